@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  bench_import_time.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measures the startup imports of BLASTats with "python -X importtime", in fresh interpreters.
+For each startup path (the modules the Gtk interface and the CLI import, and the CLI's --help), prints the best total
+import time over --repeat runs and the slowest imports of that run, then checks that the headless paths import
+neither Gtk nor heavy libraries (Biopython, NumPy, Matplotlib) before they are needed.
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RES = os.path.join(ROOT, "res")
+
+# (name, python arguments, modules that must not be imported)
+PATHS = [("gtk startup (without gi)", ["-c", "import sys; sys.path.append({!r}); import compute, jobs, output, service"
+                                              .format(RES)], ["gi", "Bio", "numpy", "matplotlib"]),
+         ("cli --help", [os.path.join(ROOT, "blastats-cli.py"), "--help"], ["gi", "Bio", "numpy", "matplotlib"]),
+         ("analysis modules", ["-c", "import sys; sys.path.append({!r}); import compute, aggregate, hit_table, sweep"
+                                     .format(RES)], ["gi"])]
+HEAVY = ("gi", "Bio", "numpy", "matplotlib")
+
+
+def import_times(arguments):
+    """
+    Runs python -X importtime with arguments. Returns {module: (self µs, cumulative µs)} for top-level imports and
+    submodules alike, and the total import time (sum of the cumulative times of top-level imports) in µs.
+    """
+
+    process = subprocess.run([sys.executable, "-X", "importtime"] + arguments, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    total = 0
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is shown by indentation: top-level imports have a single space before their name
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        modules[name] = (int(self_time), int(cumulative))
+        if depth == 0:
+            total += int(cumulative)
+    return modules, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path, the fastest one is kept")
+    parser.add_argument("--top", type=int, default=8, help="slowest imports listed per path")
+    args = parser.parse_args()
+
+    failures = 0
+    for name, arguments, forbidden in PATHS:
+        runs = [import_times(arguments) for i in range(args.repeat)]
+        modules, total = min(runs, key=lambda run: run[1])
+        print("{}: {:.1f} ms".format(name, total / 1000))
+        for module, (self_time, cumulative) in sorted(modules.items(), key=lambda item: -item[1][0])[:args.top]:
+            print("    {:<40}{:>10.1f} ms self{:>10.1f} ms cumulative".format(module, self_time / 1000,
+                                                                              cumulative / 1000))
+        imported = sorted(set(module.split(".")[0] for module in modules) & set(forbidden))
+        if imported:
+            failures += 1
+            print("    IMPORTED TOO EARLY: {}".format(", ".join(imported)))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
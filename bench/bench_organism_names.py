@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  bench_organism_names.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Checks the organism name parser against a corpus of NCBI hit titles, then measures its throughput, cold (every title
+parsed) and warm (titles repeating as they do across HSPs and re-analyses, served by the LRU cache).
+"""
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "res"))
+
+from organism_names import parse_title
+import argparse
+import time
+
+# (title, genus, species, strain)
+CORPUS = [
+    ("gi|30260195|gb|AE016877.1| Bacillus cereus ATCC 14579, complete genome",
+     "Bacillus", "cereus", "ATCC 14579"),
+    ("gi|749295452|gb|CP009686.1| Bacillus cereus strain FORC_005, complete genome",
+     "Bacillus", "cereus", "strain FORC_005"),
+    ("gi|545778205|gb|U00096.3| Escherichia coli str. K-12 substr. MG1655, complete genome",
+     "Escherichia", "coli", "str. K-12 substr. MG1655"),
+    ("gi|260682033|emb|FN545816.1| Clostridium difficile complete genome, strain M120",
+     "Clostridium", "difficile", "strain M120"),
+    ("gi|30253828|gb|AE016879.1| Bacillus anthracis str. Ames chromosome, complete genome",
+     "Bacillus", "anthracis", "str. Ames"),
+    ("gi|47118312|dbj|BA000007.2| Escherichia coli O157:H7 str. Sakai DNA, complete genome",
+     "Escherichia", "coli", "O157:H7 str. Sakai"),
+    ("gi|49328240|gb|AE017355.1| Bacillus thuringiensis serovar konkukian str. 97-27, complete genome",
+     "Bacillus", "thuringiensis", "serovar konkukian str. 97-27"),
+    ("gi|88193823|ref|NC_007795.1| Staphylococcus aureus subsp. aureus NCTC 8325 chromosome, complete genome",
+     "Staphylococcus", "aureus", "subsp. aureus NCTC 8325"),
+    ("gi|1000000001|gb|CP012345.1| Bacillus sp. FJAT-18017 genome",
+     "Bacillus", "sp.", "FJAT-18017"),
+    ("gi|33519483|emb|BX248583.1| Candidatus Blochmannia floridanus, complete genome",
+     "Blochmannia", "floridanus", ""),
+    ("gi|1000000002|gb|CP012346.1| [Clostridium] difficile strain DSM 1296, complete genome",
+     "Clostridium", "difficile", "strain DSM 1296"),
+    ("gi|16802048|ref|NC_003210.1| Listeria monocytogenes EGD-e chromosome, complete genome",
+     "Listeria", "monocytogenes", "EGD-e"),
+    ("gi|1000000003|emb|LN000001.1| Bacillus cereus genome assembly, chromosome: I",
+     "Bacillus", "cereus", ""),
+    ("gi|1000000004|gb|CP000005.1| Bacterium HF130 complete genome",
+     "Bacterium", "", "HF130"),
+    ("gi|1000000005|gb|CP000006.1| Salmonella enterica subsp. enterica serovar Typhimurium str. LT2, complete genome",
+     "Salmonella", "enterica", "subsp. enterica serovar Typhimurium str. LT2"),
+    ("gi|1000000006|gb|CP000007.1| Klebsiella pneumoniae strain KP-1 chromosome, complete genome",
+     "Klebsiella", "pneumoniae", "strain KP-1"),
+    ("gi|1000000007|gb|CP000008.1| Escherichia coli",
+     "Escherichia", "coli", ""),
+    # Descriptions without a capitalised genus: identifiers must not be taken for one
+    ("gi|1|gb|CP1.1| uncultured bacterium, complete genome",
+     "uncultured", "", "bacterium"),
+    ("gi|1000000008|gb|KF000001.1| uncultured Bacillus sp. clone B12 16S ribosomal RNA gene, partial sequence",
+     "uncultured", "", "Bacillus sp. clone B12 16S ribosomal RNA gene"),
+    ("gi|1000000009|ref|WP_000000001.1| uncultured archaeon",
+     "uncultured", "", "archaeon"),
+    ("gi|1000000010|gb|AB000001.1| bacterium enrichment culture clone 12, complete genome",
+     "bacterium", "", "enrichment culture clone 12"),
+]
+
+
+def check_corpus():
+    failures = 0
+    for title, genus, species, strain in CORPUS:
+        parsed = tuple(parse_title(title))
+        if parsed != (genus, species, strain):
+            failures += 1
+            print("MISMATCH {!r}\n  expected {}\n  got      {}".format(title, (genus, species, strain), parsed))
+    return failures
+
+
+def throughput(titles):
+    start = time.perf_counter()
+    for title in titles:
+        parse_title(title)
+    return len(titles) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--hits", type=int, default=100000, help="number of titles parsed per measure")
+    args = parser.parse_args()
+
+    failures = check_corpus()
+    print("Corpus: {}/{} titles parsed as expected".format(len(CORPUS) - failures, len(CORPUS)))
+
+    # Distinct titles defeat the cache; the corpus repeated mimics real reports
+    unique_titles = [CORPUS[i % len(CORPUS)][0].replace("|", "{}|".format(i), 1) for i in range(args.hits)]
+    repeated_titles = [CORPUS[i % len(CORPUS)][0] for i in range(args.hits)]
+
+    parse_title.cache_clear()
+    print("Cold: {:>12,.0f} titles/s".format(throughput(unique_titles)))
+    parse_title.cache_clear()
+    print("Warm: {:>12,.0f} titles/s".format(throughput(repeated_titles)))
+    print(parse_title.cache_info())
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  bench_pipeline.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks the analysis pipeline on synthetic BLAST reports, without network access.
+For each report size, times (best of --repeat runs) and measures the peak traced memory (tracemalloc) of:
+    ncbixml_read    Bio.Blast.NCBIXML.read() of the report, as BLASTats used to parse it
+    stream_parse    blast_parser.iter_hits() over the report
+    table_build     HitTable build from the report (NumPy only)
+    filter          Compute.passing_hits(), thresholds applied to the saved table or to the stream
+    fetch_organism  Compute.fetch_organism() on every hit title, name cache cleared
+    analyse         the whole Compute.analyse(), genome counts stubbed
+    record_fasta    Compute.record_fasta() of all passing hits
+    report_output   Compute.print_details() of all passing hits
+Results are saved as JSON; --compare prints the ratios to an earlier results file and exits with status 1 if any
+measure got slower than --tolerance allows.
+"""
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "res"))
+
+from blast_cache import BlastCache
+from blast_parser import iter_hits
+from compute import Compute, Console
+from genome_cache import GenomeCountCache
+from hit_table import HitTable, TABLE_SUFFIX
+from organism_names import parse_title
+from synthetic_report import write_report
+import argparse
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+
+# Slowdowns smaller than this are timing noise, whatever their ratio
+NOISE_SECONDS = 0.005
+ORGANISMS = ["Escherichia+coli", "Bacillus+cereus", "Bacillus+anthracis", "Staphylococcus+aureus"]
+
+
+def stub_genome_counts(organisms):
+    return {organism: 1000 for organism in organisms}
+
+
+def make_compute(workdir, **kwargs):
+    return Compute(Console(os.path.join(workdir, "report.txt")), list(ORGANISMS), workdir=workdir,
+                   genome_cache=GenomeCountCache(os.path.join(workdir, "genomes_cache.sqlite")),
+                   genome_fetcher=stub_genome_counts, blast_cache=BlastCache(os.path.join(workdir, "blast_cache")),
+                   **kwargs)
+
+
+def measure(func, repeat, memory):
+    """
+    Runs func (which returns the number of items it processed) repeat times, then once more under tracemalloc if
+    memory is set. Returns its best time, peak traced memory and items.
+    """
+
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        items = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return {"seconds": best, "peak_kib": peak, "items": items}
+
+
+def organisms_tree(compute, report_path):
+    """
+    Returns the {genus: {species: [(organism, sbjct)]}} tree Compute.analyse() builds from passing hits.
+    """
+
+    tree = {}
+    for hit in compute.passing_hits(report_path):
+        genus, species, strain = parse_title(hit.title)
+        tree.setdefault(genus, {}).setdefault(species, []).append((compute.fetch_organism(hit.title), hit.sbjct))
+    return tree
+
+
+def bench_size(size, workdir, repeat, memory, skip):
+    report_path = os.path.join(workdir, "blast_results.xml")
+    if not os.path.exists(report_path):
+        write_report(report_path, size)
+
+    compute = make_compute(workdir)
+    measures = {}
+
+    def ncbixml_read():
+        from Bio.Blast import NCBIXML
+        fhandle = open(report_path)
+        record = NCBIXML.read(fhandle)
+        fhandle.close()
+        return len(record.alignments)
+
+    def stream_parse():
+        return sum(1 for hit in iter_hits(report_path))
+
+    def table_build():
+        if os.path.exists(report_path + TABLE_SUFFIX):
+            os.remove(report_path + TABLE_SUFFIX)
+        return len(HitTable.for_report(report_path))
+
+    def filter_():
+        return sum(1 for hit in compute.passing_hits(report_path))
+
+    titles = [hit.title for hit in iter_hits(report_path)]
+
+    def fetch_organism():
+        parse_title.cache_clear()
+        for title in titles:
+            compute.fetch_organism(title)
+        return len(titles)
+
+    def analyse():
+        return make_compute(workdir).analyse()["total"]
+
+    tree = organisms_tree(compute, report_path)
+    names = [organism[0] for genus in tree for species in tree[genus] for organism in tree[genus][species]]
+
+    def record_fasta():
+        compute.record_fasta(tree)
+        return len(names)
+
+    def report_output():
+        compute.print_details(names)
+        return len(names)
+
+    benchmarks = [("ncbixml_read", ncbixml_read), ("stream_parse", stream_parse), ("table_build", table_build),
+                  ("filter", filter_), ("fetch_organism", fetch_organism), ("analyse", analyse),
+                  ("record_fasta", record_fasta), ("report_output", report_output)]
+    for name, func in benchmarks:
+        if name in skip or (name == "table_build" and not HitTable.available()):
+            continue
+        measures[name] = measure(func, repeat, memory)
+        print("{:>8} {:<16}{:>10.3f} s{:>12}{:>10}".format(
+            size, name, measures[name]["seconds"],
+            "-" if measures[name]["peak_kib"] is None else "{} KiB".format(measures[name]["peak_kib"]),
+            measures[name]["items"]))
+        sys.stdout.flush()
+    return measures
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the ratio of each measure to the baseline. Returns the number of measures slower than 1 + tolerance times
+    their baseline (and by more than NOISE_SECONDS).
+    """
+
+    regressions = 0
+    print("\n{:>8} {:<16}{:>12}{:>12}{:>8}".format("hits", "measure", "baseline", "current", "ratio"))
+    for size in results:
+        for name, current in results[size].items():
+            previous = baseline.get(size, {}).get(name)
+            if previous is None:
+                continue
+            ratio = current["seconds"] / previous["seconds"] if previous["seconds"] else float("inf")
+            flag = ""
+            if ratio > 1 + tolerance and current["seconds"] - previous["seconds"] > NOISE_SECONDS:
+                regressions += 1
+                flag = "  SLOWER"
+            print("{:>8} {:<16}{:>10.3f} s{:>10.3f} s{:>7.2f}x{}".format(size, name, previous["seconds"],
+                                                                         current["seconds"], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated numbers of hits")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measure, the best one is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slower) tracemalloc runs")
+    parser.add_argument("--skip", default="", help="comma-separated measures to skip, e.g. ncbixml_read")
+    parser.add_argument("--workdir", help="directory keeping the synthetic reports between runs (default: temporary)")
+    parser.add_argument("--output", default="bench_pipeline.json", help="results file to write")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown ratio above which --compare reports a regression (default: 0.2, i.e. 20%%)")
+    args = parser.parse_args()
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="blastats-bench-")
+    skip = set(args.skip.split(",")) if args.skip else set()
+
+    results = {}
+    for size in (int(size) for size in args.sizes.split(",")):
+        size_dir = os.path.join(workdir, str(size))
+        os.makedirs(size_dir, exist_ok=True)
+        results[str(size)] = bench_size(size, size_dir, args.repeat, not args.no_memory, skip)
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    import Bio
+    of_ = open(args.output, "w")
+    json.dump({"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                        "numpy": numpy_version, "biopython": Bio.__version__, "date": time.strftime("%Y-%m-%d %H:%M"),
+                        "repeat": args.repeat},
+               "results": results}, of_, indent=2, sort_keys=True)
+    of_.close()
+    print("Results saved in {}".format(args.output))
+
+    if args.compare is not None:
+        fhandle = open(args.compare)
+        baseline = json.load(fhandle)["results"]
+        fhandle.close()
+        sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  bench_strain_names.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Micro-benchmark of duplicate strain naming in Compute.analyse(): the former "while organism in total: organism += '_'"
+loop against StrainNamer, on synthetic hit names where a few species account for most hits (hundreds of
+"Escherichia coli" strains and the like).
+The former loop is worse than quadratic (about 20 seconds for 5,000 names, days for 100,000), so it is only timed up
+to --old-max names. For larger inputs, its time is extrapolated from a power law fitted on its timings at --fit-sizes,
+and shown as such.
+"""
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "res"))
+
+from compute import StrainNamer
+import argparse
+import math
+import random
+import time
+
+SPECIES = ["Escherichia coli", "Bacillus cereus", "Bacillus anthracis", "Staphylococcus aureus",
+           "Salmonella enterica", "Klebsiella pneumoniae", "Bacillus thuringiensis", "Listeria monocytogenes"]
+
+
+def synthetic_names(n, seed=0):
+    """
+    Returns n hit names: 80% bare species names (heavily duplicated), 20% named strains.
+    """
+
+    rand = random.Random(seed)
+    names = []
+    for i in range(n):
+        species = rand.choice(SPECIES)
+        if rand.random() < 0.8:
+            names.append(species)
+        else:
+            names.append("{} strain {}".format(species, rand.randint(1, n // 10 + 1)))
+    return names
+
+
+def old_naming(names):
+    total = []
+    for organism in names:
+        if organism in total:
+            while organism in total:
+                organism += "_"
+        total.append(organism)
+    return total
+
+
+def new_naming(names):
+    namer = StrainNamer()
+    return [namer.unique(organism) for organism in names]
+
+
+def timed(func, names):
+    start = time.perf_counter()
+    result = func(names)
+    return time.perf_counter() - start, result
+
+
+def fit_power_law(timings):
+    """
+    Returns (exponent, size, seconds) of the power law t = seconds * (n / size) ** exponent fitted by least squares
+    on timings, a list of (n, t), in log-log space.
+    """
+
+    xs = [math.log(size) for size, seconds in timings]
+    ys = [math.log(seconds) for size, seconds in timings]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    exponent = (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) /
+                sum((x - mean_x) ** 2 for x in xs))
+    return exponent, math.exp(mean_x), math.exp(mean_y)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated numbers of hits")
+    parser.add_argument("--old-max", type=int, default=5000, help="largest input the former loop is timed on")
+    parser.add_argument("--fit-sizes", default="500,1000,2000",
+                        help="comma-separated numbers of hits the former loop is timed on to extrapolate larger ones")
+    args = parser.parse_args()
+
+    fit_timings = [(size, timed(old_naming, synthetic_names(size))[0])
+                   for size in (int(size) for size in args.fit_sizes.split(","))]
+    exponent, fit_size, fit_time = fit_power_law(fit_timings)
+    print("Former loop: t ~ n^{:.2f}, fitted on {} hits".format(exponent, ", ".join(str(size)
+                                                                                    for size, seconds in fit_timings)))
+
+    print("{:>8} {:>14} {:>12} {:>10}".format("hits", "former (s)", "new (s)", "speedup"))
+    for size in (int(size) for size in args.sizes.split(",")):
+        names = synthetic_names(size)
+        new_time, new_result = timed(new_naming, names)
+        assert len(set(new_result)) == len(new_result)
+        if size <= args.old_max:
+            old_time, old_result = timed(old_naming, names)
+            print("{:>8} {:>14.4f} {:>12.4f} {:>9.0f}x".format(size, old_time, new_time, old_time / new_time))
+        else:
+            old_time = fit_time * (size / fit_size) ** exponent
+            print("{:>8} {:>14} {:>12.4f} {:>10}".format(size, "~{:.0f} (est.)".format(old_time), new_time,
+                                                           "~{:.0f}x".format(old_time / new_time)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  synthetic_report.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Generates synthetic tblastn XML reports, in the layout NCBI returns, for benchmarks.
+Hit titles follow the formats found in real reports (strain, str., serovar, subsp., culture collection numbers,
+bracketed genera, "chromosome, complete genome"...), a few species accounting for most hits. Scores are drawn so that
+roughly two thirds of the hits pass the default thresholds, and some hits have several HSPs or stop codons.
+"""
+
+import argparse
+import random
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+QUERY_LENGTH = 300
+
+# (species, weight): a few species make up most of the hits, as in real searches
+SPECIES = [("Escherichia coli", 30), ("Bacillus cereus", 15), ("Bacillus anthracis", 8),
+           ("Bacillus thuringiensis", 8), ("Salmonella enterica", 10), ("Klebsiella pneumoniae", 8),
+           ("Staphylococcus aureus", 8), ("Listeria monocytogenes", 4), ("Clostridium difficile", 3),
+           ("Bacillus sp.", 3), ("Pseudomonas aeruginosa", 3)]
+
+TITLE_FORMATS = ["{species} strain {strain}, complete genome",
+                 "{species} str. {strain} chromosome, complete genome",
+                 "{species} {strain}, complete genome",
+                 "{species} strain {strain} chromosome, complete genome",
+                 "{species} subsp. {species_word} str. {strain}, complete genome",
+                 "{species} serovar {serovar} str. {strain}, complete genome",
+                 "{species} ATCC {number}, complete genome",
+                 "{species} complete genome, strain {strain}",
+                 "[{genus}] {species_word} strain {strain}, complete genome",
+                 "{species} DNA, complete genome, strain: {strain}"]
+
+SEROVARS = ["Typhimurium", "Enteritidis", "Newport", "Heidelberg", "konkukian", "kurstaki"]
+
+
+def random_title(rand, i):
+    species = rand.choices([species for species, weight in SPECIES], [weight for species, weight in SPECIES])[0]
+    genus, species_word = species.split(" ", 1)
+    strain = "{}{}-{}".format(rand.choice("ABCDEFGHKMNPRSTW"), rand.choice(["", "S", "F", "K"]), rand.randint(1, 9999))
+    description = rand.choice(TITLE_FORMATS).format(species=species, genus=genus, species_word=species_word,
+                                                     strain=strain, serovar=rand.choice(SEROVARS),
+                                                     number=rand.randint(10000, 99999))
+    accession = "CP{:06d}".format(i)
+    return "gi|{}|gb|{}.1|".format(100000000 + i, accession), description, accession
+
+
+def random_hsp(rand, query):
+    """
+    Returns the fields of an HSP: most are near-identical over the whole query, some partial, weak or with stops.
+    """
+
+    kind = rand.random()
+    if kind < 0.7:
+        identity, start, end = rand.uniform(0.85, 1.0), 1, QUERY_LENGTH
+    elif kind < 0.85:
+        identity, start, end = rand.uniform(0.85, 1.0), rand.randint(1, 100), rand.randint(150, QUERY_LENGTH)
+    else:
+        identity, start, end = rand.uniform(0.3, 0.8), 1, QUERY_LENGTH
+
+    qseq = query[start - 1:end]
+    hseq = "".join(aa if rand.random() < identity else rand.choice(AMINO_ACIDS) for aa in qseq)
+    if rand.random() < 0.03:
+        position = rand.randrange(len(hseq))
+        hseq = hseq[:position] + "*" + hseq[position + 1:]
+    identities = sum(1 for q, h in zip(qseq, hseq) if q == h)
+    midline = "".join(q if q == h else "+" for q, h in zip(qseq, hseq))
+    evalue = 10 ** -rand.uniform(identity * 150, identity * 200) if identity > 0.5 else rand.uniform(1e-5, 1)
+    return {"evalue": evalue, "query_from": start, "query_to": end, "identity": identities, "align_len": len(qseq),
+            "qseq": qseq, "hseq": hseq, "midline": midline}
+
+
+def write_report(path, nb_hits, seed=0):
+    """
+    Writes a report of nb_hits hits to path.
+    """
+
+    rand = random.Random(seed)
+    query = "".join(rand.choice(AMINO_ACIDS) for i in range(QUERY_LENGTH))
+
+    of_ = open(path, "w")
+    of_.write("""<?xml version="1.0"?>
+<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" "http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">
+<BlastOutput>
+  <BlastOutput_program>tblastn</BlastOutput_program>
+  <BlastOutput_version>TBLASTN 2.2.29+</BlastOutput_version>
+  <BlastOutput_reference>Stephen F. Altschul et al., Nucleic Acids Res. 25:3389-3402.</BlastOutput_reference>
+  <BlastOutput_db>nr</BlastOutput_db>
+  <BlastOutput_query-ID>Query_1</BlastOutput_query-ID>
+  <BlastOutput_query-def>synthetic query</BlastOutput_query-def>
+  <BlastOutput_query-len>{length}</BlastOutput_query-len>
+  <BlastOutput_param>
+    <Parameters>
+      <Parameters_matrix>BLOSUM62</Parameters_matrix>
+      <Parameters_expect>10</Parameters_expect>
+      <Parameters_gap-open>11</Parameters_gap-open>
+      <Parameters_gap-extend>1</Parameters_gap-extend>
+      <Parameters_filter>F</Parameters_filter>
+    </Parameters>
+  </BlastOutput_param>
+  <BlastOutput_iterations>
+    <Iteration>
+      <Iteration_iter-num>1</Iteration_iter-num>
+      <Iteration_query-ID>Query_1</Iteration_query-ID>
+      <Iteration_query-def>synthetic query</Iteration_query-def>
+      <Iteration_query-len>{length}</Iteration_query-len>
+      <Iteration_hits>
+""".format(length=QUERY_LENGTH))
+
+    for i in range(nb_hits):
+        hit_id, description, accession = random_title(rand, i)
+        of_.write("""        <Hit>
+          <Hit_num>{num}</Hit_num>
+          <Hit_id>{hit_id}</Hit_id>
+          <Hit_def>{description}</Hit_def>
+          <Hit_accession>{accession}</Hit_accession>
+          <Hit_len>{hit_len}</Hit_len>
+          <Hit_hsps>
+""".format(num=i + 1, hit_id=hit_id, description=description, accession=accession,
+           hit_len=rand.randint(2000000, 6000000)))
+        for hsp_num in range(1, 1 + (1 if rand.random() < 0.8 else rand.randint(2, 4))):
+            hsp = random_hsp(rand, query)
+            hit_from = rand.randint(1, 1000000)
+            of_.write("""            <Hsp>
+              <Hsp_num>{num}</Hsp_num>
+              <Hsp_bit-score>{bit_score:.1f}</Hsp_bit-score>
+              <Hsp_score>{score}</Hsp_score>
+              <Hsp_evalue>{evalue:.3g}</Hsp_evalue>
+              <Hsp_query-from>{query_from}</Hsp_query-from>
+              <Hsp_query-to>{query_to}</Hsp_query-to>
+              <Hsp_hit-from>{hit_from}</Hsp_hit-from>
+              <Hsp_hit-to>{hit_to}</Hsp_hit-to>
+              <Hsp_query-frame>0</Hsp_query-frame>
+              <Hsp_hit-frame>1</Hsp_hit-frame>
+              <Hsp_identity>{identity}</Hsp_identity>
+              <Hsp_positive>{identity}</Hsp_positive>
+              <Hsp_gaps>0</Hsp_gaps>
+              <Hsp_align-len>{align_len}</Hsp_align-len>
+              <Hsp_qseq>{qseq}</Hsp_qseq>
+              <Hsp_hseq>{hseq}</Hsp_hseq>
+              <Hsp_midline>{midline}</Hsp_midline>
+            </Hsp>
+""".format(num=hsp_num, bit_score=hsp["identity"] * 2.1, score=hsp["identity"] * 5, hit_from=hit_from,
+           hit_to=hit_from + 3 * hsp["align_len"] - 1, **hsp))
+        of_.write("""          </Hit_hsps>
+        </Hit>
+""")
+
+    of_.write("""      </Iteration_hits>
+      <Iteration_stat>
+        <Statistics>
+          <Statistics_db-num>{nb_hits}</Statistics_db-num>
+          <Statistics_db-len>0</Statistics_db-len>
+          <Statistics_hsp-len>0</Statistics_hsp-len>
+          <Statistics_eff-space>0</Statistics_eff-space>
+          <Statistics_kappa>0.041</Statistics_kappa>
+          <Statistics_lambda>0.267</Statistics_lambda>
+          <Statistics_entropy>0.14</Statistics_entropy>
+        </Statistics>
+      </Iteration_stat>
+    </Iteration>
+  </BlastOutput_iterations>
+</BlastOutput>
+""".format(nb_hits=nb_hits))
+    of_.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("hits", type=int, help="number of hits")
+    parser.add_argument("output", help="report file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_report(args.output, args.hits, args.seed)
+
+
+if __name__ == "__main__":
+    main()
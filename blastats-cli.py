@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  blastats-cli.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Headless BLASTats: runs the Compute pipeline for every protein of a multi-FASTA file, in a process pool.
+Each query gets its own output directory (blast_results.xml[.gz], sequences.fa, report.txt, summary.json...), and a
+summary.json gathering all queries is written at the root of the output directory.
+With --serve, runs the BLASTats service instead (see res/service.py).
+"""
+
+import sys
+sys.path.append("{}/res".format(sys.path[0]))
+
+from aggregate import MATRIX_VALUES, aggregate
+from assembly_index import ASSEMBLY_LEVELS, COUNTED_LEVELS
+from blast_backends import ALIGNMENTS, HITLIST_SIZE, MAX_HSPS
+from compute import Compute, Console, find_report
+from fetcher import Fetcher, NCBI_RATE
+from service import SERVICE_HOST, SERVICE_PORT, WORKERS, serve
+from taxid_index import open_classifier
+from tree_render import RENDER_BACKENDS
+import sweep
+import argparse
+import json
+import multiprocessing
+import os
+import re
+
+
+def read_fasta(path):
+    """
+    Returns a list of (identifier, sequence) tuples from a multi-FASTA file.
+    """
+
+    queries = []
+    fhandle = open(path)
+    for line in fhandle:
+        line = line.strip()
+        if line.startswith(">"):
+            queries.append((line[1:].split()[0] if len(line) > 1 else "query{}".format(len(queries) + 1), []))
+        elif line and queries:
+            queries[-1][1].append(line)
+    fhandle.close()
+    return [(identifier, "".join(sequence)) for identifier, sequence in queries]
+
+
+def query_dirname(identifier):
+    return re.sub("[^\\w.-]", "_", identifier)
+
+
+def init_worker(processes):
+    """
+    Pool initializer: every worker gets its own fetcher with a share of NCBI's request rate.
+    """
+
+    Fetcher.configure_shared(rate=NCBI_RATE / processes, email=Fetcher.shared().email)
+
+
+def run_query(job):
+    """
+    Runs the pipeline for one query in its own directory. Returns (identifier, summary), summary being None if the
+    search or the analysis failed (see the query's report.txt).
+    """
+
+    identifier, seq, analyse_only, sweep_ranges, kwargs = job
+    workdir = os.path.join(kwargs.pop("outdir"), query_dirname(identifier))
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    report = os.path.join(workdir, "report.txt")
+    open(report, "w").close()
+
+    console = Console(report)
+    # A failing query must not take the others of the batch down with it
+    try:
+        compute = Compute(console, seq=seq, workdir=workdir, json_summary=True, **kwargs)
+        if analyse_only:
+            summary = compute.analyse()
+        else:
+            summary = compute.blast()
+        if summary is not None and sweep_ranges is not None:
+            summary["sweep"] = compute.sweep(*sweep_ranges)
+        if compute.render_thread is not None:
+            compute.render_thread.join()
+    except Exception as error:
+        console.print_("Error:\n{}: {}".format(type(error).__name__, error))
+        return identifier, None
+    return identifier, summary
+
+
+def write_matrix(args, queries, organisms, genomes, console):
+    """
+    Aggregates the reports of queries into a species x query matrix saved in the output directory.
+    """
+
+    taxid_index = args.taxid_index or ""
+    if taxid_index:
+        # Checked once here, so that workers need not report an unusable index for every query
+        try:
+            open_classifier(taxid_index, organisms).close()
+        except ValueError as error:
+            console.print_("Error:\n{}\nClassifying hits of the matrix by their titles.".format(error))
+            taxid_index = ""
+    reports = [(identifier, find_report(os.path.join(args.outdir, query_dirname(identifier)), args.compress_reports))
+               for identifier, seq in queries]
+    matrix = aggregate(reports, organisms, genomes, args.coverage / 100, args.identity / 100, args.evalue,
+                       args.processes, taxid_index)
+    for query in matrix.failed:
+        console.print_("{}: could not read its BLAST report, left out of the matrix".format(query))
+    if args.matrix == "npz":
+        path = os.path.join(args.outdir, "matrix.npz")
+        matrix.save_npz(path)
+    else:
+        path = os.path.join(args.outdir, "matrix.tsv")
+        matrix.write_tsv(path, args.matrix_values)
+    console.print_("{} species x {} queries matrix saved in {}".format(len(matrix.species), len(matrix.queries), path))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run BLASTats without its graphical interface.")
+    parser.add_argument("queries", nargs="?", help="multi-FASTA file of query proteins")
+    parser.add_argument("-o", "--organism", action="append", default=[],
+                        help="organism of interest as 'Genus species' (repeatable)")
+    parser.add_argument("--organisms-file", help="file with one organism of interest per line")
+    parser.add_argument("--outdir", default="results", help="output directory, one subdirectory per query")
+    parser.add_argument("--identity", type=int, default=80, help="identity threshold in %% (default: 80)")
+    parser.add_argument("--coverage", type=int, default=95, help="query coverage threshold in %% (default: 95)")
+    parser.add_argument("--evalue", type=float, default=1e-5, help="e-value threshold (default: 1e-5)")
+    parser.add_argument("--details", action="store_true", help="list all species in reports")
+    parser.add_argument("--fasta", action="store_true", help="save hits in FASTA")
+    parser.add_argument("--align-tree", action="store_true", help="align hits and build a tree (implies --fasta)")
+    parser.add_argument("--cds", action="store_true", help="retrieve CDSs instead of HSPs")
+    parser.add_argument("--dereplicate", action="store_true",
+                        help="collapse identical sequences before alignment, aligning one representative each")
+    parser.add_argument("--cluster-identity", type=int,
+                        help="with --dereplicate, also cluster sequences at least this %% identical")
+    parser.add_argument("--hitlist-size", type=int, default=HITLIST_SIZE,
+                        help="maximum number of hits per search (default: {})".format(HITLIST_SIZE))
+    parser.add_argument("--descriptions", type=int, help="number of descriptions NCBI returns (default: NCBI's)")
+    parser.add_argument("--alignments", type=int, default=ALIGNMENTS,
+                        help="number of alignments NCBI returns (default: {})".format(ALIGNMENTS))
+    parser.add_argument("--expect", type=float,
+                        help="e-value cutoff of the search itself (default: BLAST's, 10); hits above --evalue are "
+                             "never kept anyway")
+    parser.add_argument("--max-hsps", type=int, default=MAX_HSPS,
+                        help="maximum number of HSPs per hit, local BLAST only: NCBI's BLAST URL API has no such "
+                             "parameter (default: {}, only the first HSP is analysed)".format(MAX_HSPS))
+    parser.add_argument("--taxid-index",
+                        help="assign hits to species by the taxid of their accession, looked up in this index (built "
+                             "with res/taxid_index.py), instead of by their title")
+    parser.add_argument("--local-db", default="", help="local BLAST+ nucleotide database (default: BLAST at NCBI)")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="threads per query for local BLAST, ClustalOmega and FastTree")
+    parser.add_argument("--tree-backend", choices=RENDER_BACKENDS, default="phylo",
+                        help="library drawing trees: Bio.Phylo with Matplotlib (default) or the ETE toolkit")
+    parser.add_argument("--realign", action="store_true",
+                        help="align and build trees again even if the sequences did not change")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                        help="queries processed in parallel (default: number of CPUs)")
+    parser.add_argument("--analyse-only", action="store_true",
+                        help="analyse the BLAST report already in each query directory instead of BLASTing")
+    parser.add_argument("--sweep-identity", help="identity thresholds to sweep, in %%, as start:stop:step or a,b,c")
+    parser.add_argument("--sweep-coverage", help="coverage thresholds to sweep, in %%, as start:stop:step or a,b,c")
+    parser.add_argument("--sweep-evalue", help="e-value thresholds to sweep, as a,b,c")
+    parser.add_argument("--matrix", choices=["tsv", "npz"],
+                        help="also aggregate all query reports into a species x query matrix (matrix.tsv or "
+                             "matrix.npz in the output directory)")
+    parser.add_argument("--matrix-values", choices=MATRIX_VALUES, default="abundance",
+                        help="values of the TSV matrix (default: abundance, i.e. hits / sequenced genomes)")
+    parser.add_argument("--matrix-only", action="store_true",
+                        help="only aggregate the BLAST reports already in each query directory into a matrix")
+    parser.add_argument("--compress-reports", action="store_true",
+                        help="save BLAST reports gzip-compressed (blast_results.xml.gz), streamed to disk as they are "
+                             "downloaded")
+    parser.add_argument("--refresh-blast", action="store_true",
+                        help="run searches again instead of reusing cached reports of the same searches")
+    parser.add_argument("--refresh-genomes", action="store_true", help="refetch genome counts instead of using cache")
+    parser.add_argument("--assembly-summary",
+                        help="count genomes offline in this NCBI assembly_summary.txt file (indexed on first use) "
+                             "instead of fetching counts from NCBI")
+    parser.add_argument("--assembly-levels", default=",".join(COUNTED_LEVELS),
+                        help="comma-separated assembly levels counted with --assembly-summary, among {} "
+                             "(default: {})".format(", ".join(ASSEMBLY_LEVELS), ", ".join(COUNTED_LEVELS)))
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"],
+                        help="profile hit parsing and filtering, saving the results in each query directory")
+    parser.add_argument("--serve", action="store_true",
+                        help="run as a service instead: queue and analyse jobs sent over HTTP (e.g. by the Gtk "
+                             "interface), keeping caches warm between them (see res/service.py); --local-db, "
+                             "--assembly-summary and --taxid-index then apply to every job")
+    parser.add_argument("--host", default=SERVICE_HOST,
+                        help="with --serve, address to listen on (default: {}, this machine only)".format(SERVICE_HOST))
+    parser.add_argument("--port", type=int, default=SERVICE_PORT,
+                        help="with --serve, port to listen on (default: {})".format(SERVICE_PORT))
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="with --serve, analyses run in parallel (default: {})".format(WORKERS))
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.queries is None and not args.serve:
+        parser.error("the queries file is required")
+    return args
+
+
+def main():
+    args = parse_arguments()
+    if args.serve:
+        # Paths on this machine are only taken from the command line, never from clients
+        serve(args.host, args.port, args.workers, args.verbose,
+              service_options={"local_db": args.local_db, "assembly_summary": args.assembly_summary or "",
+                               "taxid_index": args.taxid_index or ""})
+        return
+
+    organisms = list(args.organism)
+    if args.organisms_file:
+        fhandle = open(args.organisms_file)
+        organisms.extend(line.strip() for line in fhandle if line.strip())
+        fhandle.close()
+    for organism in organisms:
+        if len(organism.split()) != 2:
+            sys.exit("Error: organism name must be 2 words long: '{}'".format(organism))
+    organisms = sorted(set(organism.capitalize().replace(" ", "+") for organism in organisms))
+    if not organisms:
+        sys.exit("Error: please give at least one organism of interest")
+
+    sweep_ranges = None
+    if args.sweep_identity or args.sweep_coverage or args.sweep_evalue:
+        try:
+            sweep_ranges = (sweep.parse_range(args.sweep_identity or str(args.identity), 100),
+                            sweep.parse_range(args.sweep_coverage or str(args.coverage), 100),
+                            sweep.parse_range(args.sweep_evalue or str(args.evalue)))
+        except ValueError as error:
+            sys.exit("Error: invalid sweep range: {}".format(error))
+
+    queries = read_fasta(args.queries)
+    if not queries:
+        sys.exit("Error: no sequence found in {}".format(args.queries))
+    # Each query is known by its directory: two of them sharing one would overwrite each other's files and summaries
+    dirnames = {}
+    for identifier, seq in queries:
+        if identifier in dirnames.values():
+            sys.exit("Error: query '{}' is given twice in {}".format(identifier, args.queries))
+        if query_dirname(identifier) in dirnames:
+            sys.exit("Error: queries '{}' and '{}' would share the output directory '{}', please rename one of them"
+                     .format(dirnames[query_dirname(identifier)], identifier, query_dirname(identifier)))
+        dirnames[query_dirname(identifier)] = identifier
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    # Genome counts are fetched once here, so workers all read them from the cache
+    console = Console()
+    assembly_levels = tuple(level.strip() for level in args.assembly_levels.split(","))
+    for level in assembly_levels:
+        if level not in ASSEMBLY_LEVELS:
+            sys.exit("Error: unknown assembly level '{}'".format(level))
+    # The assembly summary, if any, is indexed here once, before workers read it
+    prefetch = Compute(console, organisms, verbose=args.verbose, refresh_genomes=args.refresh_genomes,
+                       assembly_summary=args.assembly_summary or "", assembly_levels=assembly_levels)
+    genomes = prefetch.fetch_genomes_quantity()
+    organisms = prefetch.organisms_of_interest
+
+    kwargs = {"organisms": organisms,
+              "outdir": args.outdir,
+              "verbose": args.verbose,
+              "details": args.details,
+              "fasta": args.fasta or args.align_tree,
+              "align_tree": args.align_tree,
+              "cds": args.cds,
+              "dereplicate": args.dereplicate or args.cluster_identity is not None,
+              "cluster_identity": args.cluster_identity / 100 if args.cluster_identity is not None else None,
+              "identity_threshold": args.identity / 100,
+              "query_cover_threshold": args.coverage / 100,
+              "e_threshold": args.evalue,
+              "local_db": args.local_db,
+              "hitlist_size": args.hitlist_size,
+              "descriptions": args.descriptions,
+              "alignments": args.alignments,
+              "expect": args.expect,
+              "max_hsps": args.max_hsps,
+              "num_threads": args.threads,
+              "skip_unchanged": not args.realign,
+              "refresh_blast": args.refresh_blast,
+              "compress_reports": args.compress_reports,
+              "assembly_summary": args.assembly_summary or "",
+              "assembly_levels": assembly_levels,
+              "taxid_index": args.taxid_index or "",
+              "profile": args.profile,
+              "tree_backend": args.tree_backend}
+    if args.matrix_only:
+        write_matrix(args, queries, organisms, genomes, console)
+        return
+
+    jobs = [(identifier, seq, args.analyse_only, sweep_ranges, dict(kwargs, organisms=list(organisms)))
+            for identifier, seq in queries]
+
+    processes = max(1, min(args.processes, len(jobs)))
+    summaries = {}
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(processes,))
+    try:
+        for identifier, summary in pool.imap_unordered(run_query, jobs):
+            summaries[identifier] = summary
+            if summary is None:
+                console.print_("{}: failed, see {}".format(identifier, os.path.join(args.outdir,
+                                                                                  query_dirname(identifier),
+                                                                                  "report.txt")))
+            else:
+                console.print_("{}: {} hits".format(identifier, summary["total"]))
+    finally:
+        pool.close()
+        pool.join()
+
+    of_ = open(os.path.join(args.outdir, "summary.json"), "w")
+    json.dump(summaries, of_, indent=2, sort_keys=True)
+    of_.close()
+
+    if args.matrix:
+        write_matrix(args, [query for query in queries if summaries[query[0]] is not None], organisms, genomes,
+                     console)
+
+    if None in summaries.values():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,35 +24,28 @@
 # ToDo: Pickle ethresh
 # ToDo: add chromosomes to analysis (not only complete genomes), but how to build entrez query on NCBI's BLAST ?
 # ToDo: add possibility to filter by e-value.
-# ToDo: refine name fetching. For example, "Clostridium difficile complete genome, strain M120"
-#       will be treated as "Clostridium difficile"
-# ToDo: decrease number of hsps per hit in BLAST arguments
-# ToDo: enhance GUI so user can choose if aligning HSPs or retrieved CDSs
-# ToDo: capture memory overflow when parsing too big BLAST results
 # ToDo: conditional imports with try
 
 import sys
 sys.path.append("{}/res".format(sys.path[0]))
 
-# from Bio import Phylo
-from Bio import Entrez, SeqIO
-from Bio.Align.Applications import ClustalOmegaCommandline
-from Bio.Blast import NCBIWWW, NCBIXML
-from Bio.Phylo.Applications._Fasttree import FastTreeCommandline
-
 from gi.repository import Gtk, GObject, Pango
+from blast_backends import HITLIST_SIZE, MAX_HSPS
+from compute import Compute
+from jobs import JobManager, READY
+from service import ServiceError, ServiceJobManager
+from output import OutputBuffer
 import pickle
-import queue
 import re
-import subprocess
 import threading
-import urllib.request
 
 # GLOBALS
-GENOMES_URL = "http://www.ncbi.nlm.nih.gov/genome/genomes/{}"
-GENOMES_REGEX = "Complete \[(\d+)\]"
-# Settings
-Entrez.email = "sgelis@jouy.inra.fr"
+# Interval (ms) at which text written by worker threads is flushed to the output view
+OUTPUT_FLUSH_INTERVAL = 100
+# Options taken from the window when a finished job is analysed again; the others are those it was searched with
+ANALYSIS_OPTIONS = ("organisms", "verbose", "details", "fasta", "align_tree", "refresh_genomes", "cds", "dereplicate",
+                    "identity_threshold", "query_cover_threshold", "e_threshold", "num_threads", "assembly_summary",
+                    "taxid_index")
 
 
 class Iface(Gtk.Window):
@@ -129,6 +122,50 @@ class Iface(Gtk.Window):
         self.check_fasta = Gtk.CheckButton("Save results in FASTA")
         self.check_align_tree = Gtk.CheckButton("Align & Tree")
         self.check_align_tree.connect("toggled", self.on_align_tree_click)
+        self.check_refresh = Gtk.CheckButton("Refresh genome counts")
+        self.check_cds = Gtk.CheckButton("Retrieve CDSs instead of HSPs")
+        self.check_dereplicate = Gtk.CheckButton("Collapse identical sequences before alignment")
+        self.check_compress = Gtk.CheckButton("Compress BLAST reports")
+        label_threads = Gtk.Label("Threads: ")
+        label_threads.set_alignment(0, 0.5)
+        self.entry_threads = Gtk.Entry()
+        self.entry_threads.set_max_length(3)
+        self.entry_threads.set_width_chars(3)
+        self.entry_threads.set_max_width_chars(3)
+        self.entry_threads.set_halign(Gtk.Align.START)
+        self.entry_threads.set_placeholder_text("1")
+        # Search-side limits: smaller reports come back sooner from NCBI and parse faster
+        self.entries_limits = {}
+        labels_limits = []
+        for name, text, placeholder in (("hitlist_size", "Hitlist size: ", str(HITLIST_SIZE)),
+                                        ("descriptions", "Descriptions: ", "NCBI's"),
+                                        ("max_hsps", "HSPs per hit: ", str(MAX_HSPS)),
+                                        ("expect", "Search e-value: ", "10")):
+            label = Gtk.Label(text)
+            label.set_alignment(0, 0.5)
+            labels_limits.append(label)
+            entry = Gtk.Entry()
+            entry.set_width_chars(6)
+            entry.set_max_width_chars(6)
+            entry.set_halign(Gtk.Align.START)
+            entry.set_placeholder_text(placeholder)
+            self.entries_limits[name] = entry
+        label_localdb = Gtk.Label("Local database: ")
+        label_localdb.set_alignment(0, 0.5)
+        self.entry_localdb = Gtk.Entry()
+        self.entry_localdb.set_placeholder_text("None (BLAST at NCBI)")
+        label_assembly = Gtk.Label("Assembly summary: ")
+        label_assembly.set_alignment(0, 0.5)
+        self.entry_assembly = Gtk.Entry()
+        self.entry_assembly.set_placeholder_text("None (genome counts from NCBI)")
+        label_taxid = Gtk.Label("Taxid index: ")
+        label_taxid.set_alignment(0, 0.5)
+        self.entry_taxid = Gtk.Entry()
+        self.entry_taxid.set_placeholder_text("None (species from hit titles)")
+        label_service = Gtk.Label("Service URL: ")
+        label_service.set_alignment(0, 0.5)
+        self.entry_service = Gtk.Entry()
+        self.entry_service.set_placeholder_text("None (run jobs here; applied at next start)")
         grid_options.add(label_idthresh)
         grid_options.attach(label_covthresh, 0, 1, 1, 1)
         grid_options.attach(label_ethresh, 0, 2, 1, 1)
@@ -141,13 +178,30 @@ class Iface(Gtk.Window):
         grid_options.attach(self.check_list, 3, 1, 1, 1)
         grid_options.attach(self.check_fasta, 3, 2, 1, 1)
         grid_options.attach(self.check_align_tree, 3, 3, 1, 1)
+        grid_options.attach(self.check_refresh, 3, 4, 1, 1)
+        grid_options.attach(self.check_cds, 3, 5, 1, 1)
+        grid_options.attach(self.check_dereplicate, 3, 6, 1, 1)
+        grid_options.attach(self.check_compress, 3, 7, 1, 1)
+        grid_options.attach(label_threads, 0, 3, 1, 1)
+        grid_options.attach(self.entry_threads, 1, 3, 1, 1)
+        grid_options.attach(label_localdb, 0, 4, 1, 1)
+        grid_options.attach(self.entry_localdb, 1, 4, 2, 1)
+        grid_options.attach(label_assembly, 0, 5, 1, 1)
+        grid_options.attach(self.entry_assembly, 1, 5, 2, 1)
+        grid_options.attach(label_taxid, 0, 6, 1, 1)
+        grid_options.attach(self.entry_taxid, 1, 6, 2, 1)
+        for row, (label, name) in enumerate(zip(labels_limits, ("hitlist_size", "descriptions", "max_hsps", "expect"))):
+            grid_options.attach(label, 0, 7 + row, 1, 1)
+            grid_options.attach(self.entries_limits[name], 1, 7 + row, 1, 1)
+        grid_options.attach(label_service, 0, 11, 1, 1)
+        grid_options.attach(self.entry_service, 1, 11, 2, 1)
         frame_options.add(grid_options)
 
         grid_buttons = Gtk.Grid()
         button_clear = Gtk.Button("Clear output")
         button_analyse = Gtk.Button("Analyse")
         button_analyse.set_size_request(150, -1)
-        button_blast = Gtk.Button("Blast & Analyse")
+        button_blast = Gtk.Button("Submit BLAST")
         button_blast.connect("clicked", self.on_blast_click)
         button_blast.set_size_request(150, -1)
         button_analyse.connect("clicked", self.on_analyse_click)
@@ -157,12 +211,25 @@ class Iface(Gtk.Window):
         grid_buttons.attach(button_analyse, 1, 0, 1, 1)
         grid_buttons.attach(button_blast, 2, 0, 1, 1)
 
+        frame_jobs = Gtk.Frame(label="BLAST jobs")
+        scroll_jobs = Gtk.ScrolledWindow()
+        scroll_jobs.set_min_content_height(80)
+        # Job id, name, status
+        self.liststore_jobs = Gtk.ListStore(int, str, str)
+        self.treeview_jobs = Gtk.TreeView(model=self.liststore_jobs)
+        for i, title in enumerate(("#", "Sequence", "Status")):
+            self.treeview_jobs.append_column(Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i))
+        self.treeview_jobs.connect("row-activated", self.on_job_activated)
+        self.treeview_jobs.connect("button-press-event", self.on_jobs_click)
+        scroll_jobs.add(self.treeview_jobs)
+        frame_jobs.add(scroll_jobs)
+
         frame_output = Gtk.Frame(label="Output")
         self.txtview_output = Gtk.TextView()
         self.txtview_output.set_editable(False)
         self.txtview_output.modify_font(Pango.FontDescription("mono"))
         scroll_output = Gtk.ScrolledWindow()
-        scroll_output.set_min_content_height(400)
+        scroll_output.set_min_content_height(320)
         scroll_output.set_min_content_width(400)
         scroll_output.add(self.txtview_output)
         frame_output.add(scroll_output)
@@ -179,13 +246,28 @@ class Iface(Gtk.Window):
         grid.attach(grid_organisms, 0, 1, 1, 1)
         grid.attach(frame_options, 0, 2, 1, 1)
         grid.attach(grid_buttons, 0, 3, 1, 1)
-        grid.attach(frame_output, 0, 4, 1, 1)
-        grid.attach(grid_footer, 0, 5, 1, 1)
+        grid.attach(frame_jobs, 0, 4, 1, 1)
+        grid.attach(frame_output, 0, 5, 1, 1)
+        grid.attach(grid_footer, 0, 6, 1, 1)
 
         # Although list_organisms can seem redundant with liststore_organism, it allows checking for duplicates
         self.list_organisms = []
         self.read_settings()
 
+        self.output_buffer = OutputBuffer()
+        GObject.timeout_add(OUTPUT_FLUSH_INTERVAL, self.flush_output)
+
+        # Searches run in the background; the ones left pending at last exit are resumed. With a service URL, they
+        # are run and analysed by the service (see res/service.py) and this interface only displays them
+        self.service_url = self.entry_service.get_text().strip()
+        if self.service_url:
+            self.job_manager = ServiceJobManager(self.service_url, on_update=self.on_job_update)
+        else:
+            self.job_manager = JobManager(on_update=self.on_job_update)
+        for job in self.job_manager.store.jobs():
+            self.update_job_row(job)
+        self.job_manager.start()
+
     def read_settings(self):
         try:
             fhandle = open("settings", "rb")
@@ -200,6 +282,17 @@ class Iface(Gtk.Window):
             self.entry_idthresh.set_text(settings["idthresh"])
             self.entry_covthresh.set_text(settings["covthresh"])
             self.entry_ethresh.set_text(settings["ethresh"])
+            # Settings saved by older versions lack the local BLAST fields
+            self.entry_threads.set_text(settings.get("threads", ""))
+            self.entry_localdb.set_text(settings.get("local_db", ""))
+            self.entry_assembly.set_text(settings.get("assembly_summary", ""))
+            self.entry_taxid.set_text(settings.get("taxid_index", ""))
+            self.entry_service.set_text(settings.get("service_url", ""))
+            for name, entry in self.entries_limits.items():
+                entry.set_text(settings.get(name, ""))
+            self.check_cds.set_active(settings.get("cds", False))
+            self.check_dereplicate.set_active(settings.get("dereplicate", False))
+            self.check_compress.set_active(settings.get("compress_reports", False))
             for organism in settings["organisms"]:
                 self.list_organisms.append(organism)
                 self.liststore_organism.append((organism,))
@@ -208,11 +301,44 @@ class Iface(Gtk.Window):
         buf = self.txtview_output.get_buffer()
         buf.insert(buf.get_end_iter(), "{}\n".format(str(txt)))
 
+    def print_threaded(self, txt):
+        """
+        print_() for worker threads: Gtk widgets may only be touched from the main loop, so text is buffered and
+        displayed by flush_output().
+        """
+        self.output_buffer.write(txt)
+
+    def flush_output(self):
+        """
+        Timer callback inserting all buffered text in the output view at once. Returns True to keep the timer running.
+        """
+        txt = self.output_buffer.drain()
+        if txt is not None:
+            buf = self.txtview_output.get_buffer()
+            buf.insert(buf.get_end_iter(), txt)
+        return True
+
+    def show_tree(self, png_path):
+        """
+        Called by Compute.render() from its thread: displays the rendered tree in its own window.
+        """
+        GObject.idle_add(self.open_tree_window, png_path)
+
+    def open_tree_window(self, png_path):
+        window = Gtk.Window(title="BLASTats - {}".format(png_path))
+        window.set_default_size(900, 700)
+        scroll_tree = Gtk.ScrolledWindow()
+        scroll_tree.add_with_viewport(Gtk.Image.new_from_file(png_path))
+        window.add(scroll_tree)
+        window.show_all()
+        return False
+
     def help_(self, *args):
         self.clear_output()
         self.print_("For help, see http://www.gelis.ch/programs/blastats/")
 
     def clear_output(self, *args):
+        self.output_buffer.discard()
         buf = self.txtview_output.get_buffer()
         buf.set_text("")
 
@@ -238,6 +364,10 @@ class Iface(Gtk.Window):
         kwargs["details"] = self.check_list.get_active()
         kwargs["fasta"] = self.check_fasta.get_active()
         kwargs["align_tree"] = self.check_align_tree.get_active()
+        kwargs["refresh_genomes"] = self.check_refresh.get_active()
+        kwargs["cds"] = self.check_cds.get_active()
+        kwargs["dereplicate"] = self.check_dereplicate.get_active()
+        kwargs["compress_reports"] = self.check_compress.get_active()
 
         if self.entry_idthresh.get_text() != "":
             try:
@@ -266,6 +396,38 @@ class Iface(Gtk.Window):
             except ValueError:
                 self.parent.print_("Error:\nPlease provide an E-value threshold")
 
+        if self.entry_threads.get_text() != "":
+            try:
+                if int(self.entry_threads.get_text()) >= 1:
+                    kwargs["num_threads"] = int(self.entry_threads.get_text())
+                else:
+                    self.print_("Error:\nNumber of threads must be at least 1")
+            except ValueError:
+                self.print_("Error:\nPlease provide a valid number of threads")
+
+        kwargs["local_db"] = self.entry_localdb.get_text().strip()
+        kwargs["assembly_summary"] = self.entry_assembly.get_text().strip()
+        kwargs["taxid_index"] = self.entry_taxid.get_text().strip()
+
+        for name in ("hitlist_size", "descriptions", "max_hsps"):
+            if self.entries_limits[name].get_text() != "":
+                try:
+                    if int(self.entries_limits[name].get_text()) >= 1:
+                        kwargs[name] = int(self.entries_limits[name].get_text())
+                    else:
+                        self.print_("Error:\n{} must be at least 1".format(name.replace("_", " ").capitalize()))
+                except ValueError:
+                    self.print_("Error:\nPlease provide a valid {}".format(name.replace("_", " ")))
+
+        if self.entries_limits["expect"].get_text() != "":
+            try:
+                if float(self.entries_limits["expect"].get_text()) > 0:
+                    kwargs["expect"] = float(self.entries_limits["expect"].get_text())
+                else:
+                    self.print_("Error:\nSearch e-value must be positive")
+            except ValueError:
+                self.print_("Error:\nPlease provide a valid search e-value")
+
         return kwargs
 
     def on_organism_add(self, widget, event):
@@ -302,14 +464,83 @@ class Iface(Gtk.Window):
     def on_blast_click(self, *args):
         kwargs = self.fetch_arguments(check_seq=True)
         if kwargs.get("seq", "") != "":
-            compute = Compute(self, **kwargs)
+            seq = kwargs.pop("seq")
+            name = seq if len(seq) <= 20 else "{}...".format(seq[:20])
+            # Analysis options are saved with the job, so it is analysed as asked even after a restart
+            try:
+                job = self.job_manager.submit(name, seq, kwargs)
+            except ServiceError as error:
+                self.print_("Error:\n{}\n".format(error))
+                return
+            self.update_job_row(job)
             if self.check_verbose.get_active():
-                self.print_("BLASTing sequence at NCBI...")
-            threading.Thread(target=compute.blast).start()
+                self.print_("BLAST job {} queued, results will be analysed when ready.".format(job.id))
         else:
             self.print_("Error\nPlease enter a protein sequence to blast\n")
 
+    def on_job_update(self, job):
+        """
+        Called by the job manager's threads: the job list is updated from the main loop, and finished searches are
+        analysed right away (by the service, whose output is then followed, if one is used).
+        """
+        GObject.idle_add(self.update_job_row, job)
+        if job.status == READY and self.service_url:
+            self.job_manager.follow(job.id, self)
+        elif job.status == READY:
+            self.analyse_job(job)
+
+    def update_job_row(self, job):
+        status = job.status if not job.message else "{}: {}".format(job.status, job.message.split("\n")[0])
+        for row in self.liststore_jobs:
+            if row[0] == job.id:
+                row[2] = status
+                break
+        else:
+            self.liststore_jobs.append((job.id, job.name, status))
+        return False
+
+    def analyse_job(self, job, reanalyse=False):
+        """
+        Analyses a finished job with the options it was submitted with or, when analysing it again, with the
+        thresholds and other analysis options currently set in the window.
+        """
+        options = {}
+        if reanalyse:
+            kwargs = self.fetch_arguments()
+            options = {name: kwargs[name] for name in ANALYSIS_OPTIONS if name in kwargs}
+        if self.service_url:
+            self.job_manager.analyse(job.id, self, options)
+        else:
+            compute = Compute(self, workdir=job.workdir, **dict(job.options, **options))
+            threading.Thread(target=compute.analyse).start()
+
+    def reanalyse_job(self, job_id):
+        job = self.job_manager.store.get(job_id)
+        if job is not None and job.status == READY:
+            self.analyse_job(job, reanalyse=True)
+        elif job is not None:
+            self.print_("BLAST job {} is not ready ({}).".format(job.id, job.status))
+
+    def on_job_activated(self, treeview, path, column):
+        self.reanalyse_job(self.liststore_jobs[path][0])
+
+    def on_jobs_click(self, widget, event):
+        if event.button == 3:
+            # Right click removes a job from the list, as in the organisms list
+            path = self.treeview_jobs.get_path_at_pos(event.x, event.y)
+            if path is not None:
+                self.treeview_jobs.grab_focus()
+                self.treeview_jobs.set_cursor(path[0], path[1], 0)
+                model, row = self.treeview_jobs.get_selection().get_selected()
+                self.job_manager.store.remove(model[row][0])
+                self.liststore_jobs.remove(row)
+
     def on_analyse_click(self, *args):
+        # The selected job is analysed again; without one, the report of the current directory is
+        model, row = self.treeview_jobs.get_selection().get_selected()
+        if row is not None:
+            self.reanalyse_job(model[row][0])
+            return
         kwargs = self.fetch_arguments()
         compute = Compute(self, **kwargs)
         threading.Thread(target=compute.analyse).start()
@@ -334,305 +565,26 @@ class Iface(Gtk.Window):
             settings["idthresh"] = self.entry_idthresh.get_text()
             settings["covthresh"] = self.entry_covthresh.get_text()
             settings["ethresh"] = self.entry_ethresh.get_text()
+            settings["threads"] = self.entry_threads.get_text()
+            settings["local_db"] = self.entry_localdb.get_text()
+            settings["assembly_summary"] = self.entry_assembly.get_text()
+            settings["taxid_index"] = self.entry_taxid.get_text()
+            settings["service_url"] = self.entry_service.get_text()
+            for name, entry in self.entries_limits.items():
+                settings[name] = entry.get_text()
+            settings["cds"] = self.check_cds.get_active()
+            settings["dereplicate"] = self.check_dereplicate.get_active()
+            settings["compress_reports"] = self.check_compress.get_active()
             settings["organisms"] = []
             for organism in self.liststore_organism:
                 settings["organisms"].append(organism[0])
             pickle.dump(settings, fhandle)
         finally:
             fhandle.close()
+            self.job_manager.stop()
             Gtk.main_quit()
 
 
-class Compute(object):
-    """
-    Computing object.
-    The compute object takes parameters given by the interface and:
-    1) -Optional- BLASTs the protein sequence
-    2) Fetches the number of sequenced genomes at NCBI's database
-    3) Parses the BLAST's XML output to
-        3.1) find the organisms in each sequence match
-        3.2) build a tree of organisms given their genus and specie
-    4) Outputs a tree of species of interest (inputted by interface), computing for each specie the abundance of the
-       query sequence (given by the number of species listed in the matches tree under
-       [genus_of_interest][specie_of_interest]) and the fraction of sequenced organisms it represents.
-    """
-    def __init__(self, parent, organisms, seq="", verbose=False, details=False, fasta=False, align_tree=False,
-                 identity_threshold=0.8, query_cover_threshold=0.95, e_threshold=1e-5):
-        self.parent = parent
-        self.organisms_of_interest = organisms
-        self.seq = seq
-        self.verbose = verbose
-        self.details = details
-        self.fasta = fasta
-        self.align_tree = align_tree
-        self.identity_threshold = identity_threshold
-        self.query_cover_threshold = query_cover_threshold
-        self.e_threshold = e_threshold
-
-    def get_url(self, organism, q):
-        """
-        Threaded method that gets a URL and puts its content in a threaded queue.
-        """
-
-        entrez_handle = Entrez.esearch(db="genome", term="{}[Organism]".format(organism))
-        try:
-            organism_id = Entrez.read(entrez_handle)["IdList"][0]
-        except IndexError:
-            q.put((organism, None))
-        else:
-            url = GENOMES_URL.format(organism_id)
-
-        try:
-            # Decode because .read() returns a byte string while re.findall() takes unicode strings
-            page = urllib.request.urlopen(url).read().decode()
-        except urllib.request.URLError:
-            GObject.idle_add(self.parent.print_, "Error:\nCould not reach NCBI's website.\n"
-                                                 "Please check your internet connection and retry.")
-            q.put((organism, None))
-        else:
-            q.put((organism, page))
-
-    def fetch_genomes_quantity(self):
-        """
-        Returns a dictionary containing the number of sequenced genomes available at NCBI for species of interest.
-        URL requests are threaded via get_url(), and the results queue is read after all threads are done.
-        """
-
-        #genomes = {}
-        genomes = {"Bacillus+toyonensis": 1, "Bacillus+bombysepticus": 1, "Bacillus+cytotoxicus": 1}
-        q = queue.Queue()
-        threads = []
-
-        for organism in self.organisms_of_interest:
-            threads.append(threading.Thread(target=self.get_url, args=(organism, q)))
-
-        for thread in threads:
-            thread.start()
-        for thread in threads:
-            thread.join()
-
-        regex_genomes = re.compile(GENOMES_REGEX)
-
-        while not q.empty():
-            organism, page_organism = q.get()
-            if isinstance(page_organism, type(None)) or "Organism Overview" not in page_organism:
-                GObject.idle_add(self.parent.print_, "Could not find '{}' in NCBI's database. "
-                                                     "Dropping it from analysis".format(organism.replace("+", " ")))
-                self.organisms_of_interest.remove(organism)
-            else:
-                try:
-                    genomes[organism] = int(regex_genomes.findall(page_organism)[0])
-                except IndexError:
-                    GObject.idle_add(self.parent.print_, "Error fetching genomes quantity for {}. Dropping it from "
-                                                         "analysis".format(organism.replace("+", " ")))
-                    if organism != "Bacillus+toyonensis" and organism != "Bacillus+bombysepticus" and organism != "Bacillus+cytotoxicus":
-                        self.organisms_of_interest.remove(organism)
-        return genomes
-
-    @staticmethod
-    def fetch_organism(string):
-        """
-        Returns a list containing organisms names contained in BLAST match title.
-        Names are filtered to ignore names < 2 words (like "Bacillus cereus"), names containing "group" and names
-        repeated several times in a single BLAST match title.
-        """
-
-        # pattern = re.compile("\[(.*?)\]")
-        # matchlist = set()
-        # for match in pattern.findall(string):
-        #     if "group" not in match and len(match.split()) > 2:
-        #         matchlist.add(match)
-
-        organism = string.split("|")[-1].split(",")[0].lstrip()
-        if "genom" in organism:
-            organism = organism[:organism.find("genom")].rstrip()
-        if "complete" in organism:
-            organism = organism[:organism.find("complete")].rstrip()
-        if "chromosome" in organism:
-            organism = organism[:organism.find("chromosome")].rstrip()
-
-        return organism
-
-    def blast(self):
-        """
-        BLASTs protein sequence at NCBI and outputs the result in a "blast_results.xml" file in the execution directory.
-        """
-
-        try:
-            query = NCBIWWW.qblast("tblastn", "nr", self.seq, entrez_query="complete genome[Status] NOT plasmid[Title]", hitlist_size=500, alignments=1)
-        except urllib.request.URLError:
-            self.parent.print_("\nError:\nCould not reach NCBI's website.\n"
-                               "Please check your internet connection and retry.\n")
-        else:
-            of_ = open("blast_results.xml", "w")
-            of_.write(query.read())
-            of_.close()
-            query.close()
-            self.analyse()
-
-    def analyse(self):
-        """
-        Main method of the Compute object, calling the other methods sequentially and outputting the result back to the
-        interface in an ugly threaded way, via GObject.idle_add().
-        """
-        total = []
-        match_organisms_tree = {}
-        others = []
-
-        if self.verbose:
-            GObject.idle_add(self.parent.print_, "Setting identity threshold to {}".format(self.identity_threshold))
-            GObject.idle_add(self.parent.print_, "Setting query coverage threshold to {}"
-                                                 .format(self.query_cover_threshold))
-            GObject.idle_add(self.parent.print_, "Retrieving genomes quantities at NCBI...")
-
-        genomes = self.fetch_genomes_quantity()
-
-        # Pre-populate match_organisms_tree with species of interest
-        organisms_of_interest_tree = {}
-        for organism in self.organisms_of_interest:
-            genus = organism.split("+")[0].capitalize()
-            organisms_of_interest_tree.setdefault(genus, []).append(organism.split("+")[1])
-        for genus_of_interest in organisms_of_interest_tree:
-            match_organisms_tree[genus_of_interest] = {}
-            for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
-                match_organisms_tree[genus_of_interest][specie_of_interest] = []
-
-        if self.verbose:
-            GObject.idle_add(self.parent.print_, "Parsing BLAST results...")
-
-        try:
-            blast_output_file = open("blast_results.xml")
-            blast_output = NCBIXML.read(blast_output_file)
-        except FileNotFoundError:
-            self.parent.print_("\nError:\nResults file could not be found. Please BLAST a sequence and retry.\n")
-        except ValueError:
-            self.parent.print_("\nError:\nCould not read your XML results file (is it empty?). "
-                               "Please check it and retry\n")
-        else:
-
-            for match in blast_output.alignments:
-                hsp = match.hsps[0]
-                query_cover = (hsp.query_end - hsp.query_start + 1) / blast_output.query_letters
-                identity = hsp.identities / len(hsp.sbjct)
-                evalue = hsp.expect
-                if query_cover > self.query_cover_threshold and identity > self.identity_threshold and evalue < self.e_threshold \
-                and "*" not in hsp.sbjct:
-
-                    # If this organism's protein passed all filters, add it to total list and sublists
-                    organism = self.fetch_organism(match.title)
-
-                    if organism in total:
-                        while organism in total:
-                            organism += "_"
-                    
-                    total.append(organism)
-
-                    genus = organism.split()[0]
-                    specie = organism.split()[1]
-
-                    try:
-                        if self.fasta:
-                            # match_organisms_tree[genus][specie].append((organism, self.cds_from_hsp(match.title, hsp.sbjct_start)))
-                            match_organisms_tree[genus][specie].append((organism, hsp.sbjct))
-                        else:
-                            match_organisms_tree[genus][specie].append((organism,))
-                    except KeyError:
-                        others.append(organism)
-
-            for genus in match_organisms_tree:
-                for specie in match_organisms_tree[genus]:
-                    match_organisms_tree[genus][specie].sort()
-            others.sort()
-
-            GObject.idle_add(self.parent.print_, "==============================")
-            GObject.idle_add(self.parent.print_, "Total: {}\n|".format(len(total)))
-            for genus_of_interest in organisms_of_interest_tree:
-                GObject.idle_add(self.parent.print_, "|-{}".format(genus_of_interest))
-                for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
-                    nb_species_hits = len(match_organisms_tree.get(genus_of_interest, {})
-                                                              .get(specie_of_interest, []))
-                    nb_species_genomes = genomes["{}+{}".format(genus_of_interest, specie_of_interest)]
-                    abundance = nb_species_hits / nb_species_genomes
-                    GObject.idle_add(self.parent.print_, "|---{:<20}: {:3} %{:>15}/{}".format(specie_of_interest,
-                                                                                       str(round(abundance * 100)),
-                                                                                       str(nb_species_hits),
-                                                                                       str(nb_species_genomes)))
-                GObject.idle_add(self.parent.print_, "|")
-            GObject.idle_add(self.parent.print_, "|-Others: {}".format(len(others)))
-            GObject.idle_add(self.parent.print_, "==============================")
-
-            if self.details:
-                GObject.idle_add(self.parent.print_, "\n\n")
-                for genus_of_interest in organisms_of_interest_tree:
-                    GObject.idle_add(self.parent.print_, "\n{}\n=============================="
-                                                         .format(genus_of_interest))
-                    for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
-                        GObject.idle_add(self.parent.print_, "\n{}\n------------------------------"
-                                                             .format(specie_of_interest))
-                        for strain in match_organisms_tree.get(genus_of_interest, {})\
-                                                          .get(specie_of_interest, []):
-                            GObject.idle_add(self.parent.print_, strain[0])
-                GObject.idle_add(self.parent.print_, "\nOthers\n==============================")
-                for other in others:
-                    GObject.idle_add(self.parent.print_, other)
-                GObject.idle_add(self.parent.print_, "\n")
-
-            if self.fasta:
-                self.record_fasta(match_organisms_tree)
-
-            if self.align_tree:
-                self.align_and_philogeny()
-
-    def record_fasta(self, organisms_tree):
-        """
-        Retrieves CDSs that generated significant hits and saves them as FASTA in working directory.
-        """
-        try:
-            out_fasta = open("sequences.fa", "w")
-        except PermissionError:
-            GObject.idle_add(self.parent.print_, "Error while opening sequences file. Could not save them.")
-        else:
-            GObject.idle_add(self.parent.print_, "Saving results in sequences.fa")
-            for genus in organisms_tree:
-                for specie in organisms_tree[genus]:
-                    for organism in organisms_tree[genus][specie]:
-                        out_fasta.write(">{}\n{}\n\n".format(organism[0].replace(" ", "_"), organism[1]))
-
-            out_fasta.close()
-
-    def cds_from_hsp(self, title, location):
-
-        pattern = re.compile("\|(.*?)\|")
-        accession = pattern.findall(title)[-1]
-
-        handle = Entrez.efetch(db="nucleotide", id=accession, rettype="gb", seq_start=location, seq_stop=location+1)
-        record = SeqIO.read(handle, "genbank")
-        try:
-            cds = record.features[-1].qualifiers["translation"][0]
-        except KeyError:
-            return None
-        else:
-            print(title, "\n", cds, "\n\n")
-            return cds
-
-
-    def align_and_philogeny(self):
-        """
-        Aligns retrieved sequences with ClustalOmega, builds a tree with FastTree and renders it with ETE2 toolkit.
-        """
-        GObject.idle_add(self.parent.print_, "Aligning sequences with ClustalOmega...")
-        clustal_commandline = ClustalOmegaCommandline(infile="sequences.fa", outfile="sequences.aln", outfmt="fa",
-                                                      force=True, verbose=True)
-        subprocess.call(str(clustal_commandline).split())
-        GObject.idle_add(self.parent.print_, "Building tree with FastTree...")
-        fasttree_commandline = FastTreeCommandline("fasttree", input="sequences.aln", out="sequences.tree")
-        subprocess.call(str(fasttree_commandline).split())
-
-        GObject.idle_add(self.parent.print_, "All done.")
-        
-        subprocess.call(["./tree_view.py"])
-
-
 def main():
     iface = Iface()
     iface.show_all()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+#  aggregate.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Aggregation of many BLAST reports into a species x query matrix.
+Reports are parsed in parallel by a process pool, each worker counting the hits passing the same thresholds as
+Compute.analyse() for every species of interest (vectorized over the report's HitTable when NumPy is available), and
+assigning hits to species by the taxid of their accession when a taxid index is given, as Compute.analyse() does.
+Genome counts are given once for all reports, so abundances (hits / sequenced genomes) need no further request.
+"""
+
+import multiprocessing
+
+from blast_parser import filter_hits, iter_hits, open_report
+from hit_table import HitTable, load_numpy
+from organism_names import parse_title
+from taxid_index import open_classifier
+
+MATRIX_VALUES = ("hits", "abundance", "presence")
+
+
+def report_counts(job):
+    """
+    Pool worker: returns (query, counts, total) for a (query, report_path, thresholds, taxid_index, organisms) job,
+    counts being a {(genus, species): passing hits} dictionary over all species of the report and thresholds a
+    (query_cover, identity, evalue) tuple. counts is None if the report could not be read. Without a taxid_index,
+    hits are assigned to species by their titles only.
+    """
+
+    query, report_path, (query_cover_threshold, identity_threshold, e_threshold), taxid_index, organisms = job
+    counts = {}
+    classifier = None
+    try:
+        if taxid_index:
+            classifier = open_classifier(taxid_index, organisms)
+        if HitTable.available():
+            table = HitTable.for_report(report_path)
+            numpy = load_numpy()
+            mask = table.mask(query_cover_threshold, identity_threshold, e_threshold)
+            if classifier is not None:
+                # Hits are classified one by one, by the taxid of their accession
+                for row in numpy.flatnonzero(mask).tolist():
+                    key = classifier.classify(table.string("accession", row), str(table.name("genus", row)),
+                                              str(table.name("species", row)))
+                    counts[key] = counts.get(key, 0) + 1
+                return query, counts, sum(counts.values())
+            # One key per (genus, species) pair of codes
+            nb_species = len(table.names["species"])
+            keys = table.columns["genus"][mask].astype("i8") * nb_species + table.columns["species"][mask]
+            for key, count in zip(*numpy.unique(keys, return_counts=True)):
+                genus, species = divmod(int(key), nb_species)
+                counts[(str(table.names["genus"][genus]), str(table.names["species"][species]))] = int(count)
+        else:
+            fhandle = open_report(report_path)
+            try:
+                for hit in filter_hits(iter_hits(fhandle), query_cover_threshold, identity_threshold, e_threshold):
+                    name = parse_title(hit.title)
+                    key = (name.genus, name.species)
+                    if classifier is not None:
+                        key = classifier.classify(hit.accession, name.genus, name.species)
+                    counts[key] = counts.get(key, 0) + 1
+            finally:
+                fhandle.close()
+    except (OSError, ValueError):
+        return query, None, 0
+    finally:
+        if classifier is not None:
+            classifier.close()
+    return query, counts, sum(counts.values())
+
+
+class Matrix(object):
+    """
+    Species x query matrix. species are organisms of interest as Compute stores them ("Genus+species"), hits[i][j]
+    the number of hits of species[i] passing the thresholds in the report of queries[j], genomes[i] the number of
+    sequenced genomes of species[i] and totals[j] the number of passing hits of all species in queries[j].
+    Queries whose report could not be read are listed in failed and left out of the matrix.
+    """
+    def __init__(self, species, queries, hits, genomes, totals, failed):
+        self.species = species
+        self.queries = queries
+        self.hits = hits
+        self.genomes = genomes
+        self.totals = totals
+        self.failed = failed
+
+    def value(self, i, j, values="abundance"):
+        if values == "hits":
+            return self.hits[i][j]
+        elif values == "presence":
+            return 1 if self.hits[i][j] else 0
+        return self.hits[i][j] / self.genomes[i] if self.genomes[i] else 0.
+
+    def write_tsv(self, path, values="abundance"):
+        """
+        Writes one line per species (name, genomes quantity, then one column per query) and a last line of totals.
+        """
+
+        of_ = open(path, "w")
+        of_.write("\t".join(["species", "genomes"] + self.queries) + "\n")
+        for i, specie in enumerate(self.species):
+            fields = [specie.replace("+", " "), str(self.genomes[i])]
+            if values == "abundance":
+                fields.extend("{:.4f}".format(self.value(i, j, values)) for j in range(len(self.queries)))
+            else:
+                fields.extend(str(self.value(i, j, values)) for j in range(len(self.queries)))
+            of_.write("\t".join(fields) + "\n")
+        of_.write("\t".join(["Total", ""] + [str(total) for total in self.totals]) + "\n")
+        of_.close()
+
+    def save_npz(self, path):
+        """
+        Saves the matrix as compressed NumPy arrays: hits (species x queries, int32), genomes, totals, species and
+        queries. Abundances are hits / genomes[:, None].
+        """
+
+        numpy = load_numpy()
+        if numpy is None:
+            raise RuntimeError("NumPy is needed to save matrices in binary format")
+        numpy.savez_compressed(path, hits=numpy.array(self.hits, dtype="i4").reshape(len(self.species),
+                                                                                     len(self.queries)),
+                               genomes=numpy.array(self.genomes, dtype="i4"),
+                               totals=numpy.array(self.totals, dtype="i4"),
+                               species=numpy.array(self.species, dtype=str),
+                               queries=numpy.array(self.queries, dtype=str))
+
+
+def aggregate(reports, organisms, genomes, query_cover_threshold=0.95, identity_threshold=0.8, e_threshold=1e-5,
+              processes=None, taxid_index=""):
+    """
+    Returns the Matrix of reports, a list of (query, report_path), for organisms ("Genus+species"), genomes being the
+    {organism: genomes quantity} dictionary returned by Compute.fetch_genomes_quantity(). Reports are parsed by
+    processes workers (one per CPU by default). taxid_index is the path of a taxid index (see taxid_index.py) with
+    its taxonomy; each worker opens it on its own.
+    """
+
+    thresholds = (query_cover_threshold, identity_threshold, e_threshold)
+    jobs = [(query, report_path, thresholds, taxid_index, organisms) for query, report_path in reports]
+    processes = max(1, min(processes or multiprocessing.cpu_count(), len(jobs) or 1))
+
+    results = {}
+    if processes == 1:
+        for job in jobs:
+            query, counts, total = report_counts(job)
+            results[query] = (counts, total)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for query, counts, total in pool.imap_unordered(report_counts, jobs):
+                results[query] = (counts, total)
+        finally:
+            pool.close()
+            pool.join()
+
+    species = sorted(organisms)
+    queries = [query for query, report_path in reports if results[query][0] is not None]
+    failed = [query for query, report_path in reports if results[query][0] is None]
+    hits = []
+    for specie in species:
+        genus, specie_name = specie.split("+")
+        key = (genus.capitalize(), specie_name)
+        hits.append([results[query][0].get(key, 0) for query in queries])
+    return Matrix(species, queries, hits, [genomes[specie] for specie in species],
+                  [results[query][1] for query in queries], failed)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+#
+#  assembly_index.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Offline genome counts, read from NCBI's assembly summary files (assembly_summary.txt, from
+ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/, plain or gzip-compressed).
+A summary is imported once into a SQLite index saved next to it as "<summary>.sqlite", holding the number of current
+assemblies per species and assembly level. Counting the genomes of hundreds of species then takes a single indexed
+query, needs no network access and always gives the same answer for the same snapshot of the summary.
+"""
+
+import gzip
+import os
+import sqlite3
+
+from organism_names import parse_title
+
+# Bump when the layout, or the way species are derived from organism names, changes: older indexes are then rebuilt
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".sqlite"
+ASSEMBLY_LEVELS = ("Complete Genome", "Chromosome", "Scaffold", "Contig")
+# Only complete genomes are counted by default, as on NCBI's genome pages
+COUNTED_LEVELS = ("Complete Genome",)
+# Columns of assembly_summary.txt, used when the file has no header line
+DEFAULT_COLUMNS = {"organism_name": 7, "version_status": 10, "assembly_level": 11}
+# SQLite allows 999 parameters per statement in older versions
+MAX_PARAMETERS = 500
+
+
+def species_key(organism_name):
+    """
+    Returns the species of an assembly's organism name as Compute stores organisms ("Genus+species"), or None if the
+    name has no species epithet.
+    """
+
+    genus, species, strain = parse_title(organism_name)
+    if not species:
+        return None
+    return "{}+{}".format(genus.capitalize(), species)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return "{} {} {}".format(INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+
+
+class AssemblyIndex(object):
+    """
+    SQLite index of genome counts per species and assembly level, built from an assembly summary file.
+    A connection is opened for each call, so a single index can be shared by the interface and worker threads.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_summary(cls, summary_path):
+        """
+        Returns the index of summary_path, importing the summary first if it has no index yet or was modified since.
+        """
+
+        index = cls(summary_path + INDEX_SUFFIX)
+        stamp = _stamp(summary_path)
+        if index.stamp() != stamp:
+            index.build(summary_path, stamp)
+        return index
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def stamp(self):
+        """
+        Returns the stamp of the summary the index was built from, or None if there is no usable index.
+        """
+
+        if not os.path.exists(self.path):
+            return None
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+        connection.close()
+        return None if row is None else row[0]
+
+    def build(self, summary_path, stamp=None):
+        """
+        Imports summary_path, replacing the index. Only current assemblies ("latest" version status) are counted.
+        The index is built in a temporary file renamed once complete, so concurrent readers never see a partial one.
+        """
+
+        counts = {}
+        for organism_name, level in _read_summary(summary_path):
+            species = species_key(organism_name)
+            if species is not None:
+                counts[(species, level)] = counts.get((species, level), 0) + 1
+
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        connection = sqlite3.connect(tmp_path)
+        with connection:
+            connection.execute("CREATE TABLE genomes (species TEXT NOT NULL, level TEXT NOT NULL, "
+                               "quantity INTEGER NOT NULL, PRIMARY KEY (species, level)) WITHOUT ROWID")
+            connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.executemany("INSERT INTO genomes (species, level, quantity) VALUES (?, ?, ?)",
+                                   [(species, level, quantity) for (species, level), quantity in counts.items()])
+            connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                   [("stamp", stamp if stamp is not None else _stamp(summary_path)),
+                                    ("summary", os.path.abspath(summary_path))])
+        connection.close()
+        os.replace(tmp_path, self.path)
+
+    def counts(self, organisms, levels=COUNTED_LEVELS):
+        """
+        Returns an {organism: quantity} dictionary of the number of assemblies of organisms ("Genus+species") at
+        levels, quantity being None for organisms without any, like Compute.fetch_genome_counts().
+        """
+
+        organisms = list(organisms)
+        counts = dict.fromkeys(organisms)
+        connection = self._connect()
+        for start in range(0, len(organisms), MAX_PARAMETERS):
+            chunk = organisms[start:start + MAX_PARAMETERS]
+            query = ("SELECT species, SUM(quantity) FROM genomes WHERE species IN ({}) AND level IN ({}) "
+                     "GROUP BY species".format(",".join("?" * len(chunk)), ",".join("?" * len(levels))))
+            for species, quantity in connection.execute(query, chunk + list(levels)):
+                counts[species] = quantity or None
+        connection.close()
+        return counts
+
+
+def _read_summary(path):
+    """
+    Yields (organism name, assembly level) for every current assembly of the summary file at path.
+    """
+
+    if path.endswith(".gz"):
+        fhandle = gzip.open(path, "rt", encoding="utf-8")
+    else:
+        fhandle = open(path, encoding="utf-8")
+    columns = DEFAULT_COLUMNS
+    try:
+        for line in fhandle:
+            if line.startswith("#"):
+                # The last comment line names the columns: "# assembly_accession\tbioproject\t..."
+                names = [name.strip() for name in line.lstrip("#").split("\t")]
+                if all(name in names for name in DEFAULT_COLUMNS):
+                    columns = {name: names.index(name) for name in DEFAULT_COLUMNS}
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) <= max(columns.values()) or fields[columns["version_status"]] != "latest":
+                continue
+            yield fields[columns["organism_name"]], fields[columns["assembly_level"]]
+    finally:
+        fhandle.close()
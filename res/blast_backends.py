@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+#  blast_backends.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+BLAST search backends.
+Every backend exposes a run(seq, out_path) method writing a BLAST XML report to out_path, so Compute.analyse() does
+not need to know where the search actually ran. Reports are gzip-compressed when out_path ends with ".gz".
+"""
+
+import glob
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+from blast_parser import copy_report
+from fetcher import Fetcher, FetchError
+
+# Can be pointed to a local stand-in server, e.g. for tests
+BLAST_URL = os.environ.get("BLASTATS_BLAST_URL", "https://blast.ncbi.nlm.nih.gov/Blast.cgi")
+ENTREZ_QUERY = "complete genome[Status] NOT plasmid[Title]"
+# NCBI asks not to poll a search more than once a minute
+POLL_INTERVAL = 60
+# Report size limits. Only the first HSP of each hit is analysed, so one is enough (BLAST+ only: the BLAST URL API
+# has no such parameter). Descriptions and expect left to None keep NCBI's defaults
+HITLIST_SIZE = 500
+ALIGNMENTS = 1
+MAX_HSPS = 1
+SEARCH_LIMITS = ("hitlist_size", "descriptions", "alignments", "expect", "max_hsps")
+
+
+def normalize_seq(seq):
+    """
+    Returns seq without whitespace and in upper case, so equivalent queries share cached reports.
+    """
+
+    return "".join(seq.split()).upper()
+
+
+class BlastError(Exception):
+    """
+    Raised by backends when a search could not be run. The message is meant to be shown to the user as is.
+    """
+    pass
+
+
+class BlastConnectionError(BlastError):
+    """
+    Raised by RemoteBlast when NCBI could not be reached: unlike other BlastErrors, trying again later may succeed.
+    """
+    pass
+
+
+class RemoteBlast(object):
+    """
+    Searches NCBI's databases through the BLAST URL API (the protocol NCBIWWW.qblast() speaks), with every request,
+    including status polling, going through the shared Fetcher.
+    max_hsps is accepted for symmetry with LocalBlast but cannot be sent: the URL API has no such parameter.
+    """
+    def __init__(self, program="tblastn", database="nr", entrez_query=ENTREZ_QUERY, hitlist_size=HITLIST_SIZE,
+                 alignments=ALIGNMENTS, descriptions=None, expect=None, max_hsps=None, fetcher=None, url=BLAST_URL,
+                 poll_interval=POLL_INTERVAL):
+        self.program = program
+        self.database = database
+        self.entrez_query = entrez_query
+        self.hitlist_size = hitlist_size
+        self.alignments = alignments
+        self.descriptions = descriptions
+        self.expect = expect
+        self.fetcher = fetcher if fetcher is not None else Fetcher.shared()
+        self.url = url
+        self.poll_interval = poll_interval
+
+    def describe(self):
+        return "at NCBI"
+
+    def search_key(self, seq):
+        """
+        Returns what determines the report of a search of seq, for BlastCache.
+        """
+
+        return {"backend": "remote", "url": self.url, "program": self.program, "database": self.database,
+                "seq": normalize_seq(seq), "entrez_query": self.entrez_query, "hitlist_size": self.hitlist_size,
+                "alignments": self.alignments, "descriptions": self.descriptions, "expect": self.expect}
+
+    def submit(self, seq):
+        """
+        Submits a search and returns (RID, estimated seconds before results are ready).
+        """
+
+        params = {"CMD": "Put", "PROGRAM": self.program, "DATABASE": self.database, "QUERY": seq,
+                  "ENTREZ_QUERY": self.entrez_query, "HITLIST_SIZE": self.hitlist_size,
+                  "ALIGNMENTS": self.alignments, "TOOL": self.fetcher.tool}
+        if self.descriptions is not None:
+            params["DESCRIPTIONS"] = self.descriptions
+        if self.expect is not None:
+            params["EXPECT"] = self.expect
+        if self.fetcher.email is not None:
+            params["EMAIL"] = self.fetcher.email
+        page = self._call(data=params)
+
+        rid = re.search("RID = (\\S+)", page)
+        rtoe = re.search("RTOE = (\\d+)", page)
+        if rid is None:
+            raise BlastError("NCBI did not accept the search.")
+        return rid.group(1), int(rtoe.group(1)) if rtoe is not None else self.poll_interval
+
+    def status(self, rid):
+        """
+        Returns the status of search rid: "WAITING", "READY", "FAILED" or "UNKNOWN" (expired or never submitted).
+        """
+
+        page = self._call(params={"CMD": "Get", "FORMAT_OBJECT": "SearchInfo", "RID": rid})
+        status = re.search("Status=(\\w+)", page)
+        return status.group(1) if status is not None else "UNKNOWN"
+
+    def fetch(self, rid, out_path):
+        """
+        Downloads the XML report of a finished search to out_path, streaming it to disk (and compressing it if
+        out_path ends with ".gz") rather than holding it in memory.
+        """
+
+        try:
+            self.fetcher.download(self.url, out_path, params={"CMD": "Get", "FORMAT_TYPE": "XML", "RID": rid},
+                                  compress=out_path.endswith(".gz"))
+        except FetchError:
+            raise BlastConnectionError("Could not reach NCBI's website.\n"
+                                       "Please check your internet connection and retry.")
+
+    def run(self, seq, out_path):
+        rid, wait = self.submit(seq)
+        while True:
+            time.sleep(wait)
+            status = self.status(rid)
+            if status == "READY":
+                break
+            elif status != "WAITING":
+                raise BlastError("NCBI search {} ended with status {}.".format(rid, status))
+            wait = self.poll_interval
+        self.fetch(rid, out_path)
+
+    def _call(self, params=None, data=None):
+        try:
+            return self.fetcher.get(self.url, params=params, data=data).decode()
+        except FetchError:
+            raise BlastConnectionError("Could not reach NCBI's website.\n"
+                                       "Please check your internet connection and retry.")
+
+
+class LocalBlast(object):
+    """
+    Searches a local nucleotide database (built with "makeblastdb -dbtype nucl") with a BLAST+ executable.
+    descriptions and alignments only apply to BLAST+'s text output and are ignored: the XML report holds hitlist_size
+    hits.
+    """
+    def __init__(self, database, program="tblastn", num_threads=1, hitlist_size=HITLIST_SIZE, alignments=None,
+                 descriptions=None, expect=None, max_hsps=MAX_HSPS):
+        self.database = database
+        self.program = program
+        self.num_threads = num_threads
+        self.hitlist_size = hitlist_size
+        self.expect = expect
+        self.max_hsps = max_hsps
+
+    def describe(self):
+        return "locally against {}".format(self.database)
+
+    def search_key(self, seq):
+        """
+        Returns what determines the report of a search of seq, for BlastCache. The modification time of the database
+        files is included, so reports are not reused once the database is rebuilt.
+        """
+
+        db_files = glob.glob("{}.*".format(self.database))
+        return {"backend": "local", "program": self.program, "database": os.path.abspath(self.database),
+                "database_mtime": max([os.path.getmtime(path) for path in db_files] or [0]),
+                "seq": normalize_seq(seq), "hitlist_size": self.hitlist_size, "expect": self.expect,
+                "max_hsps": self.max_hsps}
+
+    def run(self, seq, out_path):
+        # BLAST+ reads queries from a file, so the sequence goes through a temporary FASTA
+        query_file = tempfile.NamedTemporaryFile("w", suffix=".fa", delete=False)
+        query_file.write(">query\n{}\n".format(seq))
+        query_file.close()
+
+        # BLAST+ cannot compress its output: compressed reports are written in full first, then compressed
+        compress = out_path.endswith(".gz")
+        blast_out = out_path[:-len(".gz")] if compress else out_path
+        command = [self.program, "-query", query_file.name, "-db", self.database, "-out", blast_out,
+                   "-outfmt", "5", "-max_target_seqs", str(self.hitlist_size), "-num_threads", str(self.num_threads)]
+        if self.expect is not None:
+            command.extend(["-evalue", str(self.expect)])
+        if self.max_hsps is not None:
+            command.extend(["-max_hsps", str(self.max_hsps)])
+        try:
+            subprocess.check_output(command, stderr=subprocess.STDOUT, universal_newlines=True)
+        except FileNotFoundError:
+            raise BlastError("Could not find the '{}' executable. Please install BLAST+ and retry."
+                             .format(self.program))
+        except subprocess.CalledProcessError as error:
+            raise BlastError("Local BLAST failed:\n{}".format(error.output.strip()))
+        finally:
+            os.remove(query_file.name)
+        if compress:
+            copy_report(blast_out, out_path)
+            os.remove(blast_out)
+
+
+def make_backend(local_db="", num_threads=1, fetcher=None, url=BLAST_URL, poll_interval=POLL_INTERVAL, **limits):
+    """
+    Returns the search backend: a local BLAST+ run if a local database is given, NCBI's qblast otherwise.
+    limits are report size limits (see SEARCH_LIMITS), defaults being kept for those not given.
+    """
+
+    if local_db:
+        return LocalBlast(local_db, num_threads=num_threads, **limits)
+    return RemoteBlast(fetcher=fetcher, url=url, poll_interval=poll_interval, **limits)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+#  blast_cache.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Content-addressed cache of BLAST XML reports.
+A report is stored under the SHA-256 of everything that determines it (see the backends' search_key()), so running the
+same search again, from any working directory, reuses it instead of querying NCBI. The cache is bounded in size: when
+it grows over max_bytes, the least recently used reports are evicted, a file's modification time recording its last
+use. Reports are stored gzip-compressed, and handed out compressed or not depending on the name asked for.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from blast_parser import copy_report
+
+CACHE_DIR = "blast_cache"
+# 512 MiB, a few hundred reports of 500 hits
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class BlastCache(object):
+    """
+    Directory of "<key>.xml.gz" reports, safe to share between threads and processes: reports are written to a temporary
+    file then renamed, and files vanishing during eviction are ignored.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(search):
+        """
+        Returns the cache key of search, a JSON-serialisable description of a BLAST run.
+        """
+
+        return hashlib.sha256(json.dumps(search, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.xml.gz".format(key))
+
+    def get(self, key, out_path):
+        """
+        Copies the report cached under key to out_path and returns True, or returns False if there is none.
+        The copy is compressed if out_path ends with ".gz", plain XML otherwise. Uncompressed "<key>.xml" reports
+        cached by earlier versions are still found.
+        """
+
+        for path in (self._path(key), self._path(key)[:-len(".gz")]):
+            try:
+                copy_report(path, out_path)
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def put(self, key, report_path):
+        """
+        Stores a compressed copy of the report at report_path under key, then evicts old reports if needed.
+        """
+
+        path = self._path(key)
+        # Threads of one process (the job manager's, the service's workers) may store the same report at once
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        copy_report(report_path, tmp_path, compress=True)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used reports until the cache fits in max_bytes.
+        """
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".xml.gz", ".xml")):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+#  blast_parser.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Streaming reader for BLAST XML reports.
+
+NCBIXML.read() builds the whole report in memory before returning. The functions below walk the report with
+ElementTree.iterparse() instead and yield hits one at a time, keeping only the first HSP of each hit (the only one
+BLASTats uses). Every finished <Hit> element is dropped from the tree, so memory stays flat whatever the report size.
+Reports may be stored gzip-compressed ("blast_results.xml.gz"): open_report() recognises them by their magic number
+and decompresses them on the fly, so compressed reports are streamed just the same.
+"""
+
+from collections import namedtuple
+import gzip
+import shutil
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Level 6 compresses XML reports almost as well as 9 in a fraction of the time
+COMPRESS_LEVEL = 6
+CHUNK_SIZE = 1024 * 1024
+
+# Only the first HSP of each hit is kept, as in Compute.analyse()
+Hit = namedtuple("Hit", ["title", "accession", "query_cover", "identity", "evalue", "sbjct", "sbjct_start",
+                         "sbjct_end"])
+
+
+class BlastParseError(ValueError):
+    """
+    Raised when a BLAST XML report is empty, truncated or not a BLAST report at all.
+    Subclasses ValueError so callers catching NCBIXML's errors keep working.
+    """
+    pass
+
+
+def is_compressed(path):
+    """
+    Tells whether the report at path is gzip-compressed, whatever its name.
+    """
+
+    fhandle = open(path, "rb")
+    magic = fhandle.read(len(GZIP_MAGIC))
+    fhandle.close()
+    return magic == GZIP_MAGIC
+
+
+def open_report(path):
+    """
+    Opens the report at path for binary reading, decompressing it on the fly if it is gzip-compressed.
+    """
+
+    if is_compressed(path):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def copy_report(src_path, dst_path, compress=None):
+    """
+    Copies the report at src_path to dst_path in chunks, compressed or not whatever the format of the source.
+    Unless compress is given, the copy is compressed if dst_path ends with ".gz".
+    """
+
+    if compress is None:
+        compress = dst_path.endswith(".gz")
+    if is_compressed(src_path) == compress:
+        shutil.copyfile(src_path, dst_path)
+        return
+    fhandle = open_report(src_path)
+    try:
+        if compress:
+            of_ = gzip.open(dst_path, "wb", compresslevel=COMPRESS_LEVEL)
+        else:
+            of_ = open(dst_path, "wb")
+        try:
+            shutil.copyfileobj(fhandle, of_, CHUNK_SIZE)
+        finally:
+            of_.close()
+    finally:
+        fhandle.close()
+
+
+def iter_hits(fhandle):
+    """
+    Yields a Hit for each match of a BLAST XML report, as soon as its closing tag has been read.
+    fhandle can be a file name, compressed reports being then decompressed on the fly, or a binary/text file object.
+    """
+
+    if isinstance(fhandle, str):
+        fhandle = open_report(fhandle)
+        try:
+            for hit in iter_hits(fhandle):
+                yield hit
+        finally:
+            fhandle.close()
+        return
+
+    query_letters = None
+    hits_parent = None
+    hit_id = hit_def = accession = None
+    hsp = None
+    nb_hsps = 0
+
+    try:
+        for event, elem in ElementTree.iterparse(fhandle, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == "Iteration_hits":
+                    hits_parent = elem
+                elif tag == "Hit":
+                    hit_id = hit_def = accession = None
+                    hsp = None
+                    nb_hsps = 0
+                continue
+
+            if tag in ("BlastOutput_query-len", "Iteration_query-len"):
+                query_letters = int(elem.text)
+            elif tag == "Hit_id":
+                hit_id = elem.text
+            elif tag == "Hit_def":
+                hit_def = elem.text
+            elif tag == "Hit_accession":
+                accession = elem.text
+            elif tag == "Hsp":
+                nb_hsps += 1
+                if nb_hsps == 1:
+                    hsp = {child.tag: child.text for child in elem}
+                # Further HSPs are never used: forget them straight away
+                elem.clear()
+            elif tag == "Hit":
+                if hsp is not None:
+                    yield _build_hit(hit_id, hit_def, accession, hsp, query_letters)
+                elem.clear()
+                if hits_parent is not None:
+                    hits_parent.remove(elem)
+    except ElementTree.ParseError as error:
+        raise BlastParseError("Could not parse BLAST XML report: {}".format(error))
+    except (EOFError, zlib.error) as error:
+        raise BlastParseError("Truncated or corrupt compressed BLAST report: {}".format(error))
+
+    if query_letters is None:
+        raise BlastParseError("Not a BLAST XML report (no query length found)")
+
+
+def _build_hit(hit_id, hit_def, accession, hsp, query_letters):
+    """
+    Converts the raw text fields of a hit and its first HSP into a Hit.
+    Title follows Biopython's convention ("<Hit_id> <Hit_def>") so fetch_organism() behaves the same.
+    """
+
+    if query_letters is None:
+        raise BlastParseError("Hit found before query length in BLAST XML report")
+
+    sbjct = hsp.get("Hsp_hseq") or ""
+    query_start = int(hsp["Hsp_query-from"])
+    query_end = int(hsp["Hsp_query-to"])
+    identities = int(hsp["Hsp_identity"])
+
+    return Hit(title="{} {}".format(hit_id, hit_def),
+               accession=accession,
+               query_cover=(query_end - query_start + 1) / query_letters,
+               identity=identities / len(sbjct) if sbjct else 0.,
+               evalue=float(hsp["Hsp_evalue"]),
+               sbjct=sbjct,
+               sbjct_start=int(hsp["Hsp_hit-from"]),
+               sbjct_end=int(hsp["Hsp_hit-to"]))
+
+
+def filter_hits(hits, query_cover_threshold, identity_threshold, e_threshold):
+    """
+    Yields hits passing coverage, identity and e-value thresholds and whose subject sequence contains no stop codon.
+    """
+
+    for hit in hits:
+        if hit.query_cover > query_cover_threshold and hit.identity > identity_threshold \
+                and hit.evalue < e_threshold and "*" not in hit.sbjct:
+            yield hit
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+#  cds.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Retrieval of the CDSs that generated BLAST hits.
+Only the region of each hit is downloaded (efetch with seq_start and seq_stop), as GenBank records of whole genomes
+hold thousands of CDSs: hits close to each other on a record (within MAX_REGION bases) share a single region, and
+regions are fetched in parallel by the fetcher. The CDS features of each region are matched against hit locations.
+Results are memoized in a SQLite database keyed by accession and location, as GenBank records do not change under a
+given accession.
+"""
+
+import io
+import sqlite3
+
+from fetcher import FetchError
+
+CDS_CACHE_PATH = "cds_cache.sqlite"
+# Largest region fetched at once, in bases: about ten CDSs of a bacterial genome
+MAX_REGION = 10000
+
+
+def regions(locations, max_region=MAX_REGION):
+    """
+    Groups the locations of a record into (start, stop, locations) regions spanning at most max_region bases, or a
+    single location when it is longer.
+    """
+
+    groups = []
+    for location in sorted(locations, key=lambda location: min(location[1:])):
+        start, stop = min(location[1:]), max(location[1:])
+        if groups and max(groups[-1][1], stop) - groups[-1][0] < max_region:
+            groups[-1] = (groups[-1][0], max(groups[-1][1], stop), groups[-1][2] + [location])
+        else:
+            groups.append((start, stop, [location]))
+    return groups
+
+
+class CdsRetriever(object):
+    """
+    Fetches CDS translations for (accession, start, end) hit locations, start and end being the subject coordinates of
+    the HSP (start > end on the minus strand).
+    """
+    def __init__(self, fetcher, cache_path=CDS_CACHE_PATH, max_region=MAX_REGION):
+        self.fetcher = fetcher
+        self.cache_path = cache_path
+        self.max_region = max_region
+
+        connection = self._connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS cds (accession TEXT, start INTEGER, end INTEGER, "
+                               "translation TEXT, PRIMARY KEY (accession, start, end))")
+        connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.cache_path, timeout=30)
+
+    def fetch(self, locations):
+        """
+        Returns a {location: translation} dictionary for the given locations, translation being None when no CDS
+        overlaps the location. Locations without an accession are not in the dictionary.
+        """
+
+        results = {}
+        missing = {}
+        connection = self._connect()
+        for location in set(locations):
+            # Hits without an accession cannot be looked up: they are left out, so their HSPs are kept
+            if not location[0]:
+                continue
+            row = connection.execute("SELECT translation FROM cds WHERE accession = ? AND start = ? AND end = ?",
+                                     location).fetchone()
+            if row is None:
+                missing.setdefault(location[0], []).append(location)
+            else:
+                # Empty strings stand for "no CDS here", so they are not fetched again
+                results[location] = row[0] or None
+        connection.close()
+
+        requests = [(accession, start, stop, region_locations) for accession in sorted(missing)
+                    for start, stop, region_locations in regions(missing[accession], self.max_region)]
+        fetched = {}
+        for region_results in self.fetcher.map(lambda request: self._fetch_region(*request), requests):
+            fetched.update(region_results)
+
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO cds (accession, start, end, translation) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   [location + (translation or "",) for location, translation in fetched.items()])
+        connection.close()
+
+        results.update(fetched)
+        return results
+
+    def _fetch_region(self, accession, start, stop, locations):
+        """
+        Fetches the GenBank record of bases start to stop of accession and returns the translations of the CDSs
+        overlapping locations. Locations of a region that failed are left out of the results, so they are neither
+        cached nor considered CDS-less.
+        """
+
+        from Bio import SeqIO
+
+        results = {}
+        try:
+            response = self.fetcher.open_eutils("efetch", db="nuccore", id=accession, rettype="gb", retmode="text",
+                                                seq_start=start, seq_stop=stop)
+        except FetchError:
+            return results
+
+        pending = list(locations)
+        try:
+            for record in SeqIO.parse(io.TextIOWrapper(response, encoding="utf-8"), "genbank"):
+                for feature in record.features:
+                    if feature.type != "CDS" or "translation" not in feature.qualifiers:
+                        continue
+                    # Feature coordinates are relative to the region; features running past its ends are kept whole
+                    cds_start = start + int(feature.location.start)
+                    cds_end = start + int(feature.location.end) - 1
+                    for location in list(pending):
+                        if cds_start <= max(location[1:]) and min(location[1:]) <= cds_end:
+                            results[location] = feature.qualifiers["translation"][0]
+                            pending.remove(location)
+        except (OSError, ValueError):
+            # Connection dropped in the middle of the stream: keep what was read
+            return results
+        finally:
+            response.close()
+
+        for location in pending:
+            results[location] = None
+        return results
@@ -0,0 +1,828 @@
+# -*- coding: utf-8 -*-
+#
+#  compute.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+BLASTats computing pipeline, independent from any user interface.
+Biopython, NumPy and the drawing libraries take longer to import than a whole re-analysis, so they are only imported
+by the methods needing them.
+"""
+
+from assembly_index import AssemblyIndex, COUNTED_LEVELS
+from blast_backends import ALIGNMENTS, HITLIST_SIZE, MAX_HSPS, SEARCH_LIMITS, BlastError, make_backend
+from blast_cache import BlastCache
+from blast_parser import BlastParseError, iter_hits, filter_hits, open_report
+from cds import CdsRetriever
+from dereplicate import dereplicate, write_clusters
+from fetcher import Fetcher, FetchError
+from genome_cache import GenomeCountCache
+from hit_table import TABLE_SUFFIX, HitTable
+from organism_names import organism_name, parse_title
+from profiling import Profiler
+from taxid_index import open_classifier
+import sweep
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+
+# GLOBALS
+GENOMES_URL = "http://www.ncbi.nlm.nih.gov/genome/genomes/{}"
+GENOMES_REGEX = "Complete \[(\d+)\]"
+# Longer lists of all species are saved in a file instead of being output
+DETAILS_MAX_LINES = 5000
+# FastTree executables: OpenMP build, used when several threads are asked for, and regular build
+FASTTREE_MP = "FastTreeMP"
+FASTTREE = "fasttree"
+# BLAST report, plain or gzip-compressed
+REPORT_NAME = "blast_results.xml"
+COMPRESSED_REPORT_NAME = "blast_results.xml.gz"
+# Settings
+EMAIL = "sgelis@jouy.inra.fr"
+Fetcher.shared().email = EMAIL
+
+
+def find_report(workdir, compressed=False):
+    """
+    Returns the path of the BLAST report in workdir: the compressed one first if compressed is set, the plain one
+    first otherwise, falling back to the other format so reports written with either setting are found. Returns the
+    preferred path if there is no report yet.
+    """
+
+    names = (COMPRESSED_REPORT_NAME, REPORT_NAME) if compressed else (REPORT_NAME, COMPRESSED_REPORT_NAME)
+    for name in names:
+        path = os.path.join(workdir, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(workdir, names[0])
+
+
+class Console(object):
+    """
+    Headless stand-in for the Gtk interface: Compute output is appended to a file, or printed if no file is given.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def print_(self, txt):
+        with self.lock:
+            if self.path is None:
+                print(txt)
+            else:
+                of_ = open(self.path, "a")
+                of_.write("{}\n".format(txt))
+                of_.close()
+
+    def print_threaded(self, txt):
+        self.print_(txt)
+
+
+class StrainNamer(object):
+    """
+    Makes strain names unique in constant time per name: the first occurrence of a name is kept as is, the next ones
+    get "_2", "_3"... suffixes, which remain valid FASTA identifiers.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.used = set()
+
+    def unique(self, name):
+        count = self.counts.get(name, 0)
+        candidate = name if count == 0 else "{}_{}".format(name, count + 1)
+        # A strain may genuinely be called like a suffixed name
+        while candidate in self.used:
+            count += 1
+            candidate = "{}_{}".format(name, count + 1)
+        self.counts[name] = count + 1
+        self.used.add(candidate)
+        return candidate
+
+
+class Compute(object):
+    """
+    Computing object.
+    The compute object takes parameters given by the interface and:
+    1) -Optional- BLASTs the protein sequence
+    2) Fetches the number of sequenced genomes at NCBI's database
+    3) Parses the BLAST's XML output to
+        3.1) find the organisms in each sequence match
+        3.2) build a tree of organisms given their genus and specie
+    4) Outputs a tree of species of interest (inputted by interface), computing for each specie the abundance of the
+       query sequence (given by the number of species listed in the matches tree under
+       [genus_of_interest][specie_of_interest]) and the fraction of sequenced organisms it represents.
+    Output goes through parent.print_threaded(), which the Gtk interface and the headless Console both provide, and
+    every file is read from and written to workdir.
+    """
+    def __init__(self, parent, organisms, seq="", verbose=False, details=False, fasta=False, align_tree=False,
+                 identity_threshold=0.8, query_cover_threshold=0.95, e_threshold=1e-5, local_db="", num_threads=1,
+                 refresh_genomes=False, genome_cache=None, genome_fetcher=None, fetcher=None, cds=False,
+                 workdir=".", json_summary=False, render_tree=True, details_max_lines=DETAILS_MAX_LINES,
+                 skip_unchanged=True, dereplicate=False, cluster_identity=None, blast_cache=None, refresh_blast=False,
+                 profile=None, tree_backend="phylo", compress_reports=False, assembly_summary="",
+                 assembly_levels=COUNTED_LEVELS, taxid_index="", hitlist_size=HITLIST_SIZE, descriptions=None,
+                 alignments=ALIGNMENTS, expect=None, max_hsps=MAX_HSPS, hit_tables=None):
+        self.parent = parent
+        self.organisms_of_interest = organisms
+        self.seq = seq
+        self.verbose = verbose
+        self.details = details
+        self.fasta = fasta
+        self.align_tree = align_tree
+        self.cds = cds
+        self.identity_threshold = identity_threshold
+        self.query_cover_threshold = query_cover_threshold
+        self.e_threshold = e_threshold
+        self.local_db = local_db
+        self.num_threads = num_threads
+        self.hitlist_size = hitlist_size
+        self.descriptions = descriptions
+        self.alignments = alignments
+        self.expect = expect
+        self.max_hsps = max_hsps
+        self.refresh_genomes = refresh_genomes
+        self.fetcher = fetcher if fetcher is not None else Fetcher.shared()
+        # The caches are created on first use: analyses that need neither leave no files behind
+        self.genome_cache = genome_cache
+        self.genome_fetcher = genome_fetcher if genome_fetcher is not None else self.fetch_genome_counts
+        self.assembly_summary = assembly_summary
+        self.assembly_levels = assembly_levels
+        self.taxid_index = taxid_index
+        self.workdir = workdir
+        self.json_summary = json_summary
+        self.render_tree = render_tree
+        self.tree_backend = tree_backend
+        self.render_thread = None
+        self.details_max_lines = details_max_lines
+        self.skip_unchanged = skip_unchanged
+        self.dereplicate = dereplicate
+        self.cluster_identity = cluster_identity
+        self.blast_cache = blast_cache
+        # Anything with a for_report() method, such as a hit_table.TableCache shared by a long-running process
+        self.hit_tables = hit_tables if hit_tables is not None else HitTable
+        self.refresh_blast = refresh_blast
+        self.compress_reports = compress_reports
+        self.profiler = Profiler(profile)
+
+    def path(self, filename):
+        return os.path.join(self.workdir, filename)
+
+    def report_path(self):
+        return find_report(self.workdir, self.compress_reports)
+
+    def print_(self, txt):
+        """
+        Sends txt to the parent's output. Safe to call from worker threads.
+        """
+
+        self.parent.print_threaded(txt)
+
+    def get_url(self, organism):
+        """
+        Pooled method that fetches the NCBI genome page of organism. Returns (organism, page), page being None if the
+        organism could not be found.
+        """
+
+        from Bio import Entrez
+
+        try:
+            search = Entrez.read(io.BytesIO(self.fetcher.eutils("esearch", db="genome",
+                                                                term="{}[Organism]".format(organism))))
+            if not search["IdList"]:
+                return organism, None
+            # Decode because .get() returns a byte string while re.findall() takes unicode strings
+            page = self.fetcher.get(GENOMES_URL.format(search["IdList"][0])).decode()
+        except FetchError:
+            self.print_("Error:\nCould not reach NCBI's website.\n"
+                        "Please check your internet connection and retry.")
+            return organism, None
+        return organism, page
+
+    def fetch_genome_counts(self, organisms):
+        """
+        Returns an {organism: quantity} dictionary of the number of sequenced genomes available at NCBI, quantity being
+        None for organisms that could not be found. Pages are fetched via get_url() in the fetcher's bounded pool.
+        """
+
+        counts = {}
+        regex_genomes = re.compile(GENOMES_REGEX)
+
+        for organism, page_organism in self.fetcher.map(self.get_url, organisms):
+            if isinstance(page_organism, type(None)) or "Organism Overview" not in page_organism:
+                counts[organism] = None
+            else:
+                try:
+                    counts[organism] = int(regex_genomes.findall(page_organism)[0])
+                except IndexError:
+                    self.print_("Error fetching genomes quantity for {}.".format(organism.replace("+", " ")))
+                    counts[organism] = None
+        return counts
+
+    def fetch_genomes_quantity(self):
+        """
+        Returns a dictionary containing the number of sequenced genomes available at NCBI for species of interest.
+        If an assembly summary file was given, quantities are counted offline from it (see assembly_index.py).
+        Otherwise, or if it cannot be read, they are read from the on-disk cache when fresh enough, and only the
+        missing ones are fetched through genome_fetcher (fetch_genome_counts() unless another fetcher was given).
+        """
+
+        if self.assembly_summary:
+            if self.verbose:
+                self.print_("Counting genomes in {}...".format(self.assembly_summary))
+            genomes = self.count_assemblies()
+            if genomes is not None:
+                return genomes
+
+        if self.verbose:
+            self.print_("Retrieving genomes quantities at NCBI...")
+
+        #genomes = {}
+        genomes = {"Bacillus+toyonensis": 1, "Bacillus+bombysepticus": 1, "Bacillus+cytotoxicus": 1}
+        if self.genome_cache is None:
+            self.genome_cache = GenomeCountCache()
+        hits, misses = self.genome_cache.hits, self.genome_cache.misses
+
+        counts = self.genome_cache.lookup(self.organisms_of_interest, self.genome_fetcher,
+                                          refresh=self.refresh_genomes)
+
+        for organism in list(self.organisms_of_interest):
+            if counts.get(organism) is not None:
+                genomes[organism] = counts[organism]
+            elif organism not in genomes:
+                self.print_("Could not find '{}' in NCBI's database. "
+                            "Dropping it from analysis".format(organism.replace("+", " ")))
+                self.organisms_of_interest.remove(organism)
+
+        if self.verbose:
+            self.print_("Genomes quantities: {} from cache, {} fetched from NCBI"
+                        .format(self.genome_cache.hits - hits, self.genome_cache.misses - misses))
+        return genomes
+
+    def count_assemblies(self):
+        """
+        Returns the number of assemblies at assembly_levels of species of interest in the assembly summary file,
+        importing it into its index first if needed. Species without any are dropped from the analysis.
+        Returns None if the summary could not be read.
+        """
+
+        try:
+            index = AssemblyIndex.for_summary(self.assembly_summary)
+        except (OSError, UnicodeDecodeError, sqlite3.Error) as error:
+            self.print_("Error:\nCould not read assembly summary {}: {}\nCounting genomes at NCBI instead."
+                        .format(self.assembly_summary, error))
+            return None
+        counts = index.counts(self.organisms_of_interest, self.assembly_levels)
+
+        genomes = {}
+        for organism in list(self.organisms_of_interest):
+            if counts[organism] is not None:
+                genomes[organism] = counts[organism]
+            else:
+                self.print_("Could not find '{}' in {}. "
+                            "Dropping it from analysis".format(organism.replace("+", " "), self.assembly_summary))
+                self.organisms_of_interest.remove(organism)
+
+        if self.verbose:
+            self.print_("Genomes quantities: counted in {}".format(self.assembly_summary))
+        return genomes
+
+    @staticmethod
+    def fetch_organism(string):
+        """
+        Returns the organism name ("Genus species strain") contained in BLAST match title, see organism_names.py.
+        """
+
+        return organism_name(string)
+
+    def blast_backend(self):
+        """
+        Returns the search backend: a local BLAST+ run if a local database was given, NCBI's qblast otherwise.
+        """
+
+        return make_backend(self.local_db, self.num_threads, fetcher=self.fetcher,
+                            **{name: getattr(self, name) for name in SEARCH_LIMITS})
+
+    def blast(self):
+        """
+        BLASTs protein sequence at NCBI or against a local database, outputs the result in a "blast_results.xml" file
+        ("blast_results.xml.gz" if compress_reports is set) in the working directory and analyses it. Returns
+        analyse()'s summary, or None if the search failed.
+        The same search run before (unless refresh_blast is set) is not run again: its report is taken from the BLAST
+        cache.
+        """
+
+        backend = self.blast_backend()
+        report_path = self.path(COMPRESSED_REPORT_NAME if self.compress_reports else REPORT_NAME)
+        key = BlastCache.key(backend.search_key(self.seq))
+        if self.blast_cache is None:
+            self.blast_cache = BlastCache()
+        if not self.refresh_blast and self.blast_cache.get(key, report_path):
+            self.print_("Same search already run, reusing its results.")
+        else:
+            try:
+                with self.profiler.span("blast"):
+                    backend.run(self.seq, report_path)
+            except BlastError as error:
+                self.print_("\nError:\n{}\n".format(error))
+                return None
+            self.blast_cache.put(key, report_path)
+
+        # A report left in the other format by an earlier run must not be analysed instead of this one, and its hit
+        # table is of no use any more
+        other_path = self.path(REPORT_NAME if self.compress_reports else COMPRESSED_REPORT_NAME)
+        for path in (other_path, other_path + TABLE_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        return self.analyse()
+
+    def analyse(self):
+        """
+        Main method of the Compute object, calling the other methods sequentially and outputting the result back to the
+        interface through print_(). Returns a summary dictionary of the analysis (see summary()), or None if the results
+        file could not be read.
+        """
+        total = []
+        strain_namer = StrainNamer()
+        match_organisms_tree = {}
+        others = []
+        hits_locations = {}
+
+        if self.verbose:
+            self.print_("Setting identity threshold to {}".format(self.identity_threshold))
+            self.print_("Setting query coverage threshold to {}".format(self.query_cover_threshold))
+
+        with self.profiler.span("genome counts", items=len(self.organisms_of_interest)):
+            genomes = self.fetch_genomes_quantity()
+
+        # Pre-populate match_organisms_tree with species of interest
+        organisms_of_interest_tree = {}
+        for organism in self.organisms_of_interest:
+            genus = organism.split("+")[0].capitalize()
+            organisms_of_interest_tree.setdefault(genus, []).append(organism.split("+")[1])
+        for genus_of_interest in organisms_of_interest_tree:
+            match_organisms_tree[genus_of_interest] = {}
+            for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
+                match_organisms_tree[genus_of_interest][specie_of_interest] = []
+
+        if self.verbose:
+            self.print_("Parsing BLAST results...")
+
+        report_path = self.report_path()
+        if not os.path.exists(report_path):
+            self.print_("\nError:\nResults file could not be found. Please BLAST a sequence and retry.\n")
+            return
+
+        classifier = self.taxid_classifier()
+        try:
+            with self.profiler.span("parse and filter") as span, self.profiler.hot(self.path("analyse")):
+                for hit in self.passing_hits(report_path):
+                    # If this organism's protein passed all filters, add it to total list and sublists
+                    genus, specie, strain = parse_title(hit.title)
+                    if classifier is not None:
+                        genus, specie = classifier.classify(hit.accession, genus, specie)
+                    organism = strain_namer.unique(self.fetch_organism(hit.title))
+                    total.append(organism)
+
+                    try:
+                        if self.fasta:
+                            match_organisms_tree[genus][specie].append((organism, hit.sbjct))
+                            hits_locations[organism] = (hit.accession, hit.sbjct_start, hit.sbjct_end)
+                        else:
+                            match_organisms_tree[genus][specie].append((organism,))
+                    except KeyError:
+                        others.append(organism)
+                span.items = len(total)
+        except BlastParseError:
+            self.print_("\nError:\nCould not read your XML results file (is it empty?). "
+                        "Please check it and retry\n")
+            return
+        finally:
+            if classifier is not None:
+                classifier.close()
+
+        for genus in match_organisms_tree:
+            for specie in match_organisms_tree[genus]:
+                match_organisms_tree[genus][specie].sort()
+        others.sort()
+
+        # The report is built as a list of lines and sent in one piece, instead of flooding the output with one call
+        # per strain
+        report = ["==============================", "Total: {}\n|".format(len(total))]
+        for genus_of_interest in organisms_of_interest_tree:
+            report.append("|-{}".format(genus_of_interest))
+            for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
+                nb_species_hits = len(match_organisms_tree.get(genus_of_interest, {})
+                                                      .get(specie_of_interest, []))
+                nb_species_genomes = genomes["{}+{}".format(genus_of_interest, specie_of_interest)]
+                abundance = nb_species_hits / nb_species_genomes
+                report.append("|---{:<20}: {:3} %{:>15}/{}".format(specie_of_interest,
+                                                                   str(round(abundance * 100)),
+                                                                   str(nb_species_hits),
+                                                                   str(nb_species_genomes)))
+            report.append("|")
+        report.append("|-Others: {}".format(len(others)))
+        report.append("==============================")
+        with self.profiler.span("report"):
+            self.print_("\n".join(report))
+
+        if self.details:
+            details = ["\n\n"]
+            for genus_of_interest in organisms_of_interest_tree:
+                details.append("\n{}\n==============================".format(genus_of_interest))
+                for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
+                    details.append("\n{}\n------------------------------".format(specie_of_interest))
+                    for strain in match_organisms_tree.get(genus_of_interest, {})\
+                                                  .get(specie_of_interest, []):
+                        details.append(strain[0])
+            details.append("\nOthers\n==============================")
+            details.extend(others)
+            details.append("\n")
+            with self.profiler.span("details", items=len(total)):
+                self.print_details(details)
+
+        if self.fasta:
+            if self.cds:
+                with self.profiler.span("cds", items=len(hits_locations)):
+                    self.replace_hsps_with_cds(match_organisms_tree, hits_locations)
+            with self.profiler.span("record_fasta", items=len(hits_locations)):
+                self.record_fasta(match_organisms_tree)
+
+        if self.align_tree:
+            self.align_and_philogeny()
+
+        if self.verbose:
+            self.print_("\n".join(self.profiler.lines()))
+        self.profiler.dump(self.path("profile.json"))
+
+        summary = self.summary(organisms_of_interest_tree, match_organisms_tree, genomes, total, others)
+        if self.json_summary:
+            of_ = open(self.path("summary.json"), "w")
+            json.dump(summary, of_, indent=2, sort_keys=True)
+            of_.close()
+        return summary
+
+    def print_details(self, details):
+        """
+        Outputs the list of all strains. Lists longer than details_max_lines are saved in "details.txt" instead, and
+        only a pointer to that file is output.
+        """
+
+        if self.details_max_lines is None or len(details) <= self.details_max_lines:
+            self.print_("\n".join(details))
+            return
+
+        details_path = self.path("details.txt")
+        try:
+            of_ = open(details_path, "w")
+        except PermissionError:
+            self.print_("Error while opening details file. Printing details instead.")
+            self.print_("\n".join(details))
+        else:
+            of_.write("\n".join(details))
+            of_.close()
+            self.print_("\nList of all species too long to display ({} lines): saved in {}\n"
+                        .format(len(details), details_path))
+
+    def taxid_classifier(self):
+        """
+        Returns a TaxidClassifier assigning hits to species of interest by the taxid of their accession, or None if no
+        usable taxid index was given, hits being then assigned by their title only.
+        """
+
+        if not self.taxid_index:
+            return None
+        try:
+            classifier = open_classifier(self.taxid_index, self.organisms_of_interest)
+        except ValueError as error:
+            self.print_("Error:\n{}\nClassifying hits by their titles.".format(error))
+            return None
+        for organism in classifier.missing:
+            self.print_("'{}' is not a species of the taxonomy, its hits are classified by their titles."
+                        .format(organism.replace("+", " ")))
+        return classifier
+
+    def passing_hits(self, report_path):
+        """
+        Yields the hits of report_path passing all thresholds.
+        With NumPy, the report is parsed once into a HitTable saved next to it, so re-analyses with other thresholds
+        only run vectorized filters over the table. Without it, hits are streamed out of the XML report, so the report
+        never has to fit in memory.
+        """
+
+        if HitTable.available():
+            with self.profiler.span("parse") as span:
+                table = self.hit_tables.for_report(report_path)
+                span.items = len(table)
+            for hit in table.filter_hits(self.query_cover_threshold, self.identity_threshold, self.e_threshold):
+                yield hit
+        else:
+            blast_output_file = open_report(report_path)
+            try:
+                for hit in filter_hits(iter_hits(blast_output_file), self.query_cover_threshold,
+                                       self.identity_threshold, self.e_threshold):
+                    yield hit
+            finally:
+                blast_output_file.close()
+
+    def sweep_rows(self, report_path, classifier=None):
+        """
+        Yields (species, query_cover, identity, evalue, has_stop) for every hit of report_path, species being
+        "Genus species", read from the report's HitTable when NumPy is available. With a TaxidClassifier, hits are
+        assigned to species as in analyse(), species being None for hits of another species than those of interest.
+        """
+
+        if HitTable.available():
+            table = self.hit_tables.for_report(report_path)
+            columns = table.columns
+            genera = table.names["genus"].tolist()
+            species = table.names["species"].tolist()
+            for i, row in enumerate(zip(columns["genus"].tolist(), columns["species"].tolist(),
+                                        columns["query_cover"].tolist(), columns["identity"].tolist(),
+                                        columns["evalue"].tolist(), columns["has_stop"].tolist())):
+                genus, specie = genera[row[0]], species[row[1]]
+                if classifier is not None:
+                    genus, specie = classifier.classify(table.string("accession", i), genus, specie)
+                yield (None if genus is None else "{} {}".format(genus, specie),) + row[2:]
+        else:
+            blast_output_file = open_report(report_path)
+            try:
+                for hit in iter_hits(blast_output_file):
+                    genus, specie, strain = parse_title(hit.title)
+                    if classifier is not None:
+                        genus, specie = classifier.classify(hit.accession, genus, specie)
+                    yield (None if genus is None else "{} {}".format(genus, specie), hit.query_cover, hit.identity,
+                           hit.evalue, "*" in hit.sbjct)
+            finally:
+                blast_output_file.close()
+
+    def sweep(self, identity_thresholds, cover_thresholds, e_thresholds):
+        """
+        Computes the abundance of every species of interest for each combination of thresholds, in a single pass over
+        the hits (see sweep.py), and writes them as a matrix in "sweep.tsv". Returns the path of the matrix, or None if
+        the results file could not be read.
+        """
+
+        identity_thresholds = sorted(identity_thresholds)
+        cover_thresholds = sorted(cover_thresholds)
+        e_thresholds = sorted(e_thresholds)
+
+        report_path = self.report_path()
+        if not os.path.exists(report_path):
+            self.print_("\nError:\nResults file could not be found. Please BLAST a sequence and retry.\n")
+            return None
+
+        genomes = self.fetch_genomes_quantity()
+        genomes = {organism.replace("+", " "): genomes[organism] for organism in self.organisms_of_interest}
+
+        if self.verbose:
+            self.print_("Sweeping {} threshold combinations...".format(len(identity_thresholds) *
+                                                                       len(cover_thresholds) * len(e_thresholds)))
+        classifier = self.taxid_classifier()
+        try:
+            counts = sweep.hit_counts(self.sweep_rows(report_path, classifier), genomes, identity_thresholds,
+                                      cover_thresholds, e_thresholds)
+        except BlastParseError:
+            self.print_("\nError:\nCould not read your XML results file (is it empty?). "
+                        "Please check it and retry\n")
+            return None
+        finally:
+            if classifier is not None:
+                classifier.close()
+
+        sweep_path = self.path("sweep.tsv")
+        sweep.write_tsv(sweep_path, counts, genomes, identity_thresholds, cover_thresholds, e_thresholds)
+        self.print_("Saving threshold sweep in {}".format(sweep_path))
+        return sweep_path
+
+    def summary(self, organisms_of_interest_tree, match_organisms_tree, genomes, total, others):
+        """
+        Returns the analysis as a JSON-serialisable dictionary: thresholds, hit counts, and for each species of interest
+        its hits, genomes quantity, abundance and strains.
+        """
+
+        species = {}
+        for genus_of_interest in organisms_of_interest_tree:
+            for specie_of_interest in organisms_of_interest_tree[genus_of_interest]:
+                strains = [strain[0] for strain in match_organisms_tree.get(genus_of_interest, {})
+                                                                       .get(specie_of_interest, [])]
+                nb_species_genomes = genomes["{}+{}".format(genus_of_interest, specie_of_interest)]
+                species["{} {}".format(genus_of_interest, specie_of_interest)] = {
+                    "hits": len(strains),
+                    "genomes": nb_species_genomes,
+                    "abundance": len(strains) / nb_species_genomes,
+                    "strains": strains}
+
+        return {"identity_threshold": self.identity_threshold,
+                "query_cover_threshold": self.query_cover_threshold,
+                "e_threshold": self.e_threshold,
+                "total": len(total),
+                "species": species,
+                "others": others}
+
+    def record_fasta(self, organisms_tree):
+        """
+        Retrieves CDSs that generated significant hits and saves them as FASTA in working directory.
+        """
+        try:
+            out_fasta = open(self.path("sequences.fa"), "w")
+        except PermissionError:
+            self.print_("Error while opening sequences file. Could not save them.")
+        else:
+            self.print_("Saving results in sequences.fa")
+            for genus in organisms_tree:
+                for specie in organisms_tree[genus]:
+                    for organism in organisms_tree[genus][specie]:
+                        out_fasta.write(">{}\n{}\n\n".format(organism[0].replace(" ", "_"), organism[1]))
+
+            out_fasta.close()
+
+            if self.dereplicate:
+                self.record_representatives(organisms_tree)
+
+    def record_representatives(self, organisms_tree):
+        """
+        Collapses identical (or, given cluster_identity, similar) sequences of organisms_tree and saves one
+        representative per cluster in "representatives.fa", named after its first strain and the cluster size
+        ("Escherichia_coli__x37"). Cluster members are listed in "sequences.clusters.tsv".
+        """
+
+        records = [(organism[0].replace(" ", "_"), organism[1])
+                   for genus in organisms_tree for specie in organisms_tree[genus]
+                   for organism in organisms_tree[genus][specie]]
+        clusters = dereplicate(records, self.cluster_identity)
+
+        out_fasta = open(self.path("representatives.fa"), "w")
+        for cluster in clusters:
+            out_fasta.write(">{}\n{}\n\n".format(cluster.leaf_name(), cluster.sequence))
+        out_fasta.close()
+        write_clusters(self.path("sequences.clusters.tsv"), clusters)
+
+        self.print_("Collapsed {} sequences into {} representatives (see sequences.clusters.tsv)"
+                    .format(len(records), len(clusters)))
+
+    def alignment_input(self):
+        """
+        Returns the FASTA file to align: the representatives when dereplicating, all sequences otherwise.
+        """
+
+        if self.dereplicate and os.path.exists(self.path("representatives.fa")):
+            return self.path("representatives.fa")
+        return self.path("sequences.fa")
+
+    def replace_hsps_with_cds(self, organisms_tree, hits_locations):
+        """
+        Replaces, in organisms_tree, the HSP sequences of organisms of interest by the CDSs they belong to, retrieved
+        in batches via cds_from_hsps(). HSPs whose CDS could not be found are kept as is.
+        """
+
+        if self.verbose:
+            self.print_("Retrieving CDSs of {} hits at NCBI...".format(len(hits_locations)))
+
+        cds = self.cds_from_hsps(hits_locations.values())
+        nb_missing = 0
+        for genus in organisms_tree:
+            for specie in organisms_tree[genus]:
+                for i, (organism, sbjct) in enumerate(organisms_tree[genus][specie]):
+                    translation = cds.get(hits_locations[organism])
+                    if translation is None:
+                        nb_missing += 1
+                    else:
+                        organisms_tree[genus][specie][i] = (organism, translation)
+
+        if nb_missing:
+            self.print_("Could not retrieve {} CDSs, keeping their HSPs instead.".format(nb_missing))
+
+    def cds_from_hsps(self, locations):
+        """
+        Returns a {(accession, sbjct_start, sbjct_end): translation} dictionary of the CDSs overlapping each HSP
+        location, fetched with batched efetch requests and memoized on disk.
+        """
+
+        return CdsRetriever(self.fetcher).fetch(locations)
+
+    def sequences_hash(self, path):
+        """
+        Returns the SHA-256 hex digest of the file at path.
+        """
+
+        digest = hashlib.sha256()
+        fhandle = open(path, "rb")
+        for chunk in iter(lambda: fhandle.read(1 << 16), b""):
+            digest.update(chunk)
+        fhandle.close()
+        return digest.hexdigest()
+
+    def align_and_philogeny(self):
+        """
+        Aligns retrieved sequences with ClustalOmega, builds a tree with FastTree and renders it (see render()).
+        Both tools run on num_threads threads (FastTreeMP is used when installed). Only representatives are aligned
+        when dereplicating. If the aligned sequences did not change since the last run, as recorded by their hash in
+        "sequences.fa.sha256", the previous alignment and tree are reused.
+        """
+        from Bio.Align.Applications import ClustalOmegaCommandline
+        from Bio.Phylo.Applications._Fasttree import FastTreeCommandline
+
+        infile = self.alignment_input()
+        hash_path = self.path("sequences.fa.sha256")
+        sequences_hash = self.sequences_hash(infile)
+        try:
+            fhandle = open(hash_path)
+            previous_hash = fhandle.read().strip()
+            fhandle.close()
+        except FileNotFoundError:
+            previous_hash = None
+
+        if self.skip_unchanged and sequences_hash == previous_hash and os.path.exists(self.path("sequences.aln")) \
+                and os.path.exists(self.path("sequences.tree")):
+            self.print_("Sequences unchanged since last run, reusing alignment and tree.")
+        else:
+            # Forget the previous hash until both steps succeed
+            if previous_hash is not None:
+                os.remove(hash_path)
+
+            self.print_("Aligning sequences with ClustalOmega...")
+            clustal_commandline = ClustalOmegaCommandline(infile=infile,
+                                                          outfile=self.path("sequences.aln"), outfmt="fa", force=True,
+                                                          verbose=True, threads=self.num_threads)
+            try:
+                with self.profiler.span("clustalo") as span:
+                    returncode = subprocess.call(str(clustal_commandline).split())
+            except OSError as error:
+                # Not installed, or not executable
+                self.print_("Error:\nClustalOmega failed: {}".format(error))
+                return
+            if returncode != 0:
+                self.print_("Error:\nClustalOmega failed, see its output above.")
+                return
+            self.print_("Aligned in {:.1f} s".format(span.wall))
+
+            fasttree = FASTTREE_MP if self.num_threads > 1 and shutil.which(FASTTREE_MP) else FASTTREE
+            self.print_("Building tree with {}...".format(fasttree))
+            fasttree_commandline = FastTreeCommandline(fasttree, input=self.path("sequences.aln"),
+                                                       out=self.path("sequences.tree"))
+            try:
+                with self.profiler.span("fasttree") as span:
+                    returncode = subprocess.call(str(fasttree_commandline).split(),
+                                                 env=dict(os.environ, OMP_NUM_THREADS=str(self.num_threads)))
+            except OSError as error:
+                self.print_("Error:\n{} failed: {}".format(fasttree, error))
+                return
+            if returncode != 0:
+                self.print_("Error:\n{} failed, see its output above.".format(fasttree))
+                return
+            self.print_("Tree built in {:.1f} s".format(span.wall))
+
+            fhandle = open(hash_path, "w")
+            fhandle.write(sequences_hash)
+            fhandle.close()
+
+        self.print_("All done.")
+
+        if self.render_tree:
+            self.render_thread = threading.Thread(target=self.render)
+            self.render_thread.start()
+
+    def render(self):
+        """
+        Renders "sequences.tree" to sequences.nwk, sequences.png and sequences.svg, highlighting organisms of interest.
+        Runs in its own thread, started by align_and_philogeny(); the parent interface, if it has a show_tree() method,
+        is then given the PNG to display.
+        """
+
+        try:
+            from tree_render import render_tree
+            with self.profiler.span("tree rendering"):
+                written = render_tree(self.path("sequences.tree"), self.path("sequences"), self.organisms_of_interest,
+                                      backend=self.tree_backend)
+        except Exception as error:
+            # Drawing libraries fail in many ways (missing Matplotlib or ETE, odd trees): rendering is not worth
+            # losing the analysis over
+            self.print_("Error:\nCould not render the tree: {}".format(error))
+            return
+        self.profiler.dump(self.path("profile.json"))
+        self.print_("Tree saved in {}".format(", ".join(os.path.basename(path) for path in written)))
+
+        show_tree = getattr(self.parent, "show_tree", None)
+        if show_tree is not None and self.path("sequences.png") in written:
+            show_tree(self.path("sequences.png"))
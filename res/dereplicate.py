@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+#  dereplicate.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Redundancy reduction of homologue sets before alignment.
+Identical sequences (ignoring gaps and case) are collapsed by hashing. Optionally, the remaining sequences are then
+greedily clustered, longest first, CD-HIT style: a sequence joins the first representative it shares enough k-mers
+with, the k-mer fraction being turned into an identity estimate (fraction ~ identity ** k). This is an approximation
+that needs no alignment, meant to cut hundreds of near-identical strains down to a few representatives.
+"""
+
+KMER_SIZE = 3
+
+
+class Cluster(object):
+    """
+    Sequences collapsed under a representative. members lists the names of all sequences, representative included.
+    """
+    def __init__(self, name, sequence):
+        self.name = name
+        self.sequence = sequence
+        self.members = [name]
+
+    def leaf_name(self):
+        """
+        Name of the cluster in alignments and trees: the representative's, followed by "__x<size>" for clusters of
+        several sequences. Brackets are avoided as they mark comments in Newick trees.
+        """
+
+        if len(self.members) == 1:
+            return self.name
+        return "{}__x{}".format(self.name, len(self.members))
+
+
+def _kmers(sequence, k=KMER_SIZE):
+    return set(sequence[i:i + k] for i in range(len(sequence) - k + 1))
+
+
+def dereplicate(records, identity=None, k=KMER_SIZE):
+    """
+    Returns the list of Clusters of records, an iterable of (name, sequence). Without identity, only identical sequences
+    are collapsed; with identity (between 0 and 1), sequences whose estimated identity to a representative is at
+    least identity join its cluster.
+    """
+
+    clusters = {}
+    for name, sequence in records:
+        key = sequence.replace("-", "").upper()
+        if key in clusters:
+            clusters[key].members.append(name)
+        else:
+            clusters[key] = Cluster(name, sequence)
+
+    if identity is None or identity >= 1:
+        return list(clusters.values())
+
+    # Longest, then most represented, sequences become representatives first
+    unique = sorted(clusters.items(), key=lambda item: (-len(item[0]), -len(item[1].members), item[1].name))
+    representatives = []
+    for key, cluster in unique:
+        kmers = _kmers(key, k)
+        for representative_key, representative_kmers, representative in representatives:
+            # Length difference alone already rules out identity
+            if len(key) < identity * len(representative_key):
+                continue
+            if not kmers:
+                continue
+            fraction = len(kmers & representative_kmers) / len(kmers)
+            if fraction ** (1. / k) >= identity:
+                representative.members.extend(cluster.members)
+                break
+        else:
+            representatives.append((key, kmers, cluster))
+
+    return [representative for key, kmers, representative in representatives]
+
+
+def write_clusters(path, clusters):
+    """
+    Writes the mapping of cluster leaf names to member names, one cluster per line (leaf name, size, members).
+    """
+
+    of_ = open(path, "w")
+    of_.write("leaf\tsize\tmembers\n")
+    for cluster in clusters:
+        of_.write("{}\t{}\t{}\n".format(cluster.leaf_name(), len(cluster.members), ",".join(cluster.members)))
+    of_.close()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+#  fetcher.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+HTTP fetch layer for every request BLASTats sends to NCBI.
+Requests go through a bounded thread pool, share a token-bucket rate limiter (NCBI allows 3 requests per second
+without an API key), reuse one keep-alive connection per host and thread, time out, and are retried with exponential
+backoff when the network fails or NCBI throttles us.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import http.client
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/{}.fcgi"
+# Requests per second allowed by NCBI without an API key
+NCBI_RATE = 3
+# Statuses worth retrying: throttling and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_COMPRESS_LEVEL = 6
+
+
+class FetchError(Exception):
+    """
+    Raised when a request could not be completed, after all retries if the error was transient.
+    """
+    pass
+
+
+class _Retry(Exception):
+    """
+    Internal signal for a response that should be retried. retry_after is the delay asked by the server, if any.
+    """
+    def __init__(self, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket: acquire() blocks until a token is available. Tokens are refilled at rate per second,
+    up to capacity, which bounds bursts.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher(object):
+    """
+    Rate-limited, retrying HTTP client with a bounded worker pool.
+    The same Fetcher should be shared by everything talking to NCBI so the rate limit holds globally: use
+    Fetcher.shared() unless a specific instance (for instance pointing at a local stand-in server) is needed.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_workers=4, rate=NCBI_RATE, retries=4, backoff=1., timeout=60, email=None, api_key=None,
+                 tool="BLASTats"):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.email = email
+        self.api_key = api_key
+        self.tool = tool
+        self.bucket = TokenBucket(rate)
+        self.local = threading.local()
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the process-wide Fetcher, creating it on first use.
+        """
+
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @classmethod
+    def configure_shared(cls, **kwargs):
+        """
+        Replaces the process-wide Fetcher by a new one built with kwargs, for instance in a freshly forked worker
+        process, whose inherited pool threads do not exist anymore.
+        """
+
+        with cls._shared_lock:
+            cls._shared = cls(**kwargs)
+            return cls._shared
+
+    def map(self, func, items):
+        """
+        Calls func on every item in the worker pool and returns the results as a list, in items order.
+        func must not call map() itself, as nested calls could exhaust the pool.
+        """
+
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return list(self.executor.map(func, items))
+
+    def get(self, url, params=None, data=None):
+        """
+        Returns the body of url as bytes. params are encoded in the query string, data (a dictionary) is sent as
+        a form-encoded POST body.
+        """
+
+        return self._request(url, params, data, stream=False)
+
+    def open(self, url, params=None, data=None):
+        """
+        Same as get() but returns the response object so the body can be read in chunks. The response must be read
+        to the end (or closed) before the calling thread sends another request.
+        """
+
+        return self._request(url, params, data, stream=True)
+
+    def download(self, url, out_path, params=None, data=None, compress=False, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """
+        Streams the body of url to out_path in chunks of chunk_size bytes, gzip-compressing it on the way if compress
+        is set, so large replies never have to fit in memory. The body is written to a temporary file renamed once
+        complete: out_path is either the whole reply or left untouched. Returns the number of bytes received.
+        """
+
+        tmp_path = "{}.{}.part".format(out_path, os.getpid())
+        response = self.open(url, params=params, data=data)
+        size = 0
+        try:
+            if compress:
+                of_ = gzip.open(tmp_path, "wb", compresslevel=DOWNLOAD_COMPRESS_LEVEL)
+            else:
+                of_ = open(tmp_path, "wb")
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    of_.write(chunk)
+                    size += len(chunk)
+            finally:
+                of_.close()
+            # read() returns short bodies without complaint when the server closes the connection early
+            if response.length:
+                raise http.client.IncompleteRead(b"", response.length)
+            os.replace(tmp_path, out_path)
+        except (OSError, http.client.HTTPException) as error:
+            # The connection may be half-read: it cannot be reused
+            parsed = urllib.parse.urlsplit(url)
+            self._drop_connection(parsed.scheme, parsed.netloc)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise FetchError("Could not download {}: {}".format(url, error))
+        finally:
+            response.close()
+        return size
+
+    def eutils(self, utility, **params):
+        """
+        Calls an Entrez E-utility ("esearch", "efetch", ...) and returns the raw reply as bytes.
+        """
+
+        # Long ID lists do not fit in a query string, hence POST
+        return self.get(EUTILS_URL.format(utility), data=self._eutils_params(params))
+
+    def open_eutils(self, utility, **params):
+        """
+        Same as eutils() but returns the response object, like open().
+        """
+
+        return self.open(EUTILS_URL.format(utility), data=self._eutils_params(params))
+
+    def _eutils_params(self, params):
+        params.setdefault("tool", self.tool)
+        if self.email is not None:
+            params.setdefault("email", self.email)
+        if self.api_key is not None:
+            params.setdefault("api_key", self.api_key)
+        return params
+
+    def _connection(self, scheme, netloc):
+        """
+        Returns this thread's keep-alive connection to scheme://netloc, opening it if needed.
+        """
+
+        connections = getattr(self.local, "connections", None)
+        if connections is None:
+            connections = self.local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = connection
+        return connection
+
+    def _drop_connection(self, scheme, netloc):
+        connection = getattr(self.local, "connections", {}).pop((scheme, netloc), None)
+        if connection is not None:
+            connection.close()
+
+    def _request(self, url, params, data, stream):
+        if params:
+            url = "{}?{}".format(url, urllib.parse.urlencode(params))
+        body = None
+        headers = {"Connection": "keep-alive", "User-Agent": self.tool}
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1) * (1 + random.random() / 2)
+                if getattr(last_error, "retry_after", None):
+                    delay = max(delay, last_error.retry_after)
+                time.sleep(delay)
+
+            try:
+                return self._send(url, body, headers, stream)
+            except _Retry as error:
+                last_error = error
+            except (OSError, http.client.HTTPException) as error:
+                # Timeouts, refused or reset connections, and keep-alive connections closed by the server
+                last_error = error
+
+        raise FetchError("Could not fetch {} after {} attempts: {}".format(url, self.retries + 1, last_error))
+
+    def _send(self, url, body, headers, stream):
+        method = "GET" if body is None else "POST"
+        for redirect in range(MAX_REDIRECTS + 1):
+            parsed = urllib.parse.urlsplit(url)
+            path = parsed.path or "/"
+            if parsed.query:
+                path = "{}?{}".format(path, parsed.query)
+
+            self.bucket.acquire()
+            connection = self._connection(parsed.scheme, parsed.netloc)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                if response.status in REDIRECT_STATUSES:
+                    response.read()
+                    url = urllib.parse.urljoin(url, response.getheader("Location"))
+                    if response.status == 303:
+                        method, body = "GET", None
+                    continue
+                if response.status in RETRY_STATUSES:
+                    response.read()
+                    retry_after = response.getheader("Retry-After")
+                    raise _Retry("HTTP {}".format(response.status),
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+                if response.status >= 400:
+                    response.read()
+                    raise FetchError("HTTP {} for {}".format(response.status, url))
+                if stream:
+                    return response
+                return response.read()
+            except Exception:
+                self._drop_connection(parsed.scheme, parsed.netloc)
+                raise
+
+        raise FetchError("Too many redirects for {}".format(url))
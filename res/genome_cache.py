@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+#  genome_cache.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Persistent cache of the number of sequenced genomes per organism.
+Genome counts at NCBI change on a scale of weeks, so they are kept in a small SQLite database and only fetched again
+once they are older than the cache's time-to-live.
+"""
+
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = "genomes_cache.sqlite"
+# Two weeks
+CACHE_TTL = 14 * 24 * 3600
+
+
+class GenomeCountCache(object):
+    """
+    SQLite-backed organism -> genomes quantity cache.
+    Organisms are keyed the way Compute stores them ("Genus+species"). A connection is opened for each call, so a
+    single cache object can be shared by the interface and worker threads.
+    """
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        connection = self._connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS genomes "
+                               "(organism TEXT PRIMARY KEY, quantity INTEGER NOT NULL, fetched REAL NOT NULL)")
+        connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, organism):
+        """
+        Returns the cached genomes quantity for organism, or None if it is unknown or expired.
+        """
+
+        connection = self._connect()
+        row = connection.execute("SELECT quantity FROM genomes WHERE organism = ? AND fetched >= ?",
+                                 (organism, time.time() - self.ttl)).fetchone()
+        connection.close()
+        return None if row is None else row[0]
+
+    def put(self, counts):
+        """
+        Stores an {organism: quantity} dictionary. Organisms whose quantity is None are not cached, so that they are
+        fetched again next time.
+        """
+
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO genomes (organism, quantity, fetched) VALUES (?, ?, ?)",
+                                   [(organism, quantity, now) for organism, quantity in counts.items()
+                                    if quantity is not None])
+        connection.close()
+
+    def lookup(self, organisms, fetch, refresh=False):
+        """
+        Returns an {organism: quantity} dictionary for organisms, quantity being None when it could not be found.
+        Organisms missing from the cache (or all of them if refresh is True) are passed in a single call to fetch,
+        a callable taking a list of organisms and returning an {organism: quantity} dictionary.
+        """
+
+        counts = {}
+        missing = []
+        for organism in organisms:
+            quantity = None if refresh else self.get(organism)
+            if quantity is None:
+                missing.append(organism)
+            else:
+                counts[organism] = quantity
+        self.hits += len(counts)
+        self.misses += len(missing)
+
+        if missing:
+            fetched = fetch(missing)
+            self.put(fetched)
+            for organism in missing:
+                counts[organism] = fetched.get(organism)
+
+        return counts
+
+
+class MemoryGenomeCountCache(GenomeCountCache):
+    """
+    GenomeCountCache keeping what it reads and writes in memory too, for long-running processes (see service.py):
+    only the first lookup of an organism touches the database. Entries expire after ttl as in the database.
+    """
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL):
+        GenomeCountCache.__init__(self, path, ttl)
+        self.memory = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.memory)
+
+    def get(self, organism):
+        with self.lock:
+            quantity, fetched = self.memory.get(organism, (None, 0))
+        if quantity is not None and fetched >= time.time() - self.ttl:
+            return quantity
+        connection = self._connect()
+        row = connection.execute("SELECT quantity, fetched FROM genomes WHERE organism = ? AND fetched >= ?",
+                                 (organism, time.time() - self.ttl)).fetchone()
+        connection.close()
+        if row is None:
+            return None
+        with self.lock:
+            self.memory[organism] = row
+        return row[0]
+
+    def put(self, counts):
+        GenomeCountCache.put(self, counts)
+        now = time.time()
+        with self.lock:
+            self.memory.update((organism, (quantity, now)) for organism, quantity in counts.items()
+                               if quantity is not None)
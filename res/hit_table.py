@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+#  hit_table.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Columnar store of parsed BLAST hits.
+A BLAST XML report is parsed once into NumPy arrays (one row per hit, first HSP only) saved next to the report as
+"<report>.hits.npz". Re-analysing the same report with other thresholds then only loads the table and filters it with
+vectorized masks instead of parsing XML again.
+Strings are stored as a single UTF-8 blob plus offsets, and organism/genus/species as codes into a table of unique
+names, which keeps the file compact and loadable in milliseconds.
+NumPy is optional: without it, HitTable.available() is False and callers fall back to streaming the XML. It is only
+imported by the first call to available(), build() or load(), which keeps it off the startup path.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+from blast_parser import Hit, iter_hits, open_report
+from organism_names import parse_title
+
+# Bump when the layout, or the way organisms are derived from titles, changes: older tables are then rebuilt
+TABLE_VERSION = 2
+TABLE_SUFFIX = ".hits.npz"
+NUMERIC_COLUMNS = (("query_cover", "f8"), ("identity", "f8"), ("evalue", "f8"), ("sbjct_start", "i8"),
+                   ("sbjct_end", "i8"), ("has_stop", "?"), ("organism", "i4"), ("genus", "i4"), ("species", "i4"))
+STRING_COLUMNS = ("title", "accession", "sbjct")
+# Tables kept in memory by a TableCache
+MAX_CACHED_TABLES = 64
+
+numpy = None
+_numpy_checked = False
+
+
+def load_numpy():
+    """
+    Imports NumPy on first call. Returns the module, or None if it is not installed.
+    """
+
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_checked = True
+    return numpy
+
+
+def _stamp(path):
+    """
+    Identifies a version of a report file, so tables built from an older one are not reused.
+    """
+
+    stat = os.stat(path)
+    return [TABLE_VERSION, stat.st_size, stat.st_mtime_ns]
+
+
+class HitTable(object):
+    """
+    Table of BLAST hits. columns holds one NumPy array per numeric column; strings[column] is a (blob, offsets) pair
+    for each string column; names holds the unique organism, genus and species names referred to by their codes.
+    """
+    def __init__(self, columns, strings, names, stamp=None):
+        self.columns = columns
+        self.strings = strings
+        self.names = names
+        self.stamp = stamp
+
+    def __len__(self):
+        return len(self.columns["evalue"])
+
+    @staticmethod
+    def available():
+        return load_numpy() is not None
+
+    @classmethod
+    def build(cls, hits, parse=parse_title, stamp=None):
+        """
+        Builds a table from an iterable of Hit, parse being the function turning a hit title into an OrganismName.
+        """
+
+        load_numpy()
+        columns = {name: [] for name, dtype in NUMERIC_COLUMNS}
+        strings = {name: [] for name in STRING_COLUMNS}
+        codes = {"organism": {}, "genus": {}, "species": {}}
+
+        for hit in hits:
+            name = parse(hit.title)
+            organism = " ".join(part for part in name if part)
+            genus, species = name.genus, name.species
+            for column, value in (("organism", organism), ("genus", genus), ("species", species)):
+                columns[column].append(codes[column].setdefault(value, len(codes[column])))
+            columns["query_cover"].append(hit.query_cover)
+            columns["identity"].append(hit.identity)
+            columns["evalue"].append(hit.evalue)
+            columns["sbjct_start"].append(hit.sbjct_start)
+            columns["sbjct_end"].append(hit.sbjct_end)
+            columns["has_stop"].append("*" in hit.sbjct)
+            strings["title"].append(hit.title)
+            strings["accession"].append(hit.accession or "")
+            strings["sbjct"].append(hit.sbjct)
+
+        for name, dtype in NUMERIC_COLUMNS:
+            columns[name] = numpy.array(columns[name], dtype=dtype)
+        for name in STRING_COLUMNS:
+            strings[name] = cls._pack(strings[name])
+        names = {column: numpy.array(sorted(codes[column], key=codes[column].get), dtype=str)
+                 for column in codes}
+
+        return cls(columns, strings, names, stamp)
+
+    @staticmethod
+    def _pack(values):
+        encoded = [value.encode() for value in values]
+        offsets = numpy.zeros(len(encoded) + 1, dtype="i8")
+        numpy.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return numpy.frombuffer(b"".join(encoded), dtype="u1"), offsets
+
+    def string(self, column, row):
+        blob, offsets = self.strings[column]
+        return blob[offsets[row]:offsets[row + 1]].tobytes().decode()
+
+    def name(self, column, row):
+        """
+        Returns the organism, genus or species name of row.
+        """
+
+        return self.names[column][self.columns[column][row]]
+
+    def save(self, path):
+        arrays = {"stamp": numpy.array(self.stamp if self.stamp is not None else [], dtype="i8")}
+        for name, dtype in NUMERIC_COLUMNS:
+            arrays[name] = self.columns[name]
+        for name in STRING_COLUMNS:
+            arrays["{}_blob".format(name)], arrays["{}_offsets".format(name)] = self.strings[name]
+        for name in self.names:
+            arrays["{}_names".format(name)] = self.names[name]
+        # Write then rename, so a concurrent reader never sees a half-written table. Processes and threads saving the
+        # same table each write their own file
+        tmp_path = "{}.{}.{}.tmp.npz".format(path, os.getpid(), threading.get_ident())
+        numpy.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        load_numpy()
+        # Arrays are read into memory as they are accessed, so the archive can be closed right after
+        with numpy.load(path) as arrays:
+            columns = {name: arrays[name] for name, dtype in NUMERIC_COLUMNS}
+            strings = {name: (arrays["{}_blob".format(name)], arrays["{}_offsets".format(name)])
+                       for name in STRING_COLUMNS}
+            names = {name: arrays["{}_names".format(name)] for name in ("organism", "genus", "species")}
+            stamp = arrays["stamp"].tolist()
+        return cls(columns, strings, names, stamp)
+
+    @classmethod
+    def for_report(cls, report_path, parse=parse_title):
+        """
+        Returns the table of report_path, loading it from "<report_path>.hits.npz" when it is up to date and building
+        (then saving) it otherwise.
+        """
+
+        stamp = _stamp(report_path)
+        table_path = report_path + TABLE_SUFFIX
+        if os.path.exists(table_path):
+            try:
+                table = cls.load(table_path)
+            except (OSError, KeyError, ValueError):
+                table = None
+            if table is not None and table.stamp == stamp:
+                return table
+
+        fhandle = open_report(report_path)
+        try:
+            table = cls.build(iter_hits(fhandle), parse, stamp)
+        finally:
+            fhandle.close()
+        try:
+            table.save(table_path)
+        except OSError:
+            # Read-only directory: the table is still usable for this run
+            pass
+        return table
+
+    def mask(self, query_cover_threshold, identity_threshold, e_threshold):
+        """
+        Returns the boolean mask of rows passing the same filters as blast_parser.filter_hits().
+        """
+
+        columns = self.columns
+        return (columns["query_cover"] > query_cover_threshold) & (columns["identity"] > identity_threshold) \
+            & (columns["evalue"] < e_threshold) & ~columns["has_stop"]
+
+    def hit(self, row):
+        columns = self.columns
+        return Hit(title=self.string("title", row),
+                   accession=self.string("accession", row) or None,
+                   query_cover=float(columns["query_cover"][row]),
+                   identity=float(columns["identity"][row]),
+                   evalue=float(columns["evalue"][row]),
+                   sbjct=self.string("sbjct", row),
+                   sbjct_start=int(columns["sbjct_start"][row]),
+                   sbjct_end=int(columns["sbjct_end"][row]))
+
+    def filter_hits(self, query_cover_threshold, identity_threshold, e_threshold):
+        """
+        Yields the Hit of every row passing the thresholds, in report order.
+        """
+
+        for row in numpy.flatnonzero(self.mask(query_cover_threshold, identity_threshold, e_threshold)):
+            yield self.hit(row)
+
+
+class TableCache(object):
+    """
+    In-memory LRU cache of HitTables, for long-running processes analysing the same reports again and again (see
+    service.py). for_report() is a drop-in replacement for HitTable.for_report(); a table is reused as long as its
+    report is unchanged. Safe to share between threads.
+    """
+    def __init__(self, max_tables=MAX_CACHED_TABLES):
+        self.max_tables = max_tables
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.tables)
+
+    def for_report(self, report_path, parse=parse_title):
+        key = os.path.abspath(report_path)
+        stamp = _stamp(report_path)
+        with self.lock:
+            cached = self.tables.get(key)
+            if cached is not None and cached.stamp == stamp:
+                self.tables.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        # Built outside the lock: other reports stay available meanwhile
+        table = HitTable.for_report(report_path, parse)
+        with self.lock:
+            self.tables[key] = table
+            self.tables.move_to_end(key)
+            while len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+        return table
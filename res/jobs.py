@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#
+#  jobs.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Asynchronous BLAST jobs.
+Searches are queued in a small SQLite job table and run by a single background poller: remote searches are submitted
+to NCBI and their RIDs polled on a shared schedule (every due job is checked in the same pass, each at most once per
+poll interval), local searches run one at a time on a worker thread. Submissions, status requests and report
+downloads are handed to a pool of worker threads, so a slow or unreachable NCBI, or a large report, does not hold up
+the other jobs; when NCBI cannot be reached for a submission, the job stays queued and its submission is tried again
+later, waiting longer after each failure. As RIDs and statuses are persisted, searches
+still pending when the application quits are resumed on the next start.
+Each job has its own working directory, where its "blast_results.xml" (or "blast_results.xml.gz" if the job's
+compress_reports option is set) is saved once ready. Searches already in the
+BLAST cache are ready as soon as they are queued.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from blast_backends import BLAST_URL, POLL_INTERVAL, SEARCH_LIMITS, BlastConnectionError, BlastError, make_backend
+from blast_cache import BlastCache
+from compute import COMPRESSED_REPORT_NAME, REPORT_NAME
+
+JOBS_PATH = "jobs.sqlite"
+JOBS_DIR = "jobs"
+# Seconds between two passes of the poller
+TICK = 5
+# Remote searches submitted, polled or downloaded at once
+REMOTE_WORKERS = 4
+# Seconds before submitting again a search NCBI could not be reached for, doubled after each failure up to the maximum
+SUBMIT_RETRY = 30
+MAX_SUBMIT_RETRY = 900
+
+# Job statuses
+QUEUED = "QUEUED"
+SUBMITTED = "SUBMITTED"
+RUNNING = "RUNNING"
+READY = "READY"
+FAILED = "FAILED"
+
+Job = namedtuple("Job", ["id", "name", "seq", "workdir", "options", "status", "rid", "next_poll", "message",
+                         "created"])
+
+
+class JobStore(object):
+    """
+    SQLite-backed job table. options is a dictionary of Compute keyword arguments, kept as JSON, of which only
+    local_db and num_threads matter to the search itself. A connection is opened for each call, so a store can be
+    shared by the interface and the poller thread.
+    """
+    def __init__(self, path=JOBS_PATH):
+        self.path = path
+
+        connection = self._connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs "
+                               "(id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, seq TEXT NOT NULL, "
+                               "workdir TEXT NOT NULL, options TEXT NOT NULL, status TEXT NOT NULL, rid TEXT, "
+                               "next_poll REAL NOT NULL DEFAULT 0, message TEXT NOT NULL DEFAULT '', "
+                               "created REAL NOT NULL)")
+        connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _job(row):
+        return Job(*row[:4], options=json.loads(row[4]), status=row[5], rid=row[6], next_poll=row[7],
+                   message=row[8], created=row[9])
+
+    def add(self, name, seq, jobs_dir, options):
+        """
+        Queues a new job, working in "<jobs_dir>/<job id>", and returns it.
+        """
+
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute("INSERT INTO jobs (name, seq, workdir, options, status, created) "
+                                        "VALUES (?, ?, '', ?, ?, ?)",
+                                        (name, seq, json.dumps(options), QUEUED, time.time()))
+            job_id = cursor.lastrowid
+            connection.execute("UPDATE jobs SET workdir = ? WHERE id = ?",
+                               (os.path.join(jobs_dir, str(job_id)), job_id))
+        connection.close()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        connection = self._connect()
+        row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        connection.close()
+        return None if row is None else self._job(row)
+
+    def jobs(self, *statuses):
+        """
+        Returns all jobs, or those with one of statuses, oldest first.
+        """
+
+        connection = self._connect()
+        if statuses:
+            rows = connection.execute("SELECT * FROM jobs WHERE status IN ({}) ORDER BY id"
+                                      .format(", ".join("?" * len(statuses))), statuses).fetchall()
+        else:
+            rows = connection.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        connection.close()
+        return [self._job(row) for row in rows]
+
+    def update(self, job_id, **fields):
+        """
+        Sets fields (status, rid, next_poll or message) of a job and returns it.
+        """
+
+        connection = self._connect()
+        with connection:
+            connection.execute("UPDATE jobs SET {} WHERE id = ?".format(", ".join("{} = ?".format(field)
+                                                                                 for field in fields)),
+                               list(fields.values()) + [job_id])
+        connection.close()
+        return self.get(job_id)
+
+    def remove(self, job_id):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        connection.close()
+
+
+class JobManager(object):
+    """
+    Runs the jobs of a JobStore in the background. on_update, if given, is called from the poller threads with the
+    Job every time its status changes; it must not touch Gtk widgets directly.
+    url is the BLAST URL API endpoint, which can point to a local stand-in server.
+    """
+    def __init__(self, store=None, jobs_dir=JOBS_DIR, fetcher=None, url=BLAST_URL, poll_interval=POLL_INTERVAL,
+                 tick=TICK, on_update=None, blast_cache=None):
+        self.store = store if store is not None else JobStore()
+        self.jobs_dir = jobs_dir
+        self.fetcher = fetcher
+        self.url = url
+        self.poll_interval = poll_interval
+        self.tick = tick
+        self.on_update = on_update
+        self.blast_cache = blast_cache if blast_cache is not None else BlastCache()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # BLAST+ already uses several threads per search, so local searches run one after the other
+        self._local_worker = ThreadPoolExecutor(max_workers=1)
+        self._remote_worker = ThreadPoolExecutor(max_workers=REMOTE_WORKERS)
+        # Jobs being submitted or polled, and failed submission attempts of queued jobs
+        self._busy = set()
+        self._submit_failures = {}
+        self._lock = threading.Lock()
+
+    def backend(self, job):
+        return make_backend(job.options.get("local_db", ""), job.options.get("num_threads", 1), fetcher=self.fetcher,
+                            url=self.url, poll_interval=self.poll_interval,
+                            **{name: job.options[name] for name in SEARCH_LIMITS if name in job.options})
+
+    def submit(self, name, seq, options):
+        """
+        Queues a search of seq and returns its Job. It is submitted on the poller's next pass.
+        """
+
+        job = self.store.add(name, seq, self.jobs_dir, options)
+        os.makedirs(job.workdir, exist_ok=True)
+        self._wake.set()
+        return job
+
+    def start(self):
+        """
+        Resumes pending jobs and starts the poller. Local searches interrupted by the previous exit are run again;
+        remote ones keep their RID and are polled right away.
+        """
+
+        for job in self.store.jobs(RUNNING):
+            self.store.update(job.id, status=QUEUED)
+        for job in self.store.jobs(SUBMITTED):
+            self.store.update(job.id, next_poll=0)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._local_worker.shutdown(wait=False)
+        self._remote_worker.shutdown(wait=False)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.step()
+            self._wake.wait(self.tick)
+            self._wake.clear()
+
+    def step(self):
+        """
+        One pass of the poller: submits queued jobs (those waiting to be submitted again when due) and polls every
+        remote job that is due.
+        """
+
+        now = time.time()
+        for job in self.store.jobs(QUEUED):
+            with self._lock:
+                if job.id in self._busy or job.next_poll > now:
+                    continue
+            if self.blast_cache.get(self.cache_key(job), self.report_path(job)):
+                self._update(job.id, status=READY, message="cached")
+            elif job.options.get("local_db"):
+                self._update(job.id, status=RUNNING, message="")
+                self._local_worker.submit(self._run_local, job)
+            else:
+                self._dispatch(self._submit_remote, job)
+        for job in self.store.jobs(SUBMITTED):
+            with self._lock:
+                if job.id in self._busy:
+                    continue
+            if job.next_poll <= now:
+                self._dispatch(self._poll, job)
+
+    def _dispatch(self, target, job):
+        """
+        Runs target(job) on a remote worker. The job is skipped by the poller until it is done.
+        """
+
+        with self._lock:
+            self._busy.add(job.id)
+        self._remote_worker.submit(self._run_remote, target, job)
+
+    def _run_remote(self, target, job):
+        try:
+            target(job)
+        finally:
+            with self._lock:
+                self._busy.discard(job.id)
+            self._wake.set()
+
+    def _update(self, job_id, **fields):
+        job = self.store.update(job_id, **fields)
+        if self.on_update is not None and "status" in fields:
+            self.on_update(job)
+        return job
+
+    @staticmethod
+    def report_path(job):
+        return os.path.join(job.workdir, COMPRESSED_REPORT_NAME if job.options.get("compress_reports") else REPORT_NAME)
+
+    def cache_key(self, job):
+        return BlastCache.key(self.backend(job).search_key(job.seq))
+
+    def _run_local(self, job):
+        try:
+            self.backend(job).run(job.seq, self.report_path(job))
+        except BlastError as error:
+            self._update(job.id, status=FAILED, message=str(error))
+        else:
+            self.blast_cache.put(self.cache_key(job), self.report_path(job))
+            self._update(job.id, status=READY)
+
+    def _submit_remote(self, job):
+        try:
+            rid, wait = self.backend(job).submit(job.seq)
+        except BlastConnectionError as error:
+            # Likely a network hiccup: the job stays queued and is submitted again later
+            failures = self._submit_failures.get(job.id, 0) + 1
+            self._submit_failures[job.id] = failures
+            delay = min(SUBMIT_RETRY * 2 ** (failures - 1), MAX_SUBMIT_RETRY)
+            self.store.update(job.id, next_poll=time.time() + delay,
+                              message="{}\nTrying again in {} s.".format(error, delay))
+        except BlastError as error:
+            self._submit_failures.pop(job.id, None)
+            self._update(job.id, status=FAILED, message=str(error))
+        else:
+            self._submit_failures.pop(job.id, None)
+            self._update(job.id, status=SUBMITTED, rid=rid, next_poll=time.time() + wait, message="")
+
+    def _poll(self, job):
+        backend = self.backend(job)
+        try:
+            status = backend.status(job.rid)
+            if status == "READY":
+                backend.fetch(job.rid, self.report_path(job))
+        except BlastError as error:
+            # Network hiccups are not fatal: the search goes on at NCBI, try again later
+            self.store.update(job.id, next_poll=time.time() + self.poll_interval, message=str(error))
+            return
+
+        if status == "READY":
+            self.blast_cache.put(self.cache_key(job), self.report_path(job))
+            self._update(job.id, status=READY, message="")
+        elif status == "WAITING":
+            self.store.update(job.id, next_poll=time.time() + self.poll_interval)
+        else:
+            self._update(job.id, status=FAILED, message="NCBI search {} ended with status {}.".format(job.rid, status))
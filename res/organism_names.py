@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+#  organism_names.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Organism names of BLAST hit titles.
+A single precompiled regular expression splits a title such as
+    "gi|1234|gb|CP000001.1| Escherichia coli str. K-12 substr. MG1655, complete genome"
+into genus, species and strain in one pass. Titles repeat heavily (across HSPs, reports and re-analyses), so results
+are kept in an LRU cache.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import re
+
+OrganismName = namedtuple("OrganismName", ["genus", "species", "strain"])
+
+NAME_CACHE_SIZE = 65536
+
+# Words ending the organism part of a title ("..., complete genome", "... chromosome", "... DNA"...)
+_NOISE = "complete|chromosome|genome|genomic|DNA|plasmid|whole|draft|sequence|assembly"
+
+# Matched against the description, after the last "|": matching the identifiers too would let the regex backtrack
+# into them, and take "CP1" of "gb|CP1.1| uncultured bacterium" for a genus
+REGEX_TITLE = re.compile(
+    "^\\s*"
+    # Genus, possibly flagged as Candidatus or bracketed as misclassified ("[Clostridium] difficile")
+    "(?:Candidatus\\s+)?\\[?(?P<genus>[A-Z][A-Za-z]+)\\]?"
+    # Species epithet: lower case, or "sp." for unclassified species. One-word names have none
+    "(?:\\s+(?P<species>sp\\.|[a-z][a-z0-9-]*))?"
+    # Strain: everything up to a comma or a noise word
+    "(?P<strain>.*?)"
+    # Noise, which may end with a strain name ("Clostridium difficile complete genome, strain M120")
+    "(?:(?:,|\\s+(?:{})\\b).*?(?:,\\s*(?P<late_strain>strain\\s+[^,]+?))?)?"
+    "\\s*$".format(_NOISE))
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def parse_title(title):
+    """
+    Returns the OrganismName of a BLAST hit title. Missing parts are empty strings; a title not starting with a
+    capitalised genus yields an OrganismName whose genus is the title's first word.
+    """
+
+    description = title.rpartition("|")[2]
+    match = REGEX_TITLE.match(description)
+    if match is None:
+        words = description.split(",")[0].split()
+        return OrganismName(words[0] if words else "", "", " ".join(words[1:]))
+    strain = match.group("strain").strip(" ,")
+    if match.group("late_strain") and not strain:
+        strain = match.group("late_strain")
+    return OrganismName(match.group("genus"), match.group("species") or "", strain)
+
+
+def organism_name(title):
+    """
+    Returns "Genus species strain" for a BLAST hit title, leaving out missing parts.
+    """
+
+    return " ".join(part for part in parse_title(title) if part)
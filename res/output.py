@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+#  output.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Thread-safe output buffer. Worker threads write lines to it; the interface drains it periodically and displays the
+accumulated text in one go, rather than scheduling one main loop callback per line.
+"""
+
+import threading
+
+
+class OutputBuffer(object):
+    def __init__(self):
+        self.lines = []
+        self.lock = threading.Lock()
+
+    def write(self, txt):
+        with self.lock:
+            self.lines.append(str(txt))
+
+    def drain(self):
+        """
+        Returns everything written since the last call as a single newline-terminated string, or None if nothing was.
+        """
+
+        with self.lock:
+            if not self.lines:
+                return None
+            lines, self.lines = self.lines, []
+        lines.append("")
+        return "\n".join(lines)
+
+    def discard(self):
+        with self.lock:
+            self.lines = []
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+#  profiling.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Timing of pipeline stages.
+Each stage runs in a span recording its wall time, CPU time (of the whole process, plus that of child processes such
+as ClustalOmega), the peak resident memory of the process and of its children when it ends, and the number of items it
+processed.
+Spans can be nested; they are listed in the order they started.
+The hot loop (parsing and filtering hits) can additionally run under cProfile or tracemalloc.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak memory is then not reported
+    resource = None
+
+PROFILERS = ("cprofile", "tracemalloc")
+# Allocation sites listed by tracemalloc
+TRACEMALLOC_TOP = 20
+
+
+def _cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _peak_rss():
+    """
+    Returns the peak resident set sizes (KiB on Linux) of this process and of its waited-for children so far.
+    """
+
+    if resource is None:
+        return None, None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+class Span(object):
+    """
+    Measures of one stage. items may be set by the code running in the span.
+    """
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.wall = None
+        self.cpu = None
+        self.peak_rss = None
+        self.children_peak_rss = None
+        self.items = None
+
+    def as_dict(self):
+        return {"name": self.name, "depth": self.depth, "wall": self.wall, "cpu": self.cpu, "peak_rss": self.peak_rss,
+                "children_peak_rss": self.children_peak_rss, "items": self.items}
+
+
+class Profiler(object):
+    """
+    Collects the spans of a run. hot_profile, "cprofile" or "tracemalloc", enables the matching profiler in hot()
+    blocks.
+    """
+    def __init__(self, hot_profile=None):
+        if hot_profile is not None and hot_profile not in PROFILERS:
+            raise ValueError("Unknown profiler '{}', choose among {}".format(hot_profile, ", ".join(PROFILERS)))
+        self.hot_profile = hot_profile
+        self.spans = []
+        self._lock = threading.Lock()
+        self._depth = threading.local()
+
+    @contextmanager
+    def span(self, name, items=None):
+        depth = getattr(self._depth, "value", 0)
+        span = Span(name, depth)
+        span.items = items
+        with self._lock:
+            self.spans.append(span)
+        self._depth.value = depth + 1
+        wall, cpu = time.perf_counter(), _cpu_time()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - wall
+            span.cpu = _cpu_time() - cpu
+            span.peak_rss, span.children_peak_rss = _peak_rss()
+            self._depth.value = depth
+
+    @contextmanager
+    def hot(self, path_prefix):
+        """
+        Runs a block under the profiler chosen at creation, if any. cProfile statistics are saved to
+        "<path_prefix>.prof" (to be read with pstats or snakeviz), the top allocation sites seen by tracemalloc to
+        "<path_prefix>.tracemalloc.txt".
+        """
+
+        if self.hot_profile == "cprofile":
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats("{}.prof".format(path_prefix))
+        elif self.hot_profile == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                of_ = open("{}.tracemalloc.txt".format(path_prefix), "w")
+                of_.write("Traced memory: {} KiB current, {} KiB peak\n".format(current // 1024, peak // 1024))
+                for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                    of_.write("{}\n".format(stat))
+                of_.close()
+        else:
+            yield
+
+    def lines(self):
+        """
+        Returns the spans as lines of text, for output.
+        """
+
+        lines = ["{:<28}{:>10}{:>10}{:>12}{:>10}".format("Stage", "wall (s)", "CPU (s)", "peak RSS", "items")]
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            if span.wall is None:
+                continue
+            lines.append("{:<28}{:>10.2f}{:>10.2f}{:>12}{:>10}".format(
+                "{}{}".format("  " * span.depth, span.name), span.wall, span.cpu,
+                "-" if span.peak_rss is None else "{} MiB".format(span.peak_rss // 1024),
+                "-" if span.items is None else span.items))
+        return lines
+
+    def dump(self, path):
+        """
+        Writes all spans to path as JSON. The analysis and the tree rendering thread both dump their profile: each
+        writes its own temporary file, renamed once complete, so the file is never left truncated or interleaved.
+        """
+
+        with self._lock:
+            spans = [span.as_dict() for span in self.spans]
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        of_ = open(tmp_path, "w")
+        json.dump({"spans": spans, "hot_profile": self.hot_profile}, of_, indent=2)
+        of_.close()
+        os.replace(tmp_path, path)
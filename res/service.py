@@ -0,0 +1,570 @@
+# -*- coding: utf-8 -*-
+#
+#  service.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+BLASTats as a long-running service, and its client.
+The service ("blastats-cli.py --serve") queues searches in a JobManager and analyses finished ones in a bounded pool
+of worker threads. It stays warm between jobs: modules are imported once, HTTP connections to NCBI are kept alive,
+genome counts and parsed reports (HitTables) are kept in memory, and the BLAST cache is shared. Several users, or
+several Gtk interfaces, can then share one instance.
+The API is plain JSON over HTTP:
+    GET    /status                          uptime, workers, job and analysis counts, cache statistics
+    GET    /jobs                            all jobs
+    POST   /jobs                            queues {"name", "seq", "options"}, options being Compute arguments
+                                            (CLIENT_OPTIONS)
+    GET    /jobs/<id>                       a job and the state of its analysis
+    DELETE /jobs/<id>                       forgets a job
+    POST   /jobs/<id>/analyse               analyses a finished job again, with {"options"} if given, unless it is
+                                            being analysed already
+    GET    /jobs/<id>/output?since=<line>   analysis output from line number since on
+    GET    /jobs/<id>/files/<name>          a file of the job's working directory, e.g. sequences.png
+Local databases and indexes (SERVICE_OPTIONS) are read from the service's machine, so they are set on the service's
+command line only, for every job.
+ServiceJobManager gives a client the interface of a local JobManager, so the Gtk interface only has to pick one.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import http.server
+import inspect
+import json
+import mimetypes
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from blast_cache import BlastCache
+from compute import Compute
+from genome_cache import MemoryGenomeCountCache
+from hit_table import TableCache
+from jobs import JOBS_DIR, READY, Job, JobManager
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+WORKERS = 2
+# Seconds between two refreshes of a client's job list
+CLIENT_TICK = 2
+CLIENT_TIMEOUT = 30
+# Seconds a client waits for the service to start analysing a job, then for any news of the analysis, before it stops
+# following it
+ANALYSIS_START_TIMEOUT = 60
+FOLLOW_TIMEOUT = 1800
+
+# Analysis statuses
+PENDING = "PENDING"
+ANALYSING = "ANALYSING"
+DONE = "DONE"
+ERROR = "ERROR"
+
+# Compute arguments a client may not set: they are objects, or belong to the service
+PRIVATE_OPTIONS = ("parent", "workdir", "genome_cache", "genome_fetcher", "fetcher", "blast_cache", "hit_tables",
+                   "json_summary")
+# Paths on the service's machine, only given on its command line: a client could otherwise read any file, or have
+# indexes written next to it
+SERVICE_OPTIONS = ("local_db", "assembly_summary", "taxid_index")
+CLIENT_OPTIONS = tuple(name for name in inspect.signature(Compute.__init__).parameters
+                       if name not in ("self",) + PRIVATE_OPTIONS + SERVICE_OPTIONS)
+
+
+class ServiceError(Exception):
+    """
+    Raised by the client when the service cannot be reached or rejects a request. The message is meant to be shown to
+    the user as is.
+    """
+    pass
+
+
+class Conflict(Exception):
+    """
+    Raised by AnalysisService.analyse() when a job cannot be analysed now: it is not ready, or already being analysed.
+    """
+    pass
+
+
+class Analysis(object):
+    """
+    State and output of the analysis of a job. Stands for Compute's parent, collecting what it prints.
+    """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = PENDING
+        self.lines = []
+        self.summary = None
+        self.tree = None
+        self.lock = threading.Lock()
+
+    def print_threaded(self, txt):
+        with self.lock:
+            self.lines.extend(str(txt).split("\n"))
+
+    def show_tree(self, png_path):
+        self.tree = os.path.basename(png_path)
+
+    def output(self, since=0):
+        with self.lock:
+            return self.lines[since:]
+
+    def as_dict(self):
+        return {"status": self.status, "lines": len(self.lines), "summary": self.summary, "tree": self.tree}
+
+
+class AnalysisService(object):
+    """
+    Searches jobs through a JobManager and analyses them, once their report is ready, in a pool of worker threads.
+    """
+    def __init__(self, workers=WORKERS, store=None, jobs_dir=JOBS_DIR, blast_cache=None, genome_cache=None,
+                 hit_tables=None, service_options=None):
+        self.workers = workers
+        self.service_options = {name: value for name, value in (service_options or {}).items() if value}
+        self.blast_cache = blast_cache if blast_cache is not None else BlastCache()
+        # Genome counts come from the assembly summary when one is given: there is then no cache to keep
+        if genome_cache is None and not self.service_options.get("assembly_summary"):
+            genome_cache = MemoryGenomeCountCache()
+        self.genome_cache = genome_cache
+        self.hit_tables = hit_tables if hit_tables is not None else TableCache()
+        self.job_manager = JobManager(store, jobs_dir, on_update=self.on_job_update, blast_cache=self.blast_cache)
+        self.store = self.job_manager.store
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.analyses = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def start(self):
+        self.job_manager.start()
+
+    def stop(self):
+        self.job_manager.stop()
+        self.pool.shutdown(wait=False)
+
+    def submit(self, name, seq, options):
+        """
+        Queues a search of seq. options (Compute arguments) must have been checked by check_options().
+        """
+
+        return self.job_manager.submit(name, seq, dict(options, **self.service_options))
+
+    def on_job_update(self, job):
+        if job.status == READY:
+            try:
+                self.analyse(job.id)
+            except Conflict:
+                pass
+
+    def analyse(self, job_id, options=None):
+        """
+        Queues the analysis of a finished job, with options (checked by check_options()) overriding those of the job.
+        Returns the Analysis. Raises Conflict if the job does not exist, is not ready or is being analysed: two
+        analyses of a job would write the same files of its working directory.
+        """
+
+        job = self.store.get(job_id)
+        if job is None or job.status != READY:
+            raise Conflict("Job {} is not ready ({})".format(job_id, job.status if job is not None else "removed"))
+        with self.lock:
+            running = self.analyses.get(job_id)
+            if running is not None and running.status in (PENDING, ANALYSING):
+                raise Conflict("Job {} is being analysed already".format(job_id))
+            analysis = Analysis(job_id)
+            self.analyses[job_id] = analysis
+        future = self.pool.submit(self._run, analysis, job,
+                                  dict(job.options, **dict(options or {}, **self.service_options)))
+        future.add_done_callback(lambda future: self._check_over(analysis, future))
+        return analysis
+
+    @staticmethod
+    def _check_over(analysis, future):
+        # A worker that died, or an analysis cancelled before it started, must not be left pending for ever
+        if analysis.status in (PENDING, ANALYSING):
+            error = None if future.cancelled() else future.exception()
+            analysis.print_threaded("\nError:\nThe analysis was interrupted{}\n"
+                                    .format(": {}".format(error) if error is not None else "."))
+            analysis.status = ERROR
+
+    def _run(self, analysis, job, options):
+        analysis.status = ANALYSING
+        try:
+            compute = Compute(analysis, workdir=job.workdir, genome_cache=self.genome_cache,
+                              blast_cache=self.blast_cache, hit_tables=self.hit_tables, json_summary=True, **options)
+            analysis.summary = compute.analyse()
+            if compute.render_thread is not None:
+                compute.render_thread.join()
+        except Exception as error:
+            analysis.print_threaded("\nError:\n{}\n".format(error))
+            analysis.status = ERROR
+        else:
+            analysis.status = DONE if analysis.summary is not None else ERROR
+
+    def job_dict(self, job):
+        with self.lock:
+            analysis = self.analyses.get(job.id)
+        return dict(job._asdict(), analysis=analysis.as_dict() if analysis is not None else None)
+
+    def remove(self, job_id):
+        self.store.remove(job_id)
+        with self.lock:
+            self.analyses.pop(job_id, None)
+
+    def status(self):
+        jobs = {}
+        for job in self.store.jobs():
+            jobs[job.status] = jobs.get(job.status, 0) + 1
+        analyses = {}
+        with self.lock:
+            for analysis in self.analyses.values():
+                analyses[analysis.status] = analyses.get(analysis.status, 0) + 1
+        return {"uptime": time.time() - self.started, "workers": self.workers, "jobs": jobs, "analyses": analyses,
+                "caches": {"blast": {"hits": self.blast_cache.hits, "misses": self.blast_cache.misses},
+                           "genomes": {"hits": self.genome_cache.hits, "misses": self.genome_cache.misses,
+                                       "entries": len(self.genome_cache)} if self.genome_cache is not None else None,
+                           "tables": {"hits": self.hit_tables.hits, "misses": self.hit_tables.misses,
+                                      "entries": len(self.hit_tables)}}}
+
+
+def check_options(options):
+    """
+    Returns options if they are Compute arguments a client may set (CLIENT_OPTIONS), raises ValueError otherwise, so
+    bad options are rejected when sent rather than once the search is over.
+    """
+
+    if not isinstance(options, dict):
+        raise ValueError("Options must be a JSON object")
+    unknown = sorted(name for name in options if name not in CLIENT_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown or forbidden options: {}".format(", ".join(unknown)))
+    return options
+
+
+def client_options(options):
+    """
+    Returns options without those a client may not send, such as the paths set on the service's command line.
+    """
+
+    return {name: value for name, value in options.items() if name in CLIENT_OPTIONS}
+
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Routes requests to the server's AnalysisService.
+    """
+    server_version = "BLASTats"
+
+    def log_message(self, format_, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format_, *args)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _route(self, method):
+        service = self.server.service
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            body = self._body() if method == "POST" else {}
+            if parts == ["status"] and method == "GET":
+                return self._send_json(200, service.status())
+            if parts == ["jobs"] and method == "GET":
+                return self._send_json(200, [service.job_dict(job) for job in service.store.jobs()])
+            if parts == ["jobs"] and method == "POST":
+                if not body.get("seq") or not isinstance(body["seq"], str):
+                    return self._send_json(400, {"error": "No sequence given"})
+                options = check_options(body.get("options", {}))
+                if not options.get("organisms") or not isinstance(options["organisms"], list):
+                    return self._send_json(400, {"error": "No organisms of interest given"})
+                job = service.submit(str(body.get("name") or body["seq"][:20]), body["seq"], options)
+                return self._send_json(201, service.job_dict(job))
+
+            if len(parts) < 2 or parts[0] != "jobs":
+                return self._send_json(404, {"error": "Unknown request"})
+            job = service.store.get(int(parts[1]))
+            if job is None:
+                return self._send_json(404, {"error": "No such job"})
+            if len(parts) == 2 and method == "GET":
+                return self._send_json(200, service.job_dict(job))
+            if len(parts) == 2 and method == "DELETE":
+                service.remove(job.id)
+                return self._send_json(200, {"removed": job.id})
+            if parts[2:] == ["analyse"] and method == "POST":
+                try:
+                    service.analyse(job.id, check_options(body.get("options") or {}))
+                except Conflict as error:
+                    return self._send_json(409, {"error": str(error)})
+                return self._send_json(202, service.job_dict(job))
+            if parts[2:] == ["output"] and method == "GET":
+                with service.lock:
+                    analysis = service.analyses.get(job.id)
+                since = int(query.get("since", ["0"])[0])
+                return self._send_json(200, {"lines": analysis.output(since) if analysis is not None else [],
+                                             "analysis": analysis.as_dict() if analysis is not None else None})
+            if len(parts) == 4 and parts[2] == "files" and method == "GET":
+                return self._send_file(job.workdir, parts[3])
+            return self._send_json(404, {"error": "Unknown request"})
+        except ValueError as error:
+            return self._send_json(400, {"error": str(error)})
+        except Exception as error:
+            self.log_error("%s failed: %r", self.path, error)
+            return self._send_json(500, {"error": "Internal error: {}".format(error)})
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length).decode())
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def _send_json(self, status, obj):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, workdir, name):
+        name = urllib.parse.unquote(name)
+        # Only plain file names: nothing outside the job's working directory is served
+        path = os.path.join(workdir, name)
+        if name != os.path.basename(name) or name.startswith(".") or not os.path.isfile(path):
+            return self._send_json(404, {"error": "No such file"})
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        fhandle = open(path, "rb")
+        try:
+            while True:
+                chunk = fhandle.read(256 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+        finally:
+            fhandle.close()
+
+
+def serve(host=SERVICE_HOST, port=SERVICE_PORT, workers=WORKERS, verbose=False, service=None, service_options=None):
+    """
+    Runs the service until interrupted. service_options (SERVICE_OPTIONS, such as local_db) apply to every job.
+    """
+
+    service = service if service is not None else AnalysisService(workers, service_options=service_options)
+    server = http.server.ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    service.start()
+    print("BLASTats service listening on http://{}:{}/ with {} workers".format(host, server.server_port, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+class ServiceClient(object):
+    """
+    Blocking client of the service API.
+    """
+    def __init__(self, url, timeout=CLIENT_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, raw=False):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request("{}{}".format(self.url, path), data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+            try:
+                content = response.read()
+            finally:
+                response.close()
+        except urllib.error.HTTPError as error:
+            try:
+                message = json.loads(error.read().decode())["error"]
+            except (ValueError, KeyError):
+                message = "HTTP {}".format(error.code)
+            raise ServiceError(message)
+        except OSError as error:
+            raise ServiceError("Could not reach the BLASTats service at {}: {}".format(self.url, error))
+        return content if raw else json.loads(content.decode())
+
+    def status(self):
+        return self.request("GET", "/status")
+
+    def jobs(self):
+        return self.request("GET", "/jobs")
+
+    def job(self, job_id):
+        return self.request("GET", "/jobs/{}".format(job_id))
+
+    def submit(self, name, seq, options):
+        return self.request("POST", "/jobs", {"name": name, "seq": seq, "options": options})
+
+    def remove(self, job_id):
+        return self.request("DELETE", "/jobs/{}".format(job_id))
+
+    def analyse(self, job_id, options=None):
+        return self.request("POST", "/jobs/{}/analyse".format(job_id), {"options": options or {}})
+
+    def output(self, job_id, since=0):
+        return self.request("GET", "/jobs/{}/output?since={}".format(job_id, since))
+
+    def fetch_file(self, job_id, name, out_path):
+        content = self.request("GET", "/jobs/{}/files/{}".format(job_id, urllib.parse.quote(name)), raw=True)
+        of_ = open(out_path, "wb")
+        of_.write(content)
+        of_.close()
+
+
+def _job(job_dict):
+    return Job(**{field: job_dict[field] for field in Job._fields})
+
+
+class ServiceJobManager(object):
+    """
+    Client-side stand-in for JobManager: jobs are searched and analysed by the service, this object only mirrors
+    them. It is its own store (jobs(), get(), remove()), calls on_update from its polling thread when a job changes
+    status, and forwards analysis output to a parent with print_threaded() and show_tree().
+    """
+    def __init__(self, url, on_update=None, tick=CLIENT_TICK, files_dir=None):
+        self.client = ServiceClient(url)
+        self.on_update = on_update
+        self.tick = tick
+        self.files_dir = files_dir if files_dir is not None else os.path.join(JOBS_DIR, "service")
+        self.store = self
+        self.statuses = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def jobs(self, *statuses):
+        try:
+            jobs = [_job(job) for job in self.client.jobs()]
+        except ServiceError:
+            return []
+        return [job for job in jobs if not statuses or job.status in statuses]
+
+    def get(self, job_id):
+        try:
+            return _job(self.client.job(job_id))
+        except ServiceError:
+            return None
+
+    def remove(self, job_id):
+        try:
+            self.client.remove(job_id)
+        except ServiceError:
+            # Already gone, or the service is down: the job shows up again on next start if it still exists
+            pass
+        self.statuses.pop(job_id, None)
+
+    def submit(self, name, seq, options):
+        # Local databases and indexes are those set on the service's command line
+        job = _job(self.client.submit(name, seq, client_options(options)))
+        self.statuses[job.id] = job.status
+        return job
+
+    def start(self):
+        for job in self.jobs():
+            self.statuses[job.id] = job.status
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.tick):
+            for job in self.jobs():
+                if self.statuses.get(job.id) != job.status:
+                    self.statuses[job.id] = job.status
+                    if self.on_update is not None:
+                        self.on_update(job)
+
+    def follow(self, job_id, parent):
+        """
+        Forwards the output of the service's analysis of job_id to parent, in a thread, until it is over. The tree, if
+        one was rendered, is then downloaded and handed to parent.show_tree().
+        """
+
+        threading.Thread(target=self._follow, args=(job_id, parent), daemon=True).start()
+
+    def analyse(self, job_id, parent, options=None):
+        """
+        Has the service analyse job_id again and forwards the output to parent, like follow().
+        """
+
+        try:
+            self.client.analyse(job_id, client_options(options or {}))
+        except ServiceError as error:
+            parent.print_threaded("Error:\n{}".format(error))
+            return
+        self.follow(job_id, parent)
+
+    def _follow(self, job_id, parent):
+        since = 0
+        analysis = None
+        status = None
+        last_news = time.time()
+        while not self._stop.is_set():
+            try:
+                reply = self.client.output(job_id, since)
+            except ServiceError as error:
+                parent.print_threaded("Error:\n{}".format(error))
+                return
+            for line in reply["lines"]:
+                parent.print_threaded(line)
+            since += len(reply["lines"])
+            analysis = reply["analysis"]
+            if analysis is not None and analysis["status"] in (DONE, ERROR) and since >= analysis["lines"]:
+                break
+
+            if reply["lines"] or (analysis is not None and analysis["status"] != status):
+                last_news = time.time()
+                status = analysis["status"] if analysis is not None else None
+            timeout = ANALYSIS_START_TIMEOUT if analysis is None else FOLLOW_TIMEOUT
+            if time.time() - last_news > timeout:
+                parent.print_threaded("Error:\nNo news of the analysis of job {} from the service for {} s, stopped "
+                                      "following it.".format(job_id, timeout))
+                return
+            self._stop.wait(self.tick / 2)
+
+        if analysis is not None and analysis["tree"] and hasattr(parent, "show_tree"):
+            out_dir = os.path.join(self.files_dir, str(job_id))
+            os.makedirs(out_dir, exist_ok=True)
+            png_path = os.path.join(out_dir, analysis["tree"])
+            try:
+                self.client.fetch_file(job_id, analysis["tree"], png_path)
+            except ServiceError as error:
+                parent.print_threaded("Error:\nCould not download the tree: {}".format(error))
+            else:
+                parent.show_tree(png_path)
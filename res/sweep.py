@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+#  sweep.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Threshold sweeps: species hit counts for every (identity, coverage, e-value) threshold combination in one pass.
+Each hit is placed in the grid cell of the strictest thresholds it still passes (found by bisection in the sorted
+threshold lists), then cumulative sums over the three axes give, for every grid point, the number of hits passing it.
+This costs O(hits * log(thresholds) + species * grid size) instead of one filtering pass per grid point.
+"""
+
+from bisect import bisect_left, bisect_right
+
+
+def parse_range(text, scale=1.):
+    """
+    Parses "start:stop:step" (stop included) or a comma-separated list of values, every value being divided by scale.
+    """
+
+    if ":" in text:
+        start, stop, step = (float(value) for value in text.split(":"))
+        if step <= 0:
+            raise ValueError("Range step must be positive: '{}'".format(text))
+        values = []
+        value = start
+        # Tolerance for float steps such as 0.1
+        while value <= stop + step * 1e-9:
+            values.append(round(value, 10) / scale)
+            value += step
+        return values
+    return [float(value) / scale for value in text.split(",") if value.strip()]
+
+
+def hit_counts(rows, species, identity_thresholds, cover_thresholds, e_thresholds):
+    """
+    Returns {species: counts}, counts[i][j][k] being the number of hits of that species with an identity above
+    identity_thresholds[i], a query cover above cover_thresholds[j] and an e-value below e_thresholds[k], the same
+    strict comparisons as Compute.analyse(). Thresholds must be sorted in ascending order.
+    rows is an iterable of (species, query_cover, identity, evalue, has_stop) tuples; rows whose species is not in
+    species, or whose subject contains a stop codon, are ignored. The key "Total" counts hits of all species.
+    """
+
+    n_identity, n_cover, n_e = len(identity_thresholds), len(cover_thresholds), len(e_thresholds)
+    keys = list(species) + ["Total"]
+    cells = {key: [[[0] * (n_e + 1) for j in range(n_cover + 1)] for i in range(n_identity + 1)] for key in keys}
+
+    for specie, query_cover, identity, evalue, has_stop in rows:
+        if has_stop:
+            continue
+        # Number of thresholds passed on each axis
+        i = bisect_left(identity_thresholds, identity)
+        j = bisect_left(cover_thresholds, query_cover)
+        # Passed e-value thresholds are the ones from index k on
+        k = bisect_right(e_thresholds, evalue)
+        cells["Total"][i][j][k] += 1
+        if specie in cells:
+            cells[specie][i][j][k] += 1
+
+    counts = {}
+    for key in keys:
+        cell = cells[key]
+        # A hit in cell (a, b, c) passes grid point (i, j, k) when a > i, b > j and c <= k: suffix sums over the
+        # first two axes, prefix sum over the last one
+        for a in range(n_identity - 1, -1, -1):
+            for b in range(n_cover + 1):
+                for c in range(n_e + 1):
+                    cell[a][b][c] += cell[a + 1][b][c]
+        for a in range(n_identity + 1):
+            for b in range(n_cover - 1, -1, -1):
+                for c in range(n_e + 1):
+                    cell[a][b][c] += cell[a][b + 1][c]
+        for a in range(n_identity + 1):
+            for b in range(n_cover + 1):
+                for c in range(1, n_e + 1):
+                    cell[a][b][c] += cell[a][b][c - 1]
+        counts[key] = [[[cell[i + 1][j + 1][k] for k in range(n_e)] for j in range(n_cover)]
+                       for i in range(n_identity)]
+    return counts
+
+
+def write_tsv(path, counts, genomes, identity_thresholds, cover_thresholds, e_thresholds):
+    """
+    Writes one line per grid point: the three thresholds, the total number of hits, then the abundance
+    (hits / genomes) of every species of genomes, a {species: genomes quantity} dictionary.
+    """
+
+    species = sorted(genomes)
+    of_ = open(path, "w")
+    of_.write("\t".join(["identity", "query_cover", "evalue", "total"] + species) + "\n")
+    for i, identity in enumerate(identity_thresholds):
+        for j, query_cover in enumerate(cover_thresholds):
+            for k, evalue in enumerate(e_thresholds):
+                fields = [str(identity), str(query_cover), str(evalue), str(counts["Total"][i][j][k])]
+                fields.extend("{:.4f}".format(counts[specie][i][j][k] / genomes[specie]) for specie in species)
+                of_.write("\t".join(fields) + "\n")
+    of_.close()
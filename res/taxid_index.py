@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+#
+#  taxid_index.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Classification of BLAST hits by taxonomy instead of title.
+NCBI's accession2taxid dumps (ftp.ncbi.nlm.nih.gov/pub/taxonomy/accession2taxid/, hundreds of millions of lines) are
+converted once into a file of fixed-width (accession, taxid) records sorted by accession. The file is memory-mapped
+and searched by bisection, so opening it takes no time whatever its size, and only the few pages a lookup touches are
+ever read into memory.
+With NCBI's taxonomy (nodes.dmp and names.dmp from taxdump), taxids are also resolved to the species they belong to,
+in a small SQLite table saved next to the index as "<index>.taxonomy.sqlite". Hits can then be grouped by species
+taxid, whatever their title says.
+Build an index with:
+    python res/taxid_index.py INDEX nucl_gb.accession2taxid.gz [...] --taxdump TAXDUMP_DIRECTORY
+"""
+
+import argparse
+import gzip
+import heapq
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+
+MAGIC = b"BLTAXID1"
+# Magic, key width and number of records
+HEADER = struct.Struct("<8sIQ")
+# Versionless accessions, up to 20 characters ("NZ_JAAAAA010000001" is 18)
+KEY_WIDTH = 20
+# Records sorted in memory at once while building (24 bytes each)
+CHUNK_RECORDS = 5000000
+TAXONOMY_SUFFIX = ".taxonomy.sqlite"
+
+
+def accession_key(accession, key_width=KEY_WIDTH):
+    """
+    Returns the record key of accession: upper case, without version, null-padded to key_width bytes. Returns None if
+    the accession is too long to be indexed.
+    """
+
+    key = accession.split(".")[0].strip().upper().encode("ascii", "replace")
+    if len(key) > key_width:
+        return None
+    return key.ljust(key_width, b"\0")
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+class TaxidIndex(object):
+    """
+    Read-only accession -> taxid index, memory-mapped from a file written by build().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fhandle = open(path, "rb")
+        try:
+            header = self.fhandle.read(HEADER.size)
+            if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+                raise ValueError("{} is not a taxid index".format(path))
+            magic, self.key_width, self.nb_records = HEADER.unpack(header)
+            if not 0 < self.key_width <= 255:
+                raise ValueError("{} is not a taxid index".format(path))
+            self.record = struct.Struct("<{}sI".format(self.key_width))
+            # An index cut short (by a full disk, an interrupted copy...) would be searched past its end
+            if os.fstat(self.fhandle.fileno()).st_size != HEADER.size + self.nb_records * self.record.size:
+                raise ValueError("{} is truncated or corrupted, please build it again".format(path))
+            self.map = mmap.mmap(self.fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.fhandle.close()
+            raise
+        taxonomy_path = path + TAXONOMY_SUFFIX
+        self.taxonomy = Taxonomy(taxonomy_path) if os.path.exists(taxonomy_path) else None
+
+    def __len__(self):
+        return self.nb_records
+
+    def close(self):
+        self.map.close()
+        self.fhandle.close()
+
+    def taxid(self, accession):
+        """
+        Returns the taxid of accession (with or without version), or None if it is not in the index.
+        """
+
+        if not accession:
+            return None
+        key = accession_key(accession, self.key_width)
+        if key is None:
+            return None
+
+        data = self.map
+        size = self.record.size
+        low, high = 0, self.nb_records
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * size
+            if data[offset:offset + self.key_width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        offset = HEADER.size + low * size
+        if low < self.nb_records and data[offset:offset + self.key_width] == key:
+            return self.record.unpack_from(data, offset)[1]
+        return None
+
+    @classmethod
+    def build(cls, path, sources, taxdump=None, chunk_records=CHUNK_RECORDS):
+        """
+        Writes the index of sources (accession2taxid files, plain or gzip-compressed) to path, and the taxonomy of
+        taxdump (a directory holding nodes.dmp and names.dmp) next to it if given. Accessions are sorted by chunks of
+        chunk_records in memory, the sorted runs being then merged from disk, so memory use does not grow with the
+        number of accessions. Returns the number of indexed accessions.
+        """
+
+        record = struct.Struct("<{}sI".format(KEY_WIDTH))
+        directory = os.path.dirname(os.path.abspath(path))
+        runs = []
+        try:
+            chunk = []
+            for source in sources:
+                fhandle = _open_text(source)
+                for line in fhandle:
+                    fields = line.split("\t")
+                    # Header line ("accession\taccession.version\ttaxid\tgi"), and truncated lines
+                    if len(fields) < 3 or not fields[2].strip().isdigit():
+                        continue
+                    key = accession_key(fields[0])
+                    if key is not None:
+                        chunk.append(record.pack(key, int(fields[2])))
+                    if len(chunk) >= chunk_records:
+                        runs.append(_write_run(chunk, directory))
+                        chunk = []
+                fhandle.close()
+            if chunk or not runs:
+                runs.append(_write_run(chunk, directory))
+            del chunk
+
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            of_ = open(tmp_path, "wb")
+            of_.write(HEADER.pack(MAGIC, KEY_WIDTH, 0))
+            nb_records = 0
+            previous = None
+            run_files = [open(run, "rb") for run in runs]
+            try:
+                for data in heapq.merge(*[_iter_records(run_file, record.size) for run_file in run_files]):
+                    key = data[:KEY_WIDTH]
+                    # An accession listed twice (in two dumps) keeps a single taxid
+                    if key != previous:
+                        of_.write(data)
+                        nb_records += 1
+                        previous = key
+            finally:
+                for run_file in run_files:
+                    run_file.close()
+            of_.seek(0)
+            of_.write(HEADER.pack(MAGIC, KEY_WIDTH, nb_records))
+            of_.close()
+            os.replace(tmp_path, path)
+        finally:
+            for run in runs:
+                os.remove(run)
+
+        if taxdump is not None:
+            Taxonomy.build(path + TAXONOMY_SUFFIX, os.path.join(taxdump, "nodes.dmp"),
+                           os.path.join(taxdump, "names.dmp"))
+        return nb_records
+
+
+def _write_run(chunk, directory):
+    chunk.sort()
+    fd, run = tempfile.mkstemp(prefix="taxid-run-", dir=directory)
+    of_ = os.fdopen(fd, "wb")
+    of_.write(b"".join(chunk))
+    of_.close()
+    return run
+
+
+def _iter_records(fhandle, size, batch=65536):
+    while True:
+        data = fhandle.read(size * batch)
+        if not data:
+            return
+        for offset in range(0, len(data), size):
+            yield data[offset:offset + size]
+
+
+class Taxonomy(object):
+    """
+    SQLite table of the species each taxid belongs to, and of the taxids of species scientific names.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.species_cache = {}
+
+    def species(self, taxid):
+        """
+        Returns the taxid of the species taxid belongs to (taxid itself for a species), or None for taxa above the
+        species rank and unknown taxids.
+        """
+
+        if taxid not in self.species_cache:
+            row = self.connection.execute("SELECT species FROM taxa WHERE taxid = ?", (taxid,)).fetchone()
+            self.species_cache[taxid] = None if row is None else row[0]
+        return self.species_cache[taxid]
+
+    def species_taxid(self, name):
+        """
+        Returns the taxid of the species whose scientific name is name ("Genus species"), or None.
+        """
+
+        row = self.connection.execute("SELECT taxid FROM species_names WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def build(path, nodes_path, names_path):
+        """
+        Writes the taxonomy of nodes_path and names_path (NCBI's nodes.dmp and names.dmp) to path.
+        """
+
+        parents = {}
+        ranks = {}
+        fhandle = open(nodes_path, encoding="utf-8")
+        for line in fhandle:
+            fields = line.rstrip("\t|\n").split("\t|\t", 3)
+            parents[int(fields[0])] = int(fields[1])
+            ranks[int(fields[0])] = fields[2].rstrip("\t|\n")
+        fhandle.close()
+
+        species = {}
+        for taxid in parents:
+            # Walk up to the species, remembering the answer for every taxon on the way
+            lineage = []
+            node = taxid
+            while node not in species and ranks.get(node) != "species" and parents.get(node, node) != node:
+                lineage.append(node)
+                node = parents[node]
+            if node in species:
+                found = species[node]
+            else:
+                found = node if ranks.get(node) == "species" else None
+                species[node] = found
+            for node in lineage:
+                species[node] = found
+
+        names = []
+        fhandle = open(names_path, encoding="utf-8")
+        for line in fhandle:
+            fields = line.rstrip("\t|\n").split("\t|\t")
+            if fields[3] == "scientific name" and ranks.get(int(fields[0])) == "species":
+                names.append((fields[1], int(fields[0])))
+        fhandle.close()
+
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        connection = sqlite3.connect(tmp_path)
+        with connection:
+            connection.execute("CREATE TABLE taxa (taxid INTEGER PRIMARY KEY, species INTEGER NOT NULL)")
+            connection.execute("CREATE TABLE species_names (name TEXT PRIMARY KEY, taxid INTEGER NOT NULL) "
+                               "WITHOUT ROWID")
+            connection.executemany("INSERT INTO taxa (taxid, species) VALUES (?, ?)",
+                                   [(taxid, found) for taxid, found in species.items() if found is not None])
+            connection.executemany("INSERT OR IGNORE INTO species_names (name, taxid) VALUES (?, ?)", names)
+        connection.close()
+        os.replace(tmp_path, path)
+
+
+class TaxidClassifier(object):
+    """
+    Assigns hits to organisms of interest ("Genus+species") by the species taxid of their accession.
+    """
+    def __init__(self, index, organisms):
+        self.index = index
+        self.interest = {}
+        self.missing = []
+        for organism in organisms:
+            genus, species = organism.split("+")
+            taxid = index.taxonomy.species_taxid("{} {}".format(genus.capitalize(), species))
+            if taxid is None:
+                self.missing.append(organism)
+            else:
+                self.interest[taxid] = (genus.capitalize(), species)
+
+    def classify(self, accession, genus, species):
+        """
+        Returns the (genus, species) of interest accession belongs to, (None, None) if it belongs to another species,
+        or (genus, species), as parsed from the hit's title, if the index does not know it.
+        """
+
+        taxid = self.index.taxid(accession)
+        species_taxid = self.index.taxonomy.species(taxid) if taxid is not None else None
+        if species_taxid is None:
+            return genus, species
+        return self.interest.get(species_taxid, (None, None))
+
+    def close(self):
+        self.index.taxonomy.close()
+        self.index.close()
+
+
+def open_classifier(path, organisms):
+    """
+    Returns the TaxidClassifier of the index at path for organisms ("Genus+species"). Raises ValueError, with a message
+    meant for the user, if the index or its taxonomy cannot be used.
+    """
+
+    try:
+        index = TaxidIndex(path)
+    except (OSError, ValueError) as error:
+        raise ValueError("Could not open taxid index {}: {}".format(path, error))
+    if index.taxonomy is None:
+        index.close()
+        raise ValueError("Taxid index {} has no taxonomy (see taxid_index.py)".format(path))
+    try:
+        return TaxidClassifier(index, organisms)
+    except sqlite3.Error as error:
+        index.taxonomy.close()
+        index.close()
+        raise ValueError("Could not read the taxonomy of taxid index {}: {}".format(path, error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the accession -> taxid index used to classify BLAST hits.")
+    parser.add_argument("index", help="index file to write")
+    parser.add_argument("sources", nargs="+", help="accession2taxid files (plain or gzip-compressed)")
+    parser.add_argument("--taxdump", help="directory holding NCBI's nodes.dmp and names.dmp, to group hits by species")
+    parser.add_argument("--chunk-records", type=int, default=CHUNK_RECORDS,
+                        help="accessions sorted in memory at once (default: {})".format(CHUNK_RECORDS))
+    args = parser.parse_args()
+    nb_records = TaxidIndex.build(args.index, args.sources, args.taxdump, args.chunk_records)
+    print("{} accessions indexed in {}".format(nb_records, args.index))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+#  tree_render.py
+#
+#  Copyright 2013-2014 Sébastien Gélis-Jeanvoine <sebastien@gelis.ch>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+In-process rendering of the FastTree tree, replacing the former Python 2/ETE2 tree_view.py script.
+The tree is midpoint-rooted, ladderized, saved back as Newick and drawn to PNG and SVG files, leaves of species of
+interest being highlighted and collapsed clusters (see dereplicate.py) showing their size. Drawing uses Bio.Phylo
+with Matplotlib's Agg canvas, so it needs no display and is safe to run from a worker thread. The ETE toolkit (ete3)
+can be used instead when installed.
+"""
+
+RENDER_BACKENDS = ("phylo", "ete")
+RENDER_FORMATS = ("png", "svg")
+INTEREST_COLOR = "#c0392b"
+# Figure size: width, and height per leaf (inches)
+FIGURE_WIDTH = 12
+LEAF_HEIGHT = 0.22
+
+
+def leaf_label(name):
+    """
+    Returns the displayed label of a leaf: "Escherichia_coli_K-12__x37" becomes "Escherichia coli K-12 (x37)".
+    """
+
+    if name is None:
+        return None
+    name, separator, size = name.partition("__x")
+    label = name.replace("_", " ")
+    return "{} (x{})".format(label, size) if separator else label
+
+
+def of_interest(label, organisms):
+    """
+    Tells whether a leaf label belongs to one of organisms ("Genus+species").
+    """
+
+    return any(label == organism.replace("+", " ") or label.startswith("{} ".format(organism.replace("+", " ")))
+               for organism in organisms)
+
+
+def render_tree(tree_path, out_prefix, organisms=(), formats=RENDER_FORMATS, backend="phylo"):
+    """
+    Renders the Newick tree at tree_path to "<out_prefix>.nwk" and "<out_prefix>.<format>" for each of formats.
+    Returns the list of written files.
+    """
+
+    from Bio import Phylo
+
+    tree = Phylo.read(tree_path, "newick")
+    if len(tree.get_terminals()) > 2:
+        tree.root_at_midpoint()
+    tree.ladderize()
+    written = ["{}.nwk".format(out_prefix)]
+    Phylo.write(tree, written[0], "newick")
+
+    if backend == "ete":
+        written.extend(_render_ete(written[0], out_prefix, organisms, formats))
+    else:
+        written.extend(_render_phylo(tree, out_prefix, organisms, formats))
+    return written
+
+
+def _render_phylo(tree, out_prefix, organisms, formats):
+    # Figure and canvas are created directly instead of through pyplot, which is neither thread-safe nor headless
+    # by default
+    from Bio import Phylo
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    nb_leaves = len(tree.get_terminals())
+    figure = Figure(figsize=(FIGURE_WIDTH, max(4, LEAF_HEIGHT * nb_leaves)))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+
+    def label(clade):
+        return leaf_label(clade.name) if clade.is_terminal() else None
+
+    def color(text):
+        return INTEREST_COLOR if of_interest(text, organisms) else "black"
+
+    Phylo.draw(tree, label_func=label, label_colors=color, do_show=False, axes=axes)
+    axes.set_ylabel("")
+    for side in ("top", "right", "left"):
+        axes.spines[side].set_visible(False)
+    axes.set_yticks([])
+    figure.tight_layout()
+
+    written = []
+    for format_ in formats:
+        path = "{}.{}".format(out_prefix, format_)
+        figure.savefig(path, format=format_)
+        written.append(path)
+    return written
+
+
+def _render_ete(newick_path, out_prefix, organisms, formats):
+    from ete3 import Tree, TreeStyle, TextFace
+
+    tree = Tree(newick_path)
+    tree_style = TreeStyle()
+    tree_style.show_leaf_name = False
+    tree_style.show_branch_length = True
+    tree_style.show_branch_support = True
+    for leaf in tree.iter_leaves():
+        text = leaf_label(leaf.name)
+        leaf.add_face(TextFace(text, fgcolor=INTEREST_COLOR if of_interest(text, organisms) else "black"), column=0)
+
+    written = []
+    for format_ in formats:
+        path = "{}.{}".format(out_prefix, format_)
+        tree.render(path, tree_style=tree_style)
+        written.append(path)
+    return written